@@ -0,0 +1,846 @@
+# bench_dashboard.py — mediciones de la ruta de datos del dashboard (sin ventana: Agg + Tk simulado)
+#   python bench_dashboard.py                       → 10k / 100k / 1M lecturas, guarda y compara
+#   python bench_dashboard.py --n 100000 --solo db consolidate
+#   python bench_dashboard.py --estricto            → código 1 si algo empeora más que --umbral
+# Los resultados se acumulan en bench_resultados.jsonl (una línea por medición, con el commit) y cada
+# corrida se compara con la última medición de otro commit para el mismo (bench, n).
+import argparse, http.server, json, os, platform, struct, subprocess, sys, tempfile, threading, time, traceback, warnings
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import dashboard_meteo as dm
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RESULTADOS = os.path.join(AQUI, "bench_resultados.jsonl")
+
+# ---------------- Datos sintéticos ----------------
+def serie_sintetica(n, n_picos=12, seed=7):
+    """n minutos de 4 métricas con ruido, huecos (NaN) y picos aislados en calidadAire (excursiones MQ-8).
+    Los picos quedan separados al menos n/(n_picos+1) puntos."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n, dtype=np.float64) * 60.0
+    dia = np.sin(t / 86400.0 * 2 * np.pi)
+    pres = 1013 + 2 * dia + rng.normal(0, 0.2, n)
+    Y = np.vstack([
+        20 + 6 * dia + rng.normal(0, 0.3, n),        # temperatura
+        pres,                                        # presión
+        44330 * (1 - (pres / 1013.25) ** 0.1903),    # altitud (derivada de la presión, como el BMP)
+        90 + rng.normal(0, 1.0, n),                  # calidadAire
+    ])
+    picos = np.linspace(0, n - 1, n_picos + 2)[1:-1].astype(np.int64)
+    huecos = np.setdiff1d(rng.choice(n, n // 100, replace=False), picos)
+    Y[:, huecos] = np.nan
+    Y[3, picos] = rng.choice([5.0, 15.0, 160.0], n_picos)
+    return t, Y, picos
+
+SENSORES = (("DHT11", "Temperatura", "°C"), ("BMP280", "Presión", "hPa"),
+            ("BMP280", "Altitud", "m"), ("MQ8", "Calidad del aire", "%"))
+
+def payload_sintetico(n, estaciones=3, seed=7, t0=1_700_000_000):
+    """n lecturas crudas como las entrega el servidor: 4 sensores por minuto y estación, ts con milisegundos y Z."""
+    rng = np.random.default_rng(seed)
+    vals = rng.normal(50, 10, n).round(2).tolist()
+    por_min = 4 * estaciones
+    ts = [datetime.fromtimestamp(t0 + m * 60, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+          for m in range(n // por_min + 1)]
+    nombres = [f"Estación {e + 1}" for e in range(estaciones)]
+    out = []
+    for i in range(n):
+        minuto, resto = divmod(i, por_min); e, k = divmod(resto, 4)
+        sensor, tipo, unidad = SENSORES[k]
+        out.append({"lecturaId": i, "valor": vals[i], "timestamp": ts[minuto], "sensorNombre": sensor, "tipoSensor": tipo,
+                    "unidadMedicion": unidad, "estacionNombre": nombres[e], "estacionUbicacion": "UMES"})
+    return out
+
+# ---------------- Utilidades ----------------
+def medir(fn, repeat=5, setup=None):
+    """Mejor y mediana de `repeat` ejecuciones, en ms; `setup` corre antes de cada una y no se mide."""
+    ts = []
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter(); fn(); ts.append((time.perf_counter() - t0) * 1000.0)
+    ts.sort()
+    return ts[0], ts[len(ts) // 2]
+
+MEDICIONES = []
+
+def informe(nombre, n, best, med):
+    MEDICIONES.append({"bench": nombre, "n": n, "min_ms": round(best, 3), "mediana_ms": round(med, 3)})
+    print(f"{nombre:<34} n={n:>9,}  min {best:9.2f} ms  mediana {med:9.2f} ms")
+
+def repeticiones(n):
+    return 5 if n <= 100_000 else 2
+
+def db_temporal(nombre, iniciar=True):
+    """Apunta el dashboard a una base vacía en el directorio temporal (db_conn reabre al cambiar DB_FILE).
+    iniciar=False: sin db_init ni archivo, para armar antes una base con un esquema anterior."""
+    path = os.path.join(tempfile.gettempdir(), f"bench_{os.getpid()}_{nombre}.db")
+    if getattr(dm._DB_LOCAL, "conn", None) is not None:   # misma ruta: db_conn no reabriría el archivo borrado
+        dm._DB_LOCAL.conn.close(); dm._DB_LOCAL.conn = None
+    for suf in ("", "-wal", "-shm"):
+        if os.path.exists(path + suf): os.remove(path + suf)
+    dm.DB_FILE = path
+    if iniciar: dm.db_init()
+    return path
+
+class Chequeo:
+    """Condiciones con nombre de un check_*: `c("qué se espera", condición)`. Al salir imprime el resultado
+    y cada condición que falló (una excepción cuenta como falla y no corta los demás checks).
+    Con `db`, el dashboard usa una base temporal (ver db_temporal) y DB_FILE se restaura al salir."""
+    def __init__(self, titulo, db=None, iniciar=True):
+        self.titulo = titulo; self.db = db; self.iniciar = iniciar
+        self.fallas = []; self.ok = False; self.path = None
+
+    def __enter__(self):
+        self.db_original = dm.DB_FILE
+        if self.db: self.path = db_temporal(self.db, self.iniciar)
+        return self
+
+    def __call__(self, nombre, cond):
+        if not cond: self.fallas.append(nombre)
+        return cond
+
+    def __exit__(self, tipo, exc, tb):
+        dm.DB_FILE = self.db_original
+        if exc is not None:
+            self.fallas.append(f"excepción {tipo.__name__}: {exc}"); traceback.print_exception(tipo, exc, tb)
+        self.ok = not self.fallas
+        print(f"{self.titulo}: {'sí' if self.ok else 'NO'}")
+        for f in self.fallas: print(f"   falla: {f}")
+        return isinstance(exc, Exception)
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=AQUI, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or "desconocido"
+    except (OSError, subprocess.SubprocessError):
+        return "desconocido"
+
+# ---------------- Downsampling ----------------
+def bench_downsample(n):
+    t, Y, _ = serie_sintetica(n)
+    for mode in ("lttb", "minmax"):
+        informe(f"downsample[{mode}]", n, *medir(lambda: dm.downsample_idx(t, Y, dm.MAX_POINTS_CHART, mode)))
+    informe("thin_series", n, *medir(lambda: dm.thin_series(dm.epoch_to_num(t), Y)))
+
+def check_picos():
+    """Fidelidad visual: todos los picos de calidadAire deben sobrevivir a la reducción.
+    LTTB se evalúa con cubetas de ~100 min (más anchas, el ciclo diario pesa más que un pico aislado);
+    minmax conserva el extremo de cada cubeta a cualquier escala. Una métrica sin ningún valor (estación
+    sin BMP280) no cambia la selección ni dispara avisos de numpy."""
+    with Chequeo("picos conservados al reducir") as c:
+        for mode, n in (("lttb", 30_000), ("minmax", 1_000_000)):
+            t, Y, picos = serie_sintetica(n)
+            idx = dm.downsample_idx(t, Y, dm.MAX_POINTS_CHART, mode)
+            perdidos = np.setdiff1d(picos, idx)
+            print(f"picos[{mode}] n={n:,}: {len(picos) - len(perdidos)}/{len(picos)} conservados en {len(idx)} puntos")
+            c(f"{mode}: ningún pico perdido", len(perdidos) == 0)
+            c(f"{mode}: a lo sumo MAX_POINTS_CHART puntos", len(idx) <= dm.MAX_POINTS_CHART)
+            vacias = Y.copy(); vacias[1:3] = np.nan           # presión y altitud ausentes
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", RuntimeWarning)
+                try: sin_bmp = dm.downsample_idx(t, vacias, dm.MAX_POINTS_CHART, mode); avisa = False
+                except RuntimeWarning: avisa = True
+            c(f"{mode}: métricas vacías sin RuntimeWarning", not avisa)
+            c(f"{mode}: métricas vacías no desplazan picos", not avisa and len(np.setdiff1d(picos, sin_bmp)) == 0)
+    return c.ok
+
+# ---------------- Consolidación y tiempos ----------------
+def consolidate_legacy(items):
+    """consolidate() anterior (dict por cubeta, dos strftime y tres lower() por lectura): referencia del benchmark."""
+    buckets = defaultdict(lambda: {"temperatura": None, "presion": None, "altitud": None, "calidadAire": None,
+                                   "ts": None, "fecha": None, "hora": None, "estacionNombre": None, "epoch": None})
+    for it in items:
+        ts = it.get("timestamp"); est = it.get("estacionNombre")
+        if not ts or not est: continue
+        b = buckets[(ts, est)]
+        b["ts"] = ts; b["estacionNombre"] = est
+        try:
+            dt = datetime.fromisoformat(ts.replace("Z",""))
+            b["fecha"] = dt.strftime("%Y-%m-%d"); b["hora"] = dt.strftime("%H:%M:%S")
+            b["epoch"] = dm._ts_epoch(ts)
+        except Exception:
+            b["fecha"] = ts[:10]; b["hora"] = ts[11:19] if len(ts) >= 19 else ""
+        unidad = (it.get("unidadMedicion") or "").lower()
+        tipo = (it.get("tipoSensor") or "").lower()
+        sensor = (it.get("sensorNombre") or "").lower()
+        val = it.get("valor")
+        if unidad in ("°c","c","celsius"): b["temperatura"] = val
+        elif unidad in ("hpa",): b["presion"] = val
+        elif unidad in ("m",): b["altitud"] = val
+        elif unidad in ("%",) or "calidad" in tipo or sensor == "mq8": b["calidadAire"] = val
+    rows = list(buckets.values())
+    rows.sort(key=lambda x: (x["ts"] or "", x["estacionNombre"] or ""))
+    return rows
+
+def bench_consolidate(items):
+    n = len(items); rep = repeticiones(n)
+    informe("consolidate[legacy]", n, *medir(lambda: consolidate_legacy(items), rep))
+    informe("consolidate", n, *medir(lambda: dm.consolidate(items), rep))
+    mitad = n // 2; base = dm.consolidate(items[:mitad])
+    informe("consolidate[merge 2a mitad]", n, *medir(lambda: dm.consolidate(items[mitad:], base), rep))
+    ts = [it["timestamp"] for it in items[::4]]   # un timestamp por cubeta
+    informe("ts_to_epoch", len(ts), *medir(lambda: dm.ts_to_epoch(ts), rep))
+
+def check_consolidate():
+    """Misma salida que la versión anterior (incluye una cubeta partida entre dos lotes que se intercalan)."""
+    with Chequeo("consolidate ≡ legacy") as c:
+        items = payload_sintetico(20_000)
+        items.append(dict(items[0], timestamp="2023-11-14 22:13", lecturaId=-1))   # formato alterno
+        ref = [tuple(r[f] for f in dm.FilaConso._fields) for r in consolidate_legacy(items)]
+        c(f"un lote ({len(ref):,} filas)", dm.consolidate(items) == ref)
+        pares, impares = items[::2], items[1::2]
+        c("dos lotes intercalados", dm.consolidate(impares, dm.consolidate(pares)) == ref)
+    return c.ok
+
+# ---------------- SQLite ----------------
+def bench_db(items):
+    """Inserciones sobre base vacía y consultas de la UI sobre la base ya poblada."""
+    n = len(items); rep = repeticiones(n); rows = dm.consolidate(items)
+    informe("db_insert_raw[vacía]", n, *medir(lambda: dm.db_insert_raw(items), rep,
+                                              setup=lambda: db_temporal("raw")))
+    informe("db_insert_raw[repetidas]", n, *medir(lambda: dm.db_insert_raw(items), rep))
+    informe("db_insert_consolidated", len(rows), *medir(lambda: dm.db_insert_consolidated(rows), rep,
+                                                         setup=lambda: db_temporal("conso")))
+    dm.db_insert_raw(items)
+    est = rows[-1].estacionNombre; medio = rows[len(rows) // 2].epoch
+    informe("db_fetch_consolidated[últimas]", len(rows), *medir(lambda: dm.db_fetch_consolidated()))
+    informe("db_fetch_consolidated[antes]", len(rows),
+            *medir(lambda: dm.db_fetch_consolidated(est=est, before=(medio, 0))))
+    informe("db_fetch_raw[últimas]", n, *medir(lambda: dm.db_fetch_raw(est=est)))
+    informe("SeriesCache.get[frío]", len(rows), *medir(lambda: dm.SeriesCache().get(est)))
+    t1 = rows[-1].epoch + 1
+    for dias in (1, 30):
+        res = dm.pick_resolution(dias * 86400)
+        informe(f"db_fetch_range[{dias}d, res={res}]", len(rows),
+                *medir(lambda: dm.db_fetch_range(est, t1 - dias * 86400, t1, res)))
+    informe("build_snapshot", len(rows), *medir(lambda: dm.build_snapshot(None, dm.SeriesCache())))
+
+def planes(fn):
+    """EXPLAIN QUERY PLAN de cada SELECT sobre particiones o rollup que ejecuta fn() (SQL capturado con sus
+    parámetros ya sustituidos, así el plan es el de la consulta real)."""
+    conn = dm.db_conn(); sqls = []
+    conn.set_trace_callback(sqls.append)
+    try:
+        fn()
+    finally:
+        conn.set_trace_callback(None)
+    return [(sql, [r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + sql)]) for sql in sqls
+            if sql.lstrip().startswith("SELECT") and "FROM lecturas_" in sql]
+
+def check_plan():
+    """Las consultas de la UI recorren los índices: ninguna tabla se lee sin índice (SCAN sin USING) ni se
+    ordena aparte (USE TEMP B-TREE), con y sin estación, en las dos direcciones de la paginación. Las de
+    una estación sobre consolidadas no tocan la tabla: la partición se lee solo del índice cubriente."""
+    with Chequeo("planes de consulta (índices, sin ordenar en memoria)", db="check_plan") as c:
+        items = payload_sintetico(4_000, estaciones=2); rows = dm.consolidate(items)
+        dm.db_insert_raw(items); dm.db_insert_consolidated(rows); dm.db_conn().execute("ANALYZE")
+        est = rows[-1].estacionNombre; medio = (rows[len(rows) // 2].epoch, 0); t1 = rows[-1].epoch + 1
+        casos = {
+            "db_fetch_raw[últimas]": lambda: dm.db_fetch_raw(),
+            "db_fetch_raw[est, antes]": lambda: dm.db_fetch_raw(est=est, before=medio),
+            "db_fetch_raw[después]": lambda: dm.db_fetch_raw(after=medio),
+            "db_fetch_consolidated[últimas]": lambda: dm.db_fetch_consolidated(),
+            "db_fetch_consolidated[est]": lambda: dm.db_fetch_consolidated(est=est),
+            "db_fetch_consolidated[antes]": lambda: dm.db_fetch_consolidated(before=medio),
+            "db_fetch_consolidated[est, después]": lambda: dm.db_fetch_consolidated(est=est, after=medio),
+            "db_fetch_series": lambda: dm.db_fetch_series(est, 500),
+            "db_fetch_range[res=0]": lambda: dm.db_fetch_range(est, t1 - 3600, t1),
+            "db_fetch_range[rollup]": lambda: dm.db_fetch_range(est, t1 - 86400, t1, min(dm.ROLLUP_RES)),
+            "db_fetch_payload": lambda: dm.db_fetch_payload(*medio),
+        }
+        cubiertas = {"db_fetch_consolidated[est]", "db_fetch_consolidated[est, después]", "db_fetch_series"}
+        for nombre, fn in casos.items():
+            consultas = planes(fn)
+            c(f"{nombre}: ejecuta alguna consulta", consultas)
+            for sql, plan in consultas:
+                sin_indice = [p for p in plan if p.startswith("SCAN") and " USING " not in p]
+                if sin_indice or any("TEMP B-TREE" in p for p in plan):
+                    print(f"  {nombre}:\n    " + " ".join(sql.split()) + "\n    " + "\n    ".join(plan))
+                c(f"{nombre}: usa índice en cada tabla", not sin_indice)
+                c(f"{nombre}: sin USE TEMP B-TREE", not any("TEMP B-TREE" in p for p in plan))
+                if nombre in cubiertas:   # la fila de la partición (alias c o el nombre); la de estaciones es aparte
+                    particion = [p for p in plan if p.split()[1] == "c" or p.split()[1].startswith("lecturas_")]
+                    if not all("USING COVERING INDEX" in p for p in particion):
+                        print(f"  {nombre}:\n    " + "\n    ".join(plan))
+                    c(f"{nombre}: solo el índice cubriente", particion and
+                      all("USING COVERING INDEX" in p for p in particion))
+    return c.ok
+
+# ---------------- HTTP (servidor local) ----------------
+class _ServidorLecturas(http.server.BaseHTTPRequestHandler):
+    """/lecturas según `modo` del servidor: "ok" (lista con ETag; 304 si If-None-Match coincide) o "caído" (503)."""
+    def do_GET(self):
+        srv = self.server; srv.peticiones += 1
+        if srv.modo == "caído":
+            self.send_response(503); self.send_header("Retry-After", "2"); self.send_header("Content-Length", "0")
+            self.end_headers(); return
+        if self.headers.get("If-None-Match") == srv.etag:
+            self.send_response(304); self.end_headers(); return
+        body = json.dumps(srv.lista).encode()
+        self.send_response(200); self.send_header("Content-Type", "application/json"); self.send_header("ETag", srv.etag)
+        self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+def check_http():
+    """HttpFetcher contra un servidor de verdad: 304 con el ETag de la respuesta anterior; ante 5xx reintenta
+    con Retry-After y tras HTTP_CB_FALLOS descargas fallidas abre el circuito (sin tocar la red) hasta
+    HTTP_CB_ESPERA; al volver el servidor, la siguiente descarga cierra el circuito."""
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ServidorLecturas)
+    srv.peticiones = 0; srv.modo = "ok"; srv.etag = '"v1"'; srv.lista = payload_sintetico(8)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_address[1]}/lecturas"
+    reloj = [1000.0]; esperas = []
+    def dormir(s): esperas.append(s); reloj[0] += s
+    f = dm.HttpFetcher(dm.requests.Session(), sleep=dormir, clock=lambda: reloj[0])
+    try:
+        with Chequeo("HTTP (ETag/304, reintentos, cortacircuitos, recuperación)") as c:
+            c("200: la lista", f.get_lista(url) == srv.lista)
+            c("304 con el ETag anterior → None", f.get_lista(url) is None)
+            c("una petición por descarga", srv.peticiones == 2)
+            srv.modo = "caído"; srv.peticiones = 0
+            for i in range(dm.HTTP_CB_FALLOS):
+                try: f.get_lista(url); c(f"5xx #{i + 1}: falla", False)
+                except dm.requests.HTTPError: pass
+            c("cada descarga reintenta HTTP_REINTENTOS veces",
+              srv.peticiones == dm.HTTP_CB_FALLOS * (dm.HTTP_REINTENTOS + 1))
+            c("esperas de Retry-After", esperas == [2.0] * dm.HTTP_CB_FALLOS * dm.HTTP_REINTENTOS)
+            c("circuito abierto por HTTP_CB_ESPERA", f.fallos == dm.HTTP_CB_FALLOS
+              and f.abierto_hasta == reloj[0] + dm.HTTP_CB_ESPERA)
+            antes = srv.peticiones
+            try: f.get_lista(url); c("abierto: CircuitoAbierto", False)
+            except dm.CircuitoAbierto: pass
+            c("abierto: ninguna petición", srv.peticiones == antes)
+            srv.modo = "ok"; srv.etag = '"v2"'; srv.lista = payload_sintetico(8, t0=1_700_000_600)
+            reloj[0] = f.abierto_hasta
+            c("pasada la espera: lista nueva", f.get_lista(url) == srv.lista)
+            c("recuperado: una petición, circuito cerrado", srv.peticiones == antes + 1 and f.fallos == 0)
+            c("ETag nuevo: 304", f.get_lista(url) is None)
+    finally:
+        srv.shutdown(); srv.server_close()
+    return c.ok
+
+# ---------------- MQTT (broker simulado) ----------------
+class BrokerFalso:
+    """Broker en proceso con la parte de paho que usa MqttIngest: publish() entrega a los suscritos."""
+    def __init__(self):
+        self.clientes = []
+        broker = self
+        class Client:
+            def __init__(self, *args): self.subs = set()
+            def connect_async(self, host, port, keepalive=60): pass
+            def loop_start(self): broker.clientes.append(self); self.on_connect(self, None, {}, 0, None)
+            def loop_stop(self): pass
+            def subscribe(self, topics): self.subs.update(t for t, _ in topics)
+            def disconnect(self): broker.clientes.remove(self)
+        self.paho = SimpleNamespace(Client=Client, CallbackAPIVersion=SimpleNamespace(VERSION2=2))
+
+    def publish(self, topic, payload):
+        for cli in list(self.clientes):
+            if topic in cli.subs: cli.on_message(cli, None, SimpleNamespace(topic=topic, payload=bytes(payload)))
+
+def lecturas_firmware(n, t1=1_760_000_000, estacion=3):
+    """n lecturas por minuto del ESP32 (epoch, temp, hum, mq8_raw, calidadAire) y las crudas con que el servidor
+    las devuelve por /lecturas (un ítem por sensor, con sus ids y el nombre que el servidor da a la estación)."""
+    lect = [(t1 - (n - m) * 60, 20 + m % 7 / 10, 50 + m % 3, 1150 + m, 90 - m % 5) for m in range(n)]
+    servidor = []
+    for ep, temp, hum, _mq, air in lect:
+        ts = datetime.fromtimestamp(ep, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        for campo, v in (("temperatura", temp), ("humedad", hum), ("calidadAire", air)):
+            sen, tipo, unidad = dm.MQTT_SENSORES[campo]
+            servidor.append({"lecturaId": len(servidor) + 1, "valor": v, "timestamp": ts, "sensorNombre": sen,
+                             "tipoSensor": tipo, "unidadMedicion": unidad, "estacionNombre": "UMES",
+                             "estacionUbicacion": "Campus central", "estacionId": estacion})
+    return lect, servidor
+
+def mqtt_json(lect, estacion=3):
+    """Un mensaje como registro_a_dict del firmware (Fecha/Hora en hora de Guatemala)."""
+    ep, temp, hum, mq, air = lect
+    local = datetime.fromtimestamp(ep, timezone.utc) + timedelta(hours=dm.MQTT_UTC_OFFSET_H)
+    return json.dumps({"Fecha": local.strftime("%Y-%m-%d"), "Hora": local.strftime("%H:%M:%S"), "temperatura": temp,
+                       "humedad": hum, "mq8_raw": mq, "calidadAire": air, "mq8_min": mq, "mq8_max": mq,
+                       "mq8_media": mq, "mq8_std": 0.0, "estacion": estacion}).encode()
+
+def mqtt_binario(lote, estacion=3):
+    """Un lote como empaquetar_lote del firmware (v2: registro con estadísticas del MQ-8)."""
+    return struct.pack("<BBH", 2, len(lote), estacion) + b"".join(
+        struct.pack("<IhhHBHHHH", ep, round(temp * 10), round(hum * 10), mq, air, mq, mq, mq, 0)
+        for ep, temp, hum, mq, air in lote)
+
+def check_mqtt():
+    """Lo que llega por MQTT (JSON y lotes binarios) queda con el nombre de estación, los sensores y el ts del
+    servidor, humedad incluida, y las mismas lecturas descargadas después por HTTP no se duplican; tampoco
+    si MQTT llegó antes de la primera sincronización (con el nombre provisional "Estación N")."""
+    return all([_check_mqtt_despues_de_http(), _check_mqtt_antes_de_http()])
+
+def _check_mqtt_despues_de_http():
+    broker = BrokerFalso(); lect, servidor = lecturas_firmware(30)
+    with Chequeo("MQTT (JSON y binario, nombres del servidor, dedup con HTTP)", db="check_mqtt") as c, \
+            mock.patch.object(dm, "paho_mqtt", broker.paho):
+        app = app_en_reposo()
+        def http(items):
+            app._jobs.put(lambda: app._ingest_http(items, items, dm.consolidate(items))); esperar_worker(app)
+        def cuenta(sql):
+            conn = dm.db_conn()
+            return sum(conn.execute(sql.format(t=t)).fetchone()[0] for t in dm._particiones(conn, "lecturas_crudas"))
+        http(servidor[:30])                              # primeros 10 min: el servidor enseña el nombre del id 3
+        ingesta = dm.MqttIngest(app._on_mqtt_items, lambda msg: None); ingesta.start()
+        for l in lect[10:15]: broker.publish(dm.MQTT_TOPIC, mqtt_json(l))
+        broker.publish(dm.MQTT_TOPIC, mqtt_json(lect[0]).replace(b'"estacion": 3', b'"estacion": [3]'))   # se descarta
+        broker.publish(dm.MQTT_TOPIC, b'{"Fecha": "2025-10-09", "Hora": 7, "estacion": 3}')             # y este también
+        broker.publish(dm.MQTT_TOPIC_BIN, mqtt_binario(lect[15:]))   # ...sin que el suscriptor deje de entregar
+        broker.publish(dm.MQTT_TOPIC, b'{"Fecha": "2025-10-09"}')   # incompleto: se descarta
+        esperar_worker(app); ingesta.stop()
+        c("una sola estación, con el nombre del servidor", dm.db_fetch_estaciones() == ["UMES"])
+        c("crudas por MQTT: 3 sensores por minuto", cuenta("SELECT COUNT(*) FROM {t}") == 3 * len(lect))
+        c("humedad guardada", cuenta("SELECT COUNT(*) FROM {t} c JOIN sensores s ON s.id = c.sensor_id "
+                                     "WHERE s.tipo = 'Humedad'") == len(lect))
+        ref = [(r.fecha, r.hora, r.estacionNombre, r.temperatura, r.presion, r.altitud, r.calidadAire, r.ts)
+               for r in dm.consolidate(servidor)]
+        c("consolidadas de MQTT iguales a las del servidor", [r[:8] for r in dm.db_fetch_consolidated(limit=100)] == ref)
+        v = dm.db_fetch_versiones()
+        http(servidor[30:])                              # el servidor devuelve lo mismo que ya llegó por MQTT
+        c("HTTP después de MQTT: ninguna cruda repetida", cuenta("SELECT COUNT(*) FROM {t}") == 3 * len(lect))
+        c("HTTP después de MQTT: ninguna consolidada repetida", len(dm.db_fetch_consolidated(limit=100)) == len(lect))
+        c("sin filas nuevas la versión no sube", dm.db_fetch_versiones() == v)
+    return c.ok
+
+def _check_mqtt_antes_de_http():
+    broker = BrokerFalso(); lect, servidor = lecturas_firmware(30)
+    with Chequeo("MQTT antes de la primera sincronización (nombre provisional fusionado)", db="check_mqtt_antes") as c, \
+            mock.patch.object(dm, "paho_mqtt", broker.paho):
+        app = app_en_reposo()
+        ingesta = dm.MqttIngest(app._on_mqtt_items, lambda msg: None); ingesta.start()
+        for l in lect[:20]: broker.publish(dm.MQTT_TOPIC, mqtt_json(l))
+        broker.publish(dm.MQTT_TOPIC_BIN, mqtt_binario(lect[20:]))
+        esperar_worker(app); ingesta.stop()
+        c("sin sincronizar: estación provisional", dm.db_fetch_estaciones() == ["Estación 3"])
+        c("caché de series con lo de MQTT", len(app.cache.get("Estación 3")[0]) == len(lect))
+        app._jobs.put(lambda: app._ingest_http(servidor, servidor, dm.consolidate(servidor))); esperar_worker(app)
+        conn = dm.db_conn()
+        def cuenta(base, sql="SELECT COUNT(*) FROM {t}"):
+            return sum(conn.execute(sql.format(t=t)).fetchone()[0] for t in dm._particiones(conn, base))
+        c("una sola estación, con el nombre del servidor", dm.db_fetch_estaciones() == ["UMES"])
+        c("ninguna cruda repetida", cuenta("lecturas_crudas") == 3 * len(lect))
+        c("ninguna consolidada repetida", cuenta("lecturas_consolidadas") == len(lect))
+        ref = [(r.fecha, r.hora, r.estacionNombre, r.temperatura, r.presion, r.altitud, r.calidadAire, r.ts)
+               for r in dm.consolidate(servidor)]
+        c("consolidadas iguales a las del servidor", [r[:8] for r in dm.db_fetch_consolidated(limit=100)] == ref)
+        c("hechos sin ids de estación huérfanos", cuenta("lecturas_crudas", "SELECT COUNT(*) FROM {t} "
+                                                           "WHERE estacion_id NOT IN (SELECT id FROM estaciones)") == 0)
+        rollup = conn.execute("SELECT res, COUNT(DISTINCT estacion_id), SUM(n), SUM(temperatura_n) FROM lecturas_rollup "
+                              "GROUP BY res").fetchall()
+        c("rollup de una estación, cada lectura contada una vez",
+          rollup == [(r, 1, len(lect), len(lect)) for r in dm.ROLLUP_RES])
+        c("sin versiones de la estación provisional", conn.execute(
+            "SELECT COUNT(*) FROM versiones WHERE estacion_id NOT IN (SELECT id FROM estaciones)").fetchone()[0] == 0)
+        c("caché de series recargada con la estación real",
+          len(app.cache.get("UMES")[0]) == len(lect) and "Estación 3" not in app.cache._t)
+    return c.ok
+
+# ---------------- Payload crudo (raw_json / raw_z) ----------------
+def con_extras(items):
+    """Payloads con los campos del servidor que no tienen columna (ids internos, fecha de alta)."""
+    return [dict(it, id=10_000_000 + i, sensorId=i % 4 + 1, estacionId=int(it["estacionNombre"][-1]),
+                 createdAt=it["timestamp"]) for i, it in enumerate(items)]
+
+def bench_raw(items):
+    """Bytes por lectura e inserciones/s guardando el payload completo en texto vs. solo el residuo comprimido."""
+    items = con_extras(items); n = len(items); rep = repeticiones(n); modo_original = dm.RAW_MODO
+    try:
+        for modo in ("json", "residuo"):
+            dm.RAW_MODO = modo
+            best, med = medir(lambda: dm.db_insert_raw(items), rep, setup=lambda: db_temporal(f"raw_{modo}"))
+            conn = dm.db_conn()
+            payload = sum(conn.execute("SELECT SUM(COALESCE(LENGTH(CAST(raw_json AS BLOB)), 0) + "
+                                       f"COALESCE(LENGTH(raw_z), 0)) FROM {t}").fetchone()[0]
+                          for t in dm._particiones(conn, "lecturas_crudas")) / n
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")   # en WAL el VACUUM queda en -wal hasta el checkpoint
+            archivo = os.path.getsize(dm.DB_FILE) / n
+            informe(f"db_insert_raw[{modo}]", n, best, med)
+            MEDICIONES[-1].update(payload_b=round(payload, 1), archivo_b=round(archivo, 1))
+            print(f"{'':<34} payload {payload:7.1f} B/lectura  archivo {archivo:7.1f} B/lectura  "
+                  f"{n / med * 1000:>10,.0f} lecturas/s")
+    finally:
+        dm.RAW_MODO = modo_original
+
+def check_raw():
+    """db_fetch_payload devuelve el payload insertado, también tras migrar una base con raw_json en texto."""
+    items = con_extras(payload_sintetico(2_000))
+    items[0] = dict(items[0], valor="12.5", estacionUbicacion=None, extra={"anidado": [1, 2]})   # tipos que la columna cambiaría
+    modo_original = dm.RAW_MODO
+    with Chequeo("payload crudo recuperable (y migrado)", db="check_raw", iniciar=False) as c:
+        try:
+            dm.RAW_MODO = "json"; dm.db_init(); dm.db_insert_raw(items)
+            dm.RAW_MODO = "residuo"; dm.db_init()                     # migración raw_json → raw_z
+            dm.db_insert_raw(con_extras(payload_sintetico(2_000, t0=1_800_000_000)))
+            conn = dm.db_conn(); t = dm._particiones(conn, "lecturas_crudas")[0]
+            ids = conn.execute(f"SELECT epoch, id FROM {t} WHERE lecturaId IN (0, 1, 999) "
+                               "AND raw_json IS NULL ORDER BY id LIMIT 3").fetchall()
+            c("las 3 lecturas migradas a raw_z", len(ids) == 3)
+            c("payloads iguales a los insertados", [dm.db_fetch_payload(*k) for k in ids] == [items[0], items[1], items[999]])
+            c("un solo diccionario entrenado", conn.execute("SELECT COUNT(*) FROM raw_diccionarios").fetchone()[0] == 1)
+        finally:
+            dm.RAW_MODO = modo_original
+    return c.ok
+
+# ---------------- Particiones mensuales ----------------
+def historia_sintetica(dias, estaciones=3, t1=1_760_000_000):
+    """Filas consolidadas de `dias` días a un minuto por estación, terminando en t1."""
+    rows = []
+    for m in range(dias * 1440):
+        ep = t1 - (dias * 1440 - m) * 60; dt = datetime.fromtimestamp(ep, timezone.utc)
+        ts, fecha, hora = dt.strftime("%Y-%m-%dT%H:%M:%SZ"), dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M:%S")
+        for e in range(estaciones):
+            rows.append(dm.FilaConso(ts, fecha, hora, f"Estación {e + 1}", 20.0 + m % 7, 1013.0, 1500.0, 90.0, ep))
+    return rows
+
+def bench_historia(estaciones=3):
+    """Consultas sobre "hoy" con un mes de historia vs. con un año: deben costar lo mismo."""
+    for dias in (30, 365):
+        rows = historia_sintetica(dias, estaciones); t1 = rows[-1].epoch + 1; est = rows[-1].estacionNombre
+        db_temporal(f"historia_{dias}")
+        for i in range(0, len(rows), 100_000): dm.db_insert_consolidated(rows[i:i + 100_000])
+        informe(f"db_fetch_consolidated[últimas, {dias}d]", len(rows), *medir(lambda: dm.db_fetch_consolidated()))
+        informe(f"db_fetch_range[hoy, {dias}d]", len(rows), *medir(lambda: dm.db_fetch_range(est, t1 - 86400, t1)))
+        informe(f"db_fetch_estaciones[{dias}d]", len(rows), *medir(dm.db_fetch_estaciones))
+        pasos = []                                     # un mes por llamada, como _mantenimiento_job
+        while True:
+            t0 = time.perf_counter(); tiradas = dm.db_purgar(3, ahora=t1, maximo=1)
+            pasos.append((time.perf_counter() - t0) * 1000.0)
+            if not tiradas: break
+        if len(pasos) > 1: pasos.pop()                 # la última solo confirma que no queda nada
+        pasos.sort()
+        informe(f"db_purgar[3 meses, por mes, {dias}d]", len(rows), pasos[0], pasos[len(pasos) // 2])
+        MEDICIONES[-1].update(pasos=len(pasos), max_ms=round(pasos[-1], 3), total_ms=round(sum(pasos), 3))
+        print(f"{'':<34} {len(pasos)} pasos  máx {pasos[-1]:9.2f} ms  total {sum(pasos):9.2f} ms (worker bloqueado por paso)")
+
+def bench_zoom(estaciones=3):
+    """Zoom de un mes a una hora (build_series con Vista): teselas frías y ya en caché."""
+    rows = historia_sintetica(30, estaciones); t1 = rows[-1].epoch + 1
+    nombres = sorted({r.estacionNombre for r in rows})
+    db_temporal("zoom")
+    for i in range(0, len(rows), 100_000): dm.db_insert_consolidated(rows[i:i + 100_000])
+    medio = t1 - 15 * 86400
+    for nombre, v in (("mes", dm.Vista(t1 - 30 * 86400, t1, 900)), ("hora", dm.Vista(medio, medio + 3600, 900))):
+        informe(f"zoom[{nombre}, frío]", len(rows), *medir(lambda: dm.build_series(dm.SeriesCache(), nombres, v)))
+        cache = dm.SeriesCache(); dm.build_series(cache, nombres, v)
+        informe(f"zoom[{nombre}, teselas]", len(rows), *medir(lambda: dm.build_series(cache, nombres, v)))
+
+def check_zoom():
+    """La vista de una hora trae todas las filas del rango sin reducir; la de un mes, el rollup que cabe en
+    los píxeles; la LRU no pasa de TESELAS_MAX y las teselas con filas nuevas se descartan."""
+    with Chequeo("zoom por teselas (resolución, invalidación, LRU)", db="check_zoom") as c:
+        rows = historia_sintetica(40, 1); t1 = rows[-1].epoch + 1
+        dm.db_insert_consolidated(rows[:-60])
+        cache = dm.SeriesCache(); est = rows[0].estacionNombre
+        hora = dm.Vista(t1 - 7200, t1 - 3600, 800)
+        (_, x, *_), = dm.build_series(cache, [est], hora)
+        x0, x1 = dm.epoch_to_num([hora.t0, hora.t1])
+        c("vista de 1 h: las 60 filas sin reducir", int(((x >= x0) & (x < x1)).sum()) == 60)
+        (_, x, *_), = dm.build_series(cache, [est], dm.Vista(t1 - 30 * 86400, t1, 800))
+        c("vista de 30 d: rollup de 1 h", dm.resolucion_lod(30 * 86400, 800) == 3600)
+        c("vista de 30 d: ~720 puntos", 720 <= len(x) <= 720 + 2 * dm.TESELA_PUNTOS)
+        antes = len(cache.teselas._d)
+        cache.extend(rows[-60:], dm.db_insert_consolidated(rows[-60:]))   # la última hora llega tarde
+        c("filas nuevas invalidan sus teselas", len(cache.teselas._d) < antes)
+        (_, x, *_), = dm.build_series(cache, [est], dm.Vista(t1 - 3600, t1, 800))
+        c("la hora tardía se ve", len(x) > 0 and x[-1] == dm.epoch_to_num(rows[-1].epoch))
+        chica = dm.TileCache(max_teselas=4)
+        for k in range(10): chica.get(est, k * 86400, k * 86400 + 3600, 0)
+        c("la LRU respeta max_teselas", len(chica._d) == 4)
+    return c.ok
+
+def base_legada(path, dias=70, t1=1_760_000_000):
+    """Base con el esquema anterior a las particiones (tablas únicas, rollup_estado y raw_json en texto)."""
+    conn = dm.sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE lecturas_crudas (id INTEGER PRIMARY KEY AUTOINCREMENT, lecturaId INTEGER, valor REAL, timestamp TEXT,
+        sensorNombre TEXT, tipoSensor TEXT, unidadMedicion TEXT, estacionNombre TEXT, estacionUbicacion TEXT,
+        raw_json TEXT, epoch INTEGER, UNIQUE(timestamp, estacionNombre, sensorNombre, unidadMedicion));
+    CREATE TABLE lecturas_consolidadas (id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, fecha TEXT, hora TEXT,
+        estacionNombre TEXT, temperatura REAL, presion REAL, altitud REAL, calidadAire REAL, epoch INTEGER,
+        UNIQUE(ts, estacionNombre));
+    CREATE TABLE rollup_estado (k INTEGER PRIMARY KEY CHECK (k = 0), ultimoId INTEGER NOT NULL);
+    INSERT INTO rollup_estado VALUES (0, 0);""")
+    items = [it for it in payload_sintetico(dias * 1440 * 4, estaciones=1, t0=t1 - dias * 86400)
+             if it["lecturaId"] // 4 % 10 == 0]   # una lectura por sensor cada 10 min
+    conn.executemany("INSERT INTO lecturas_crudas (lecturaId, valor, timestamp, sensorNombre, tipoSensor, unidadMedicion, "
+                     "estacionNombre, estacionUbicacion, raw_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [(it["lecturaId"], it["valor"], it["timestamp"], it["sensorNombre"], it["tipoSensor"],
+                       it["unidadMedicion"], it["estacionNombre"], it["estacionUbicacion"], json.dumps(it))
+                      for it in items])
+    rows = dm.consolidate(items)
+    conn.executemany("INSERT INTO lecturas_consolidadas (ts, fecha, hora, estacionNombre, temperatura, presion, "
+                     "altitud, calidadAire) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [r[:-1] for r in rows])
+    conn.commit(); conn.close()
+    return items, rows
+
+def check_particiones():
+    """Una base anterior se reparte por meses sin perder filas ni rollups; la paginación cruza particiones;
+    la retención tira meses enteros y el vacuum incremental devuelve el espacio."""
+    with Chequeo("particiones (migración, paginación, retención, vacuum)", db="check_particiones",
+                 iniciar=False) as c:
+        items, rows = base_legada(c.path)
+        dm.db_init()
+        conn = dm.db_conn(); crudas = dm._particiones(conn, "lecturas_crudas")
+        c("una partición por mes", len(crudas) == len({r.fecha[:7] for r in rows}) > 1)
+        c("tablas anteriores borradas", not conn.execute("SELECT 1 FROM sqlite_master WHERE name IN "
+                                                         "('lecturas_crudas', 'lecturas_consolidadas', 'rollup_estado')").fetchone())
+        c("todas las crudas repartidas",
+          sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in crudas) == len(items))
+        c("rollup diario completo",
+          conn.execute("SELECT SUM(n) FROM lecturas_rollup WHERE res = 86400").fetchone()[0] == len(rows))
+        pagina, vistas = dm.db_fetch_consolidated(limit=500), 0
+        while pagina:                                  # hacia atrás hasta el principio, de 500 en 500
+            vistas += len(pagina); pagina = dm.db_fetch_consolidated(limit=500, before=pagina[0][-2:])
+        c("la paginación recorre todas las particiones", vistas == len(rows))
+        vieja = conn.execute(f"SELECT epoch, id FROM {crudas[0]} LIMIT 1").fetchone()
+        c("payload migrado con su ubicación", dm.db_fetch_payload(*vieja)["estacionUbicacion"] == "UMES")
+        pasos = []
+        while True:                                    # un mes por paso, como el mantenimiento del worker
+            paso = dm.db_purgar(1, ahora=rows[-1].epoch, maximo=1)
+            if not paso: break
+            pasos.append(paso)
+        c("retención: un mes (crudas y consolidadas) por paso", [len(p) for p in pasos] == [2] * (len(crudas) - 1))
+        c("retención: solo queda el último mes", dm._particiones(conn, "lecturas_crudas") == crudas[-1:])
+        c("retención: sin rollup de 1 min antes del último mes", not conn.execute(
+            "SELECT 1 FROM lecturas_rollup WHERE res < 3600 AND bucket < ?",
+            (dm._mes_inicio(int(crudas[-1][-6:])),)).fetchone())
+        c("retención: el rollup diario se conserva",
+          conn.execute("SELECT MIN(bucket) FROM lecturas_rollup WHERE res = 86400").fetchone()[0] < rows[-1].epoch - 40 * 86400)
+        c("payload de un mes purgado → None", dm.db_fetch_payload(*vieja) is None)
+        antes = os.path.getsize(c.path); libres = dm.db_vacuum_paso(10**9)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        c("vacuum: sin páginas libres", libres == 0)
+        c("vacuum: el archivo se achica", os.path.getsize(c.path) < antes)
+    return c.ok
+
+# ---------------- Dimensiones (estaciones y sensores) ----------------
+def base_por_nombre(path, dias=40, t1=1_760_000_000):
+    """Base particionada con nombres en texto en cada fila (esquema anterior a las dimensiones)."""
+    items = [it for it in payload_sintetico(dias * 1440 * 8, estaciones=2, t0=t1 - dias * 86400)
+             if it["lecturaId"] // 8 % 10 == 0]   # cada 10 min
+    items[0] = dict(items[0], estacionUbicacion="Azotea")   # otra ubicación que la del resto de su estación
+    rows = dm.consolidate(items)
+    conn = dm.sqlite3.connect(path)
+    conn.create_function("mes_utc", 1, dm._mes)
+    metricas = ", ".join(f"{m}_n INTEGER, {m}_sum REAL, {m}_min REAL, {m}_max REAL" for m in dm.METRICAS)
+    conn.executescript(f"""
+    CREATE TABLE lecturas_rollup (res INTEGER, estacionNombre TEXT, bucket INTEGER, n INTEGER, {metricas},
+        PRIMARY KEY (res, estacionNombre, bucket)) WITHOUT ROWID;
+    CREATE TABLE rollup_marcas (tabla TEXT PRIMARY KEY, ultimoId INTEGER NOT NULL);""")
+    for mes in sorted({dm._mes(r.epoch) for r in rows}):
+        conn.executescript(f"""
+        CREATE TABLE lecturas_crudas_p{mes} (id INTEGER PRIMARY KEY AUTOINCREMENT, lecturaId INTEGER, valor REAL,
+            timestamp TEXT, sensorNombre TEXT, tipoSensor TEXT, unidadMedicion TEXT, estacionNombre TEXT,
+            estacionUbicacion TEXT, raw_json TEXT, epoch INTEGER, raw_z BLOB,
+            UNIQUE(timestamp, estacionNombre, sensorNombre, unidadMedicion));
+        CREATE INDEX ix_lecturas_crudas_p{mes}_est_epoch ON lecturas_crudas_p{mes}(estacionNombre, epoch);
+        CREATE TABLE lecturas_consolidadas_p{mes} (id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT, fecha TEXT,
+            hora TEXT, estacionNombre TEXT, temperatura REAL, presion REAL, altitud REAL, calidadAire REAL,
+            epoch INTEGER, UNIQUE(ts, estacionNombre));
+        CREATE INDEX ix_lecturas_consolidadas_p{mes}_est_epoch_id ON lecturas_consolidadas_p{mes}
+            (estacionNombre, epoch, id, fecha, hora, temperatura, presion, altitud, calidadAire, ts);""")
+    eps = dm.ts_to_epoch([it["timestamp"] for it in items])
+    for it, ep in zip(items, eps):
+        conn.execute(f"INSERT INTO lecturas_crudas_p{dm._mes(ep)} (lecturaId, valor, timestamp, sensorNombre, tipoSensor, "
+                     "unidadMedicion, estacionNombre, estacionUbicacion, raw_json, epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (it["lecturaId"], it["valor"], it["timestamp"], it["sensorNombre"], it["tipoSensor"],
+                      it["unidadMedicion"], it["estacionNombre"], it["estacionUbicacion"], json.dumps(it), int(ep)))
+    for r in rows:
+        conn.execute(f"INSERT INTO lecturas_consolidadas_p{dm._mes(r.epoch)} (ts, fecha, hora, estacionNombre, "
+                     "temperatura, presion, altitud, calidadAire, epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", r)
+    conn.execute("INSERT INTO lecturas_rollup (res, estacionNombre, bucket, n) SELECT 86400, estacionNombre, 0, 1 FROM "
+                 f"lecturas_consolidadas_p{dm._mes(rows[0].epoch)} GROUP BY estacionNombre")
+    conn.commit(); conn.close()
+    return items, rows
+
+def check_dimensiones():
+    """Las particiones con nombres en texto pasan a ids sin perder filas ni payloads (tampoco la ubicación
+    distinta de una lectura), el rollup se traduce y la lista de estaciones sale de la dimensión."""
+    with Chequeo("dimensiones (migración a ids, payloads, rollup, estaciones)", db="check_dimensiones",
+                 iniciar=False) as c:
+        items, rows = base_por_nombre(c.path)
+        dm.db_init()
+        conn = dm.db_conn(); crudas = dm._particiones(conn, "lecturas_crudas")
+        c("sin tablas *_v ni columnas de texto", not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name GLOB 'lecturas_*' "
+            "AND (name GLOB '*_v' OR sql GLOB '*estacionNombre*')").fetchone())
+        c("estaciones desde la dimensión", dm.db_fetch_estaciones() == sorted({r.estacionNombre for r in rows}))
+        c("4 sensores", conn.execute("SELECT COUNT(*) FROM sensores").fetchone()[0] == 4)
+        c("ubicación de la primera lectura", conn.execute("SELECT ubicacion FROM estaciones WHERE nombre = ?",
+                                                          (items[0]["estacionNombre"],)).fetchone()[0] == "Azotea")
+        c("todas las crudas copiadas",
+          sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in crudas) == len(items))
+        c("rollup de 1 h completo",
+          conn.execute("SELECT SUM(n) FROM lecturas_rollup WHERE res = 3600").fetchone()[0] == len(rows))
+        ids = [conn.execute(f"SELECT epoch, id FROM {crudas[0]} WHERE lecturaId = ?", (it["lecturaId"],)).fetchone()
+               for it in items[:8]]
+        c("payloads (y ubicación distinta) intactos", [dm.db_fetch_payload(*k) for k in ids] == items[:8])
+        pagina = dm.db_fetch_raw(limit=len(items) + 1)
+        c("tabla de crudas con nombres", len(pagina) == len(items) and pagina[-1][:7] == tuple(items[-1][k] for k in (
+            "lecturaId", "timestamp", "estacionNombre", "sensorNombre", "tipoSensor", "unidadMedicion", "valor")))
+        est = rows[-1].estacionNombre
+        c("filtro por estación",
+          len(dm.db_fetch_consolidated(est=est, limit=10**6)) == sum(r.estacionNombre == est for r in rows))
+        c("estación desconocida → vacío",
+          dm.db_fetch_consolidated(est="no existe") == [] and dm.db_fetch_range("no existe", 0, 2**31) == [])
+    return c.ok
+
+# ---------------- Gráficas (Tk simulado, canvas Agg) ----------------
+class _CanvasAgg(FigureCanvasAgg):
+    def __init__(self, fig, master=None): super().__init__(fig)
+    def get_tk_widget(self): return mock.MagicMock()
+
+def app_headless():
+    """DashboardApp real con Tk/ttk simulados: update_cards_and_charts dibuja sobre Agg."""
+    with mock.patch.multiple(dm, tk=mock.MagicMock(), ttk=mock.MagicMock(), FigureCanvasTkAgg=_CanvasAgg,
+                             BarraNavegacion=mock.MagicMock(), configure_dark_theme=lambda root: None):
+        return dm.DashboardApp(mock.MagicMock())
+
+def bench_charts(estaciones=3, n=20_000):
+    """Redibujo completo vs. añadir un punto (blitting) con `estaciones` series de MAX_POINTS_CHART puntos."""
+    app = app_headless()
+    series = []
+    for e in range(estaciones):
+        t, Y, _ = serie_sintetica(n, seed=e)
+        x, Yr = dm.thin_series(dm.epoch_to_num(t), Y)
+        series.append((f"Estación {e + 1}", x, *Yr))
+    nombres = ("(Todas)",) + tuple(s[0] for s in series)
+    cortas = [(s[0],) + tuple(c[:-1] for c in s[1:]) for s in series]
+    firma = [0]
+    def snap(sr):
+        firma[0] += 1
+        return dm.Snapshot(None, None, nombres, firma[0], (20.0, 1013.0, 1500.0, 90.0), tuple(sr))
+    def completo():
+        app.charts.multi = None
+    def base():                          # dibujo completo sin el último punto: el siguiente update solo añade
+        completo(); app.update_cards_and_charts(snap(cortas))
+    pts = dm.MAX_POINTS_CHART * estaciones
+    informe("update_cards_and_charts[completo]", pts,
+            *medir(lambda: app.update_cards_and_charts(snap(series)), setup=completo))
+    informe("update_cards_and_charts[añadir]", pts,
+            *medir(lambda: app.update_cards_and_charts(snap(series)), setup=base))
+    print(f"  último modo: {app.charts.last_mode}")
+
+# ---------------- Detección de cambios (refresco sin novedades) ----------------
+def esperar_worker(app):
+    while app._snap_pending or not app._jobs.empty(): time.sleep(0.01)
+    time.sleep(0.1)
+
+def app_en_reposo():
+    """app_headless con el worker ya ocioso (el snapshot y el mantenimiento del arranque terminados)."""
+    app = app_headless(); esperar_worker(app)
+    return app
+
+def bench_refresco(estaciones=3):
+    """_snapshot_job de un auto-refresco sin filas nuevas (solo lee las versiones) vs. uno forzado."""
+    rows = historia_sintetica(30, estaciones, t1=int(time.time()))   # hasta ahora: los rangos en vivo tienen datos
+    db_temporal("refresco")
+    for i in range(0, len(rows), 100_000): dm.db_insert_consolidated(rows[i:i + 100_000])
+    app = app_en_reposo()
+    for nombre, rango in (("reciente", None), ("7d", dm.RANGOS["7 días"])):
+        app._rango = rango; app._snapshot_job()
+        informe(f"refresco[forzado, {nombre}]", len(rows),
+                *medir(app._snapshot_job, setup=lambda: setattr(app, "_snap_forzar", True)))
+        informe(f"refresco[sin cambios, {nombre}]", len(rows), *medir(app._snapshot_job))
+
+def check_versiones():
+    """La versión de una estación sube solo si la ingesta le agregó filas; sin cambios el refresco no
+    publica nada, y con una estación elegida las filas de otra tampoco lo despiertan."""
+    with Chequeo("detección de cambios (versiones por estación, refresco ocioso)", db="check_versiones") as c:
+        rows = historia_sintetica(1, 2); uno = [r for r in rows if r.estacionNombre == "Estación 1"]
+        dm.db_insert_consolidated(rows[:-4])
+        v0 = dm.db_fetch_versiones()
+        dm.db_insert_consolidated(rows[:-4])                       # duplicadas: no cuentan
+        c("versión 1 tras la primera carga; duplicadas no suben",
+          dm.db_fetch_versiones() == v0 == {"Estación 1": 1, "Estación 2": 1})
+        app = app_en_reposo(); q = app._ui_q
+        while not q.empty(): q.get()
+        app._snapshot_job(); c("sin cambios: no se publica nada", q.empty())
+        dm.db_insert_consolidated(rows[-4:-3])                     # una fila de la estación 1
+        c("sube solo la estación con filas nuevas", dm.db_fetch_versiones() == {"Estación 1": 2, "Estación 2": 1})
+        app._snapshot_job(); c("con cambios: snapshot y tablas", [k for k, _ in q.queue] == ["snapshot", "tables"])
+        while not q.empty(): q.get()
+        app._est = "Estación 1"; app._snapshot_job(); q.queue.clear()
+        dm.db_insert_consolidated(rows[-3:-2])                     # otra estación: la elegida no cambia
+        app._snapshot_job(); c("filas de otra estación no despiertan a la elegida", q.empty())
+        dm.db_insert_raw(payload_sintetico(8, estaciones=1, t0=uno[-1].epoch))
+        app._snapshot_job(); c("las crudas también suben la versión", len(q.queue) == 2)
+        c("la retención sube todas", dm.db_purgar(1, ahora=rows[-1].epoch + 62 * 86400) != []
+          and dm.db_fetch_versiones()["Estación 2"] == 3)
+    return c.ok
+
+# ---------------- Resultados ----------------
+def cargar_resultados(path):
+    if not os.path.exists(path): return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+def comparar(actuales, previos, commit, umbral):
+    """Contra la última medición de otro commit por (bench, n); devuelve las que empeoran más que `umbral`."""
+    ref = {}
+    for r in previos:
+        if r.get("commit") != commit: ref[(r["bench"], r["n"])] = r
+    peores = []
+    for r in actuales:
+        p = ref.get((r["bench"], r["n"]))
+        if not p or not p["mediana_ms"]: continue
+        ratio = r["mediana_ms"] / p["mediana_ms"]
+        marca = "  ← REGRESIÓN" if ratio > umbral else ""
+        print(f"{r['bench']:<34} n={r['n']:>9,}  {p['mediana_ms']:9.2f} → {r['mediana_ms']:9.2f} ms "
+              f"(x{ratio:.2f} vs {p['commit']}){marca}")
+        if marca: peores.append(r)
+    return peores
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks del dashboard")
+    ap.add_argument("--n", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="lecturas crudas")
+    ap.add_argument("--estaciones", type=int, default=3)
+    ap.add_argument("--solo", nargs="+", default=None, help="grupos: downsample consolidate db raw historia zoom charts refresco")
+    ap.add_argument("--resultados", default=RESULTADOS)
+    ap.add_argument("--no-guardar", action="store_true")
+    ap.add_argument("--umbral", type=float, default=1.25, help="mediana nueva / anterior que cuenta como regresión")
+    ap.add_argument("--estricto", action="store_true", help="código de salida 1 ante regresiones")
+    args = ap.parse_args(argv)
+    grupo = lambda g: args.solo is None or g in args.solo
+
+    db_original = dm.DB_FILE
+    try:
+        for n in args.n:
+            items = payload_sintetico(n, args.estaciones)
+            if grupo("downsample"): bench_downsample(n)
+            if grupo("consolidate"): bench_consolidate(items)
+            if grupo("db"): db_temporal("consultas"); bench_db(items)
+            if grupo("raw"): bench_raw(items)
+        if grupo("historia"): bench_historia(args.estaciones)
+        if grupo("zoom"): bench_zoom(args.estaciones)
+        if grupo("charts"): db_temporal("charts"); bench_charts(args.estaciones)
+        if grupo("refresco"): bench_refresco(args.estaciones)
+    finally:
+        dm.DB_FILE = db_original
+
+    checks = (check_picos, check_consolidate, check_http, check_mqtt, check_plan, check_raw, check_particiones,
+              check_dimensiones, check_zoom, check_versiones)
+    ok = all([chk() for chk in checks])                  # lista: corren todos aunque uno falle
+    commit = commit_actual()
+    print(f"\n--- comparación (commit {commit}, umbral x{args.umbral}) ---")
+    peores = comparar(MEDICIONES, cargar_resultados(args.resultados), commit, args.umbral)
+    if not args.no_guardar:
+        fecha = datetime.now(timezone.utc).isoformat(timespec="seconds"); py = platform.python_version()
+        with open(args.resultados, "a", encoding="utf-8") as f:
+            for r in MEDICIONES:
+                f.write(json.dumps({"commit": commit, "fecha": fecha, "python": py, **r}, ensure_ascii=False) + "\n")
+    return 0 if ok and not (args.estricto and peores) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,26 @@
-
 # dashboard_meteo.py (Optimizado: cache, downsampling, ejes tiempo y redibujo inteligente)
-import json, csv, requests, sqlite3, threading, time, math
-from datetime import datetime
-from collections import defaultdict
+# Mediciones de la ruta de datos: python bench_dashboard.py (sin ventana, guarda y compara por commit)
+import json, csv, gzip, os, random, requests, sqlite3, struct, threading, time, math, queue, warnings, zlib
+import cProfile, functools, pstats
+from datetime import datetime, timezone, timedelta
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+
+import numpy as np
 
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
+
+try:
+    import pyarrow as pa, pyarrow.parquet as pq
+except ImportError:   # opcional: sin pyarrow la exportación columnar cae a CSV gzip
+    pa = pq = None
 
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+try:
+    import paho.mqtt.client as paho_mqtt
+except ImportError:   # opcional: sin paho-mqtt el dashboard funciona solo por HTTP
+    paho_mqtt = None
+
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
 import matplotlib.dates as mdates
 
@@ -15,10 +28,74 @@ import matplotlib.dates as mdates
 URL = "https://servidorestacionmeteorologica.onrender.com/lecturas"
 DB_FILE = "lecturas_ui.db"
 AUTO_REFRESH_SECONDS = 10
+UI_POLL_MS = 50               # cada cuánto el hilo de Tk vacía la cola de resultados
+
+# HTTP: timeouts (conexión, lectura), reintentos con backoff exponencial + jitter y cortacircuitos
+HTTP_TIMEOUT = (5, 20)
+HTTP_REINTENTOS = 3
+HTTP_BACKOFF_BASE = 1.0       # s; la espera i-ésima es aleatoria en [0, min(MAX, BASE·2^i)]
+HTTP_BACKOFF_MAX = 8.0
+HTTP_CB_FALLOS = 3            # descargas fallidas seguidas que abren el circuito
+HTTP_CB_ESPERA = 60           # s sin intentar mientras el circuito está abierto
 
-# Límite de filas en tabla y puntos en gráfico (tras downsampling)
+# Payload crudo de cada lectura: "residuo" = solo los campos que no tienen columna, deflate con diccionario
+# compartido (se decodifica al abrir la fila con doble clic); "json" = texto completo (formato anterior); None = no guardar
+RAW_MODO = "residuo"
+RAW_DICC_MUESTRAS = 64        # payloads con residuo con los que se entrena el diccionario (una vez por base)
+
+# Sincronización incremental: solo se piden/insertan lecturas posteriores al cursor por estación.
+# SINCE_PARAM = nombre del parámetro que entiende el servidor (None si no lo soporta: se filtra en cliente)
+INCREMENTAL_SYNC = True
+SINCE_PARAM = "desde"
+
+# Suscripción MQTT (push): mismo broker/tópico en el que publica el firmware ESP32. Cada mensaje se guarda
+# como las lecturas crudas que el servidor devuelve por HTTP (mismos nombres, sensores y timestamp), así las
+# dos fuentes se deduplican entre sí
+MQTT_BROKER = "test.mosquitto.org"
+MQTT_PORT = 1883
+MQTT_TOPIC = "umes/clima"
+MQTT_TOPIC_BIN = "umes/clima/bin"   # formato compacto por lotes del firmware (FORMATO_BIN)
+MQTT_UTC_OFFSET_H = -6        # Fecha/Hora del firmware vienen en hora de Guatemala
+# id "estacion" del firmware → estacionNombre (p. ej. {3: "UMES"}); sin entrada se usa el nombre que el
+# servidor da a ese estacionId en /lecturas, o "Estación N" si todavía no se sincronizó
+MQTT_ESTACIONES = {}
+# campo del firmware → (sensorNombre, tipoSensor, unidadMedicion) como los registra el servidor
+MQTT_SENSORES = {"temperatura": ("DHT11", "Temperatura", "°C"), "humedad": ("DHT11", "Humedad", "%"),
+                 "calidadAire": ("MQ8", "Calidad del aire", "%")}
+
+# Filas por página de las tablas, tope de filas vivas en cada Treeview y puntos en gráfico (tras downsampling)
 MAX_ROWS_TABLE = 300
+TABLE_MAX_ITEMS = 3000
 MAX_POINTS_CHART = 300
+# Reducción de puntos: "lttb" (conserva la forma) o "minmax" (conserva picos exactos por cubeta)
+DOWNSAMPLE_MODE = "lttb"
+
+# Rollups pre-agregados (segundos por cubeta) y rangos de las gráficas; None = últimas lecturas
+ROLLUP_RES = (60, 600, 3600, 86400)
+RANGOS = {"Reciente": None, "24 h": 86400, "7 días": 7 * 86400, "30 días": 30 * 86400, "1 año": 365 * 86400}
+
+# Zoom/desplazamiento con la barra de navegación: espera tras el último cambio del eje X antes de consultar;
+# teselas de TESELA_PUNTOS cubetas por (estación, resolución) en una LRU de hasta TESELAS_MAX
+ZOOM_DEBOUNCE_MS = 150
+TESELA_PUNTOS = 256
+TESELAS_MAX = 256
+
+# Particiones mensuales (UTC) de crudas/consolidadas. Retención en meses (incluido el actual; None = todo):
+# se borra tirando las tablas de un mes por trabajo del worker. El espacio libre se devuelve al disco en
+# pasos de VACUUM_PAGINAS entre trabajos; el mantenimiento corre al abrir y cada MANTENIMIENTO_S
+RETENCION_MESES = None
+VACUUM_PAGINAS = 2000
+MANTENIMIENTO_S = 3600
+
+# Exportación por bloques (memoria constante)
+EXPORT_CHUNK = 5000
+
+# Margen libre a la derecha del eje X: los puntos nuevos caben y se dibujan por blitting
+CHART_X_HEADROOM = 0.05
+
+# Instrumentación (panel Diagnóstico): muestras por span para p50/p95 y eventos guardados para la traza
+TRACE_VENTANA = 200
+TRACE_MAX_EVENTOS = 20000
 
 # Tamaño de ventana
 WIN_GEOM = "1200x720"
@@ -26,10 +103,302 @@ WIN_GEOM = "1200x720"
 
 # ----------- HTTP Session (keep-alive) -----------
 _HTTP = requests.Session()
-_HTTP.headers.update({"User-Agent": "MeteoDashboard/1.0"})
+# gzip/deflate siempre; br solo si está instalado brotli (urllib3 lo descomprime)
+_HTTP.headers.update({"User-Agent": "MeteoDashboard/1.0", "Accept-Encoding": requests.utils.DEFAULT_ACCEPT_ENCODING})
 # -------------------------------------------------
 
+# ------------- Instrumentación (spans) -------------
+class Tracer:
+    """Duraciones por nombre de span: ventana móvil para p50/p95 y eventos para chrome://tracing / Perfetto.
+    Desactivado (por defecto) cada función instrumentada solo paga una comprobación de `activo`."""
+    def __init__(self, ventana=TRACE_VENTANA, max_eventos=TRACE_MAX_EVENTOS):
+        self.activo = False; self.ventana = ventana
+        self._lock = threading.Lock()
+        self._dur = {}                            # nombre → deque de ms (últimas `ventana`)
+        self._tot = defaultdict(lambda: [0, 0.0, 0.0])   # nombre → [n, total ms, máx ms] desde limpiar()
+        self._eventos = deque(maxlen=max_eventos)        # (nombre, hilo, inicio s, duración s)
+        self._t0 = time.perf_counter()
+
+    def registrar(self, nombre, t_ini, t_fin):
+        ms = (t_fin - t_ini) * 1000.0; hilo = threading.current_thread().name
+        with self._lock:
+            d = self._dur.get(nombre)
+            if d is None: d = self._dur[nombre] = deque(maxlen=self.ventana)
+            d.append(ms)
+            tot = self._tot[nombre]; tot[0] += 1; tot[1] += ms; tot[2] = max(tot[2], ms)
+            self._eventos.append((nombre, hilo, t_ini - self._t0, t_fin - t_ini))
+
+    def limpiar(self):
+        with self._lock:
+            self._dur.clear(); self._tot.clear(); self._eventos.clear(); self._t0 = time.perf_counter()
+
+    def resumen(self):
+        """[(nombre, n, p50, p95, máx, total), ...] en ms, ordenado por tiempo total."""
+        with self._lock:
+            datos = [(k, list(v), tuple(self._tot[k])) for k, v in self._dur.items()]
+        out = []
+        for nombre, ms, (n, total, mx) in datos:
+            p50, p95 = np.percentile(ms, (50, 95))
+            out.append((nombre, n, float(p50), float(p95), mx, total))
+        return sorted(out, key=lambda r: -r[5])
+
+    def exportar_json(self, path):
+        campos = ("n", "p50_ms", "p95_ms", "max_ms", "total_ms")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"generado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                       "spans": {r[0]: dict(zip(campos, r[1:])) for r in self.resumen()}}, f, ensure_ascii=False, indent=1)
+
+    def exportar_chrome(self, path):
+        """Formato Trace Event (eventos completos "X" en µs), un carril por hilo."""
+        with self._lock:
+            eventos = list(self._eventos)
+        pid = os.getpid(); tids = {}
+        traza = []
+        for nombre, hilo, ini, dur in eventos:
+            tid = tids.setdefault(hilo, len(tids) + 1)
+            traza.append({"name": nombre, "ph": "X", "pid": pid, "tid": tid, "ts": round(ini * 1e6, 1), "dur": round(dur * 1e6, 1)})
+        traza += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": hilo}} for hilo, tid in tids.items()]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": traza, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+TRACER = Tracer()
+
+def traza(nombre=None):
+    """Decorador de span; sin tracer activo llama directo a la función."""
+    def deco(fn):
+        etiqueta = nombre or fn.__qualname__
+        @functools.wraps(fn)
+        def envuelta(*args, **kwargs):
+            if not TRACER.activo:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                TRACER.registrar(etiqueta, t0, time.perf_counter())
+        return envuelta
+    return deco
+
 # ----------------- DB utils -----------------
+_DB_LOCAL = threading.local()
+METRICAS = ("temperatura", "presion", "altitud", "calidadAire")   # columnas de lecturas_consolidadas
+
+def db_conn():
+    """Conexión persistente por hilo. WAL deja leer a la UI mientras el worker escribe."""
+    conn = getattr(_DB_LOCAL, "conn", None)
+    if conn is None or _DB_LOCAL.path != DB_FILE:
+        if conn is not None: conn.close()
+        conn = sqlite3.connect(DB_FILE)
+        # auto_vacuum antes que WAL: en una base nueva solo se fija antes de escribir la cabecera
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS stg_crudas (
+            pos INTEGER PRIMARY KEY, timestamp TEXT, estacion_id INTEGER, sensor_id INTEGER
+        )""")
+        _DB_LOCAL.conn = conn; _DB_LOCAL.path = DB_FILE
+        _DB_LOCAL.particiones = set(); _DB_LOCAL.diccs = None; _DB_LOCAL.dims = None   # cachés de esta conexión
+    return conn
+
+def _ts_epoch(s):
+    """ISO-8601 → segundos epoch (UTC si no trae zona). None si no se puede interpretar."""
+    if not s:
+        return None
+    try:
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+# ---- Payload crudo comprimido (raw_z) ----
+# Campos con columna propia y tipos que la columna conserva tal cual; lo demás (o un tipo distinto) va al residuo
+_RAW_COLS = {"lecturaId": (int,), "valor": (float,), "timestamp": (str,), "sensorNombre": (str,),
+             "tipoSensor": (str,), "unidadMedicion": (str,), "estacionNombre": (str,), "estacionUbicacion": (str,)}
+# Diccionario 0 (fijo): hasta entrenar uno con payloads reales; los entrenados quedan en raw_diccionarios
+_RAW_ZDICT0 = b'null,true,false,"id":"sensorId":"estacionId":"createdAt":"updatedAt":"T00:00:00.000Z"}'
+_RAW_WBITS = 13   # ventana de 8 KB: cabe el diccionario y copiar el compresor preparado es barato
+
+def _raw_diccs(conn, recargar=False):
+    """{versión: zdict} de la base abierta por este hilo (se lee una vez por conexión)."""
+    d = _DB_LOCAL.diccs
+    if d is None or recargar:
+        d = _DB_LOCAL.diccs = {0: _RAW_ZDICT0}
+        d.update(conn.execute("SELECT version, zdict FROM raw_diccionarios"))
+    return d
+
+def _raw_entrenar(conn, restos):
+    """zlib no entrena diccionarios: el de uso es una muestra de payloads reales con lo más frecuente
+    al final (distancias cortas). Se guarda como versión nueva; cada blob recuerda la suya."""
+    frec = Counter(restos).most_common(RAW_DICC_MUESTRAS)
+    zdict = b"".join(r for r, _ in reversed(frec))[-(1 << _RAW_WBITS):]
+    diccs = _raw_diccs(conn); v = max(diccs) + 1
+    with conn: conn.execute("INSERT INTO raw_diccionarios (version, zdict) VALUES (?, ?)", (v, zdict))
+    diccs[v] = zdict
+
+def _raw_residuo(it, ubic=None):
+    """Campos que las columnas no reconstruyen; la ubicación sale de la estación salvo que esta lectura traiga otra."""
+    resto = {k: v for k, v in it.items() if k not in _RAW_COLS or type(v) not in _RAW_COLS[k]}
+    if it.get("estacionUbicacion") != ubic: resto["estacionUbicacion"] = it.get("estacionUbicacion")
+    return json.dumps(resto, ensure_ascii=False, separators=(",", ":")).encode() if resto else b""
+
+def _raw_codificar(conn, items, ubics=None):
+    """Payloads → blobs raw_z: versión del diccionario (1 byte) + deflate crudo del residuo; b"" si no hay residuo.
+    ubics: ubicación registrada de la estación de cada lectura."""
+    restos = [_raw_residuo(it, u) for it, u in zip(items, ubics or [None] * len(items))]
+    diccs = _raw_diccs(conn)
+    if len(diccs) == 1 and sum(1 for r in restos if r) >= RAW_DICC_MUESTRAS:
+        _raw_entrenar(conn, [r for r in restos if r])
+    v = max(diccs); cab = bytes((v,)); out = []
+    # cargar el diccionario cuesta más que comprimir un residuo: se carga una vez y se copia el estado
+    base = zlib.compressobj(9, zlib.DEFLATED, -_RAW_WBITS, 4, zlib.Z_DEFAULT_STRATEGY, diccs[v])
+    for r in restos:
+        if not r:
+            out.append(b""); continue
+        co = base.copy()
+        out.append(cab + co.compress(r) + co.flush())
+    return out
+
+def _raw_decodificar(conn, raw_z):
+    diccs = _raw_diccs(conn)
+    if raw_z[0] not in diccs: diccs = _raw_diccs(conn, recargar=True)   # entrenado por otro hilo
+    do = zlib.decompressobj(-_RAW_WBITS, diccs[raw_z[0]])
+    return json.loads(do.decompress(raw_z[1:]) + do.flush())
+
+# ---- Particiones mensuales ----
+# Una tabla por mes (UTC) y tipo, p. ej. lecturas_crudas_p202510; cada una con sus propios índices.
+# Se eligieron tablas en el mismo archivo y no un archivo por mes con ATTACH: SQLite admite 10 bases
+# adjuntas por conexión y un año de historia ya no cabría.
+_DDL_PARTICION = {
+    "lecturas_crudas": ("""
+    CREATE TABLE IF NOT EXISTS {t} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lecturaId INTEGER,
+        valor REAL,
+        timestamp TEXT,
+        estacion_id INTEGER,
+        sensor_id INTEGER,
+        raw_json TEXT,
+        epoch INTEGER,
+        raw_z BLOB,
+        UNIQUE(timestamp, estacion_id, sensor_id)
+    )""",
+        "CREATE INDEX IF NOT EXISTS ix_{t}_epoch ON {t}(epoch)",
+        "CREATE INDEX IF NOT EXISTS ix_{t}_est_epoch ON {t}(estacion_id, epoch)"),
+    "lecturas_consolidadas": ("""
+    CREATE TABLE IF NOT EXISTS {t} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT,
+        fecha TEXT,
+        hora TEXT,
+        estacion_id INTEGER,
+        temperatura REAL,
+        presion REAL,
+        altitud REAL,
+        calidadAire REAL,
+        epoch INTEGER,
+        UNIQUE(ts, estacion_id)
+    )""",
+        "CREATE INDEX IF NOT EXISTS ix_{t}_epoch ON {t}(epoch)",
+        # Cubre la consulta "últimas N de la estación X" sin tocar la tabla
+        # (el id tras epoch permite paginar por (epoch, id) sin ordenar)
+        """CREATE INDEX IF NOT EXISTS ix_{t}_est_epoch_id ON {t}
+    (estacion_id, epoch, id, fecha, hora, temperatura, presion, altitud, calidadAire, ts)"""),
+}
+
+@functools.lru_cache(maxsize=4096)
+def _mes_dia(dia):
+    t = time.gmtime(dia * 86400); return t.tm_year * 100 + t.tm_mon
+
+def _mes(ep):
+    """Epoch (s) → mes UTC como entero AAAAMM."""
+    return _mes_dia(int(ep) // 86400)
+
+def _mes_mas(mes, k):
+    i = mes // 100 * 12 + mes % 100 - 1 + k
+    return i // 12 * 100 + i % 12 + 1
+
+def _mes_inicio(mes):
+    return int(datetime(mes // 100, mes % 100, 1, tzinfo=timezone.utc).timestamp())
+
+def _particion(conn, base, mes):
+    """Nombre de la partición del mes; la crea (con sus índices) la primera vez que se escribe en ella."""
+    t = f"{base}_p{mes}"
+    if t not in _DB_LOCAL.particiones:
+        with conn:
+            for ddl in _DDL_PARTICION[base]: conn.execute(ddl.format(t=t))
+        _DB_LOCAL.particiones.add(t)
+    return t
+
+def _particiones(conn, base, t0=None, t1=None, desc=False):
+    """Router: particiones de `base` que se solapan con [t0, t1) (None = sin límite), de la más antigua
+    a la más reciente (o al revés con desc). Solo lee el catálogo; las demás ni se abren."""
+    meses = sorted(int(n[len(base) + 2:]) for (n,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?", (f"{base}_p[0-9][0-9][0-9][0-9][0-9][0-9]",)))
+    if t0 is not None: meses = [m for m in meses if _mes_inicio(_mes_mas(m, 1)) > t0]
+    if t1 is not None: meses = [m for m in meses if _mes_inicio(m) < t1]
+    return [f"{base}_p{m}" for m in (meses[::-1] if desc else meses)]
+
+# ---- Dimensiones: estaciones y sensores ----
+# Los hechos (particiones y rollup) guardan ids enteros; el texto está una sola vez en estas tablas
+
+class Dimensiones:
+    """Caché en memoria de estaciones y sensores (texto → id), una por conexión. La ingesta da de alta cada
+    nombre la primera vez que lo ve y después solo consulta el dict. Los ids no se reutilizan
+    (AUTOINCREMENT), así que un id cacheado nunca cambia de significado."""
+    def __init__(self, conn):
+        self.estaciones = {}; self.ubicaciones = {}; self.sensores = {}
+        self.servidor = {}               # estacionId del servidor → nombre (para nombrar lo que llega por MQTT)
+        self.recargar(conn)
+
+    def recargar(self, conn):
+        for i, nombre, ubic, sid in conn.execute("SELECT id, nombre, ubicacion, servidor_id FROM estaciones"):
+            self.estaciones[nombre] = i; self.ubicaciones[i] = ubic
+            if sid is not None: self.servidor[sid] = nombre
+        self.sensores.update(((n, t, u), i) for i, n, t, u in conn.execute("SELECT id, nombre, tipo, unidad FROM sensores"))
+
+    def estacion(self, conn, nombre, ubicacion=None):
+        """id de la estación; si es nueva se da de alta con la ubicación de su primera lectura. None sin nombre."""
+        if nombre is None: return None
+        i = self.estaciones.get(nombre)
+        if i is None:
+            conn.execute("INSERT OR IGNORE INTO estaciones (nombre, ubicacion) VALUES (?, ?)", (nombre, ubicacion))
+            i, ubic = conn.execute("SELECT id, ubicacion FROM estaciones WHERE nombre = ?", (nombre,)).fetchone()
+            self.estaciones[nombre] = i; self.ubicaciones[i] = ubic
+        return i
+
+    def sensor(self, conn, nombre, tipo, unidad):
+        """id del sensor (nombre, tipo, unidad); los None también son parte de la clave."""
+        k = (nombre, tipo, unidad); i = self.sensores.get(k)
+        if i is None:
+            fila = conn.execute("SELECT id FROM sensores WHERE nombre IS ? AND tipo IS ? AND unidad IS ?", k).fetchone()
+            i = self.sensores[k] = fila[0] if fila else \
+                conn.execute("INSERT INTO sensores (nombre, tipo, unidad) VALUES (?, ?, ?)", k).lastrowid
+        return i
+
+    def enlazar(self, conn, sid, nombre):
+        """Anota que el servidor llama `nombre` a su estacionId `sid` (la estación ya debe existir)."""
+        if self.servidor.get(sid) == nombre: return
+        with conn:
+            conn.execute("UPDATE estaciones SET servidor_id = NULL WHERE servidor_id = ?", (sid,))
+            conn.execute("UPDATE estaciones SET servidor_id = ? WHERE nombre = ?", (sid, nombre))
+        self.servidor[sid] = nombre
+
+    def nombre_servidor(self, conn, sid):
+        if sid not in self.servidor: self.recargar(conn)
+        return self.servidor.get(sid)
+
+    def id_estacion(self, conn, nombre):
+        """Solo lectura: id de una estación ya registrada (None si no existe); releer cubre altas de otro hilo."""
+        if nombre not in self.estaciones: self.recargar(conn)
+        return self.estaciones.get(nombre)
+
+def _dims(conn):
+    if _DB_LOCAL.dims is None: _DB_LOCAL.dims = Dimensiones(conn)
+    return _DB_LOCAL.dims
+
 def _table_has_unique_on_lecturaid(conn):
     cur = conn.cursor()
     cur.execute("PRAGMA table_info(lecturas_crudas)")
@@ -49,38 +418,89 @@ def _table_has_unique_on_lecturaid(conn):
         pass
     return False
 
+# Rollups: n/suma/mín/máx por métrica y (resolución, estación, cubeta); la media es suma/n
+_DDL_ROLLUP = f"""
+    CREATE TABLE IF NOT EXISTS lecturas_rollup (
+        res INTEGER,
+        estacion_id INTEGER,
+        bucket INTEGER,
+        n INTEGER,
+        {", ".join(f"{m}_n INTEGER, {m}_sum REAL, {m}_min REAL, {m}_max REAL" for m in METRICAS)},
+        PRIMARY KEY (res, estacion_id, bucket)
+    ) WITHOUT ROWID"""
+_ROLLUP_COLS = ", ".join(f"{m}_n, {m}_sum, {m}_min, {m}_max" for m in METRICAS)
+
 def db_init():
-    conn = sqlite3.connect(DB_FILE)
+    conn = db_conn()
     c = conn.cursor()
+    # Dimensiones (AUTOINCREMENT: un id borrado no se reutiliza)
     c.execute("""
-    CREATE TABLE IF NOT EXISTS lecturas_crudas (
+    CREATE TABLE IF NOT EXISTS estaciones (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        lecturaId INTEGER,
-        valor REAL,
-        timestamp TEXT,
-        sensorNombre TEXT,
-        tipoSensor TEXT,
-        unidadMedicion TEXT,
-        estacionNombre TEXT,
-        estacionUbicacion TEXT,
-        raw_json TEXT,
-        UNIQUE(timestamp, estacionNombre, sensorNombre, unidadMedicion)
+        nombre TEXT NOT NULL UNIQUE,
+        ubicacion TEXT,
+        servidor_id INTEGER
     )""")
+    if "servidor_id" not in [r[1] for r in c.execute("PRAGMA table_info(estaciones)")]:
+        c.execute("ALTER TABLE estaciones ADD COLUMN servidor_id INTEGER")   # se llena en la próxima sincronización
     c.execute("""
-    CREATE TABLE IF NOT EXISTS lecturas_consolidadas (
+    CREATE TABLE IF NOT EXISTS sensores (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ts TEXT,
-        fecha TEXT,
-        hora TEXT,
-        estacionNombre TEXT,
-        temperatura REAL,
-        presion REAL,
-        altitud REAL,
-        calidadAire REAL,
-        UNIQUE(ts, estacionNombre)
+        nombre TEXT,
+        tipo TEXT,
+        unidad TEXT,
+        UNIQUE(nombre, tipo, unidad)
+    )""")
+    # Versión de datos por estación: la ingesta la sube con cada lote que agrega filas; la UI la compara
+    # antes de consultar nada (refresco sin novedades = una lectura de esta tabla)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS versiones (
+        estacion_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL
+    )""")
+    # Marca de agua por estación: última (timestamp, lecturaId) ya ingerida
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS cursores_sync (
+        estacionNombre TEXT PRIMARY KEY,
+        ultimoTs TEXT,
+        ultimoId INTEGER
+    )""")
+    # Marca de agua por partición de consolidadas: id de la última fila ya agregada
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_marcas (
+        tabla TEXT PRIMARY KEY,
+        ultimoId INTEGER NOT NULL
+    )""")
+    # Diccionarios de compresión de raw_z (la versión 0 es fija, en el código)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS raw_diccionarios (
+        version INTEGER PRIMARY KEY,
+        zdict BLOB NOT NULL
     )""")
     conn.commit()
 
+    compactar = False
+    if c.execute("SELECT COUNT(*) FROM sqlite_master WHERE name IN ('lecturas_crudas', 'lecturas_consolidadas')"
+                 ).fetchone()[0]:
+        _migrar_legado(conn); compactar = True
+    compactar |= _migrar_dimensiones(conn)
+    c.execute(_DDL_ROLLUP); conn.commit()
+    if RAW_MODO == "residuo":
+        for t in _particiones(conn, "lecturas_crudas"):
+            compactar |= _raw_migrar(conn, t) > 0
+    # Bases anteriores sin auto_vacuum incremental: db_conn ya lo pidió, se aplica con un VACUUM
+    compactar |= c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+    if compactar:
+        print("Compactando la base (una sola vez)…")
+        c.execute("VACUUM")
+
+    # Caché previa sin rollups (o proceso cortado a medias): agregar lo pendiente desde las marcas
+    db_update_rollup()
+
+def _migrar_legado(conn):
+    """Bases anteriores a las particiones: se ponen al día con las migraciones de siempre sobre las tablas
+    únicas, se agrega lo pendiente al rollup y se reparten las filas por mes. Luego se tiran las tablas viejas."""
+    c = conn.cursor()
     # Migración si existía UNIQUE(lecturaId)
     if _table_has_unique_on_lecturaid(conn):
         try:
@@ -98,6 +518,7 @@ def db_init():
                 estacionNombre TEXT,
                 estacionUbicacion TEXT,
                 raw_json TEXT,
+                epoch INTEGER,
                 UNIQUE(timestamp, estacionNombre, sensorNombre, unidadMedicion)
             )""")
             conn.commit()
@@ -112,178 +533,1176 @@ def db_init():
             conn.commit()
         except Exception as e:
             print("Migración de DB falló:", e)
-    conn.close()
 
+    # Columnas que pudieran faltar (epoch, raw_z); sin epoch la fila no tiene mes ni la UI la mostraba
+    conn.create_function("ts_epoch", 1, _ts_epoch, deterministic=True)
+    conn.create_function("mes_utc", 1, _mes, deterministic=True)
+    existen = {n for (n,) in c.execute(
+        "SELECT name FROM sqlite_master WHERE name IN ('lecturas_crudas', 'lecturas_consolidadas')")}
+    tablas = [t for t in _DDL_PARTICION if t in existen]   # crudas primero (ver _copiar_normalizado)
+    for tabla in tablas:
+        col = "timestamp" if tabla == "lecturas_crudas" else "ts"
+        c.execute(f"PRAGMA table_info({tabla})")
+        cols = [r[1] for r in c.fetchall()]
+        if "epoch" not in cols:
+            c.execute(f"ALTER TABLE {tabla} ADD COLUMN epoch INTEGER")
+        if tabla == "lecturas_crudas" and "raw_z" not in cols:
+            c.execute("ALTER TABLE lecturas_crudas ADD COLUMN raw_z BLOB")
+        c.execute(f"UPDATE {tabla} SET epoch = ts_epoch({col}) WHERE epoch IS NULL AND {col} IS NOT NULL")
+    conn.commit()
+
+    # Caché previa sin cursores: sembrarlos desde lo ya almacenado
+    if "lecturas_crudas" in tablas and c.execute("SELECT COUNT(*) FROM cursores_sync").fetchone()[0] == 0:
+        with conn: c.execute("""
+        INSERT OR IGNORE INTO cursores_sync (estacionNombre, ultimoTs, ultimoId)
+        SELECT estacionNombre, MAX(timestamp), lecturaId
+        FROM lecturas_crudas
+        WHERE estacionNombre IS NOT NULL AND timestamp IS NOT NULL
+        GROUP BY estacionNombre""")
+
+    # El rollup anterior (marca única, por nombre) se descarta: las particiones tienen toda la historia y
+    # db_init lo recalcula desde ellas con las marcas en cero
+    with conn:
+        c.execute("DROP TABLE IF EXISTS lecturas_rollup"); c.execute("DROP TABLE IF EXISTS rollup_estado")
+        c.execute("DELETE FROM rollup_marcas")
+
+    for tabla in tablas:
+        meses = sorted(m for (m,) in c.execute(f"SELECT DISTINCT mes_utc(epoch) FROM {tabla} WHERE epoch IS NOT NULL"))
+        n = 0
+        for mes in meses:
+            n += _copiar_normalizado(conn, tabla, tabla, _particion(conn, tabla, mes), "epoch >= ? AND epoch < ?",
+                                     (_mes_inicio(mes), _mes_inicio(_mes_mas(mes, 1))))
+        with conn: c.execute(f"DROP TABLE {tabla}")
+        print(f"{tabla}: {n} filas repartidas en {len(meses)} particiones mensuales")
+
+def _copiar_normalizado(conn, base, origen, destino, where="1", params=()):
+    """Filas con el esquema de texto (estacionNombre, sensorNombre, …) → partición con ids, en una transacción.
+    Da de alta las estaciones y sensores que falten; los raw_z de lecturas con otra ubicación que la
+    registrada para su estación se recodifican con la ubicación en el residuo. Devuelve las filas copiadas."""
+    dims = _dims(conn)
+    with conn:
+        if base == "lecturas_consolidadas":
+            for (nombre,) in conn.execute(f"SELECT DISTINCT estacionNombre FROM {origen} WHERE {where}", params).fetchall():
+                dims.estacion(conn, nombre)
+            return conn.execute(f"""
+            INSERT OR IGNORE INTO {destino} (ts, fecha, hora, estacion_id, temperatura, presion, altitud, calidadAire, epoch)
+            SELECT o.ts, o.fecha, o.hora, e.id, o.temperatura, o.presion, o.altitud, o.calidadAire, o.epoch
+            FROM {origen} o LEFT JOIN estaciones e ON e.nombre = o.estacionNombre
+            WHERE {where} ORDER BY o.epoch, o.id""", params).rowcount
+        # ubicación de cada estación = la de su lectura más antigua
+        for nombre, ubic, _ in conn.execute(f"SELECT estacionNombre, estacionUbicacion, MIN(id) FROM {origen} "
+                                            f"WHERE {where} GROUP BY estacionNombre", params).fetchall():
+            dims.estacion(conn, nombre, ubic)
+        for k in conn.execute(f"SELECT DISTINCT sensorNombre, tipoSensor, unidadMedicion FROM {origen} WHERE {where}",
+                              params).fetchall():
+            dims.sensor(conn, *k)
+        otras = conn.execute(f"""
+        SELECT o.id, o.raw_z, e.ubicacion, {", ".join(f"o.{k}" for k in _RAW_COLS)}
+        FROM {origen} o JOIN estaciones e ON e.nombre = o.estacionNombre
+        WHERE {where} AND o.raw_z IS NOT NULL AND o.estacionUbicacion IS NOT e.ubicacion""", params).fetchall()
+        if otras:
+            items = []
+            for _, raw_z, _, *cols in otras:
+                it = {k: v for k, v in zip(_RAW_COLS, cols) if v is not None}
+                if raw_z: it.update(_raw_decodificar(conn, raw_z))
+                items.append(it)
+            conn.executemany(f"UPDATE {origen} SET raw_z = ? WHERE id = ?",
+                             zip(_raw_codificar(conn, items, [f[2] for f in otras]), [f[0] for f in otras]))
+        return conn.execute(f"""
+        INSERT OR IGNORE INTO {destino} (lecturaId, valor, timestamp, estacion_id, sensor_id, raw_json, epoch, raw_z)
+        SELECT o.lecturaId, o.valor, o.timestamp, e.id, s.id, o.raw_json, o.epoch, o.raw_z
+        FROM {origen} o
+        LEFT JOIN estaciones e ON e.nombre = o.estacionNombre
+        LEFT JOIN sensores s ON s.nombre IS o.sensorNombre AND s.tipo IS o.tipoSensor AND s.unidad IS o.unidadMedicion
+        WHERE {where} ORDER BY o.epoch, o.id""", params).rowcount
+
+def _migrar_dimensiones(conn):
+    """Particiones y rollup con nombres en texto (esquema anterior) → ids de estaciones y sensores.
+    Cada partición se renombra a *_v, se copia a una nueva y se tira; si el proceso se corta, las *_v que
+    queden se retoman al abrir. Devuelve si hubo algo que migrar."""
+    c = conn.cursor(); hubo = False
+    for base in _DDL_PARTICION:   # crudas primero: la ubicación de cada estación sale de sus lecturas
+        for t in _particiones(conn, base):
+            if "estacionNombre" not in [r[1] for r in c.execute(f"PRAGMA table_info({t})")]: continue
+            with conn:
+                for (ix,) in c.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                                       "AND sql IS NOT NULL", (t,)).fetchall():
+                    c.execute(f"DROP INDEX {ix}")
+                c.execute(f"ALTER TABLE {t} RENAME TO {t}_v")
+            _DB_LOCAL.particiones.discard(t)
+        for (tv,) in c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name",
+                               (f"{base}_p[0-9][0-9][0-9][0-9][0-9][0-9]_v",)).fetchall():
+            t = _particion(conn, base, int(tv[-8:-2]))
+            n = _copiar_normalizado(conn, base, tv, t)
+            with conn: c.execute(f"DROP TABLE {tv}")
+            print(f"{t}: {n} filas con ids de estación/sensor"); hubo = True
+    cols = [r[1] for r in c.execute("PRAGMA table_info(lecturas_rollup)")]
+    if "estacionNombre" in cols:
+        dims = _dims(conn)
+        with conn:
+            c.execute("ALTER TABLE lecturas_rollup RENAME TO lecturas_rollup_v")
+            c.execute(_DDL_ROLLUP)
+            for (nombre,) in c.execute("SELECT DISTINCT estacionNombre FROM lecturas_rollup_v").fetchall():
+                dims.estacion(conn, nombre)
+            c.execute(f"""
+            INSERT INTO lecturas_rollup (res, estacion_id, bucket, n, {_ROLLUP_COLS})
+            SELECT r.res, e.id, r.bucket, r.n, {_ROLLUP_COLS}
+            FROM lecturas_rollup_v r JOIN estaciones e ON e.nombre = r.estacionNombre""")
+            c.execute("DROP TABLE lecturas_rollup_v")
+        hubo = True
+    return hubo
+
+def _raw_migrar(conn, tabla):
+    """raw_json de bases anteriores → raw_z por bloques (una transacción por bloque: se puede cortar y retomar).
+    Los payloads que no son un objeto JSON se dejan como estaban. Devuelve las filas migradas
+    (db_init compacta el archivo una vez al final si hubo)."""
+    ultimo = total = 0
+    while True:
+        filas = conn.execute(f"""
+        SELECT c.id, c.raw_json, e.ubicacion FROM {tabla} c LEFT JOIN estaciones e ON e.id = c.estacion_id
+        WHERE c.raw_json IS NOT NULL AND c.id > ? ORDER BY c.id LIMIT ?""", (ultimo, EXPORT_CHUNK)).fetchall()
+        if not filas: break
+        ultimo = filas[-1][0]
+        ids, items, ubics = [], [], []
+        for rid, raw, ubic in filas:
+            try:
+                it = json.loads(raw)
+            except ValueError:
+                continue
+            if isinstance(it, dict): ids.append(rid); items.append(it); ubics.append(ubic)
+        with conn:
+            conn.executemany(f"UPDATE {tabla} SET raw_z = ?, raw_json = NULL WHERE id = ?",
+                             zip(_raw_codificar(conn, items, ubics), ids))
+        total += len(ids)
+    if total:
+        print(f"{tabla}: raw_json → raw_z, {total} lecturas migradas")
+    return total
+
+# Sentencias fijas por partición ({t}): sqlite3 reutiliza el statement preparado mientras el texto SQL no cambie
+_SQL_STG_RAW = """
+INSERT INTO temp.stg_crudas (pos, timestamp, estacion_id, sensor_id)
+VALUES (?, ?, ?, ?)"""
+_SQL_NEW_RAW = """
+SELECT s.pos FROM temp.stg_crudas s
+WHERE NOT EXISTS (
+    SELECT 1 FROM {t} c
+    WHERE c.timestamp = s.timestamp AND c.estacion_id = s.estacion_id AND c.sensor_id = s.sensor_id)"""
+_SQL_INS_RAW = """
+INSERT OR IGNORE INTO {t}
+(lecturaId, valor, timestamp, estacion_id, sensor_id, raw_json, raw_z, epoch)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+_SQL_INS_CONSO = """
+INSERT OR IGNORE INTO {t}
+(ts, fecha, hora, estacion_id, temperatura, presion, altitud, calidadAire, epoch)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+# Agrega las consolidadas con id en (desde, hasta] a todas las resoluciones; las cubetas existentes se combinan
+# (min()/max() de SQLite con un NULL dan NULL → coalesce)
+_ROLLUP_SET = ",\n    ".join(
+    f"{m}_n = {m}_n + excluded.{m}_n, "
+    f"{m}_sum = coalesce({m}_sum + excluded.{m}_sum, {m}_sum, excluded.{m}_sum), "
+    f"{m}_min = coalesce(min({m}_min, excluded.{m}_min), {m}_min, excluded.{m}_min), "
+    f"{m}_max = coalesce(max({m}_max, excluded.{m}_max), {m}_max, excluded.{m}_max)"
+    for m in METRICAS)
+_SQL_ROLLUP = f"""
+INSERT INTO lecturas_rollup
+(res, estacion_id, bucket, n, {_ROLLUP_COLS})
+SELECT r.res, c.estacion_id, c.epoch / r.res * r.res, COUNT(*),
+       {", ".join(f"COUNT(c.{m}), SUM(c.{m}), MIN(c.{m}), MAX(c.{m})" for m in METRICAS)}
+FROM {{t}} c
+JOIN ({" UNION ALL ".join(f"SELECT {r} AS res" for r in ROLLUP_RES)}) r
+WHERE c.id > ? AND c.id <= ? AND c.epoch IS NOT NULL AND c.estacion_id IS NOT NULL{{filtro}}
+GROUP BY r.res, c.estacion_id, c.epoch / r.res
+ON CONFLICT (res, estacion_id, bucket) DO UPDATE SET
+    n = n + excluded.n,
+    {_ROLLUP_SET}"""
+
+_SQL_VERSION = """
+INSERT INTO versiones (estacion_id, version) VALUES (?, 1)
+ON CONFLICT (estacion_id) DO UPDATE SET version = version + 1"""
+
+def _versiones_subir(conn, ids):
+    """Sube la versión de datos de las estaciones `ids` (None = todas las registradas)."""
+    if ids is None: ids = [i for (i,) in conn.execute("SELECT id FROM estaciones")]
+    with conn: conn.executemany(_SQL_VERSION, [(i,) for i in ids if i is not None])
+
+def _executemany(conn, sql, params, etiqueta):
+    """executemany en una sola transacción; devuelve filas realmente insertadas (total_changes).
+    Si el lote falla se reintenta fila a fila para no perder las filas válidas."""
+    antes = conn.total_changes
+    try:
+        with conn: conn.executemany(sql, params)
+    except sqlite3.Error as e:
+        print(f"DB {etiqueta} insert error (lote):", e)
+        antes = conn.total_changes   # lo revertido también cuenta en total_changes
+        for p in params:
+            try:
+                with conn: conn.execute(sql, p)
+            except sqlite3.Error as e:
+                print(f"DB {etiqueta} insert error:", e)
+    return conn.total_changes - antes
+
+@traza()
 def db_insert_raw(items):
     if not items:
         return 0
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    added = 0
-    for it in items:
-        try:
-            c.execute("""
-            INSERT OR IGNORE INTO lecturas_crudas
-            (lecturaId, valor, timestamp, sensorNombre, tipoSensor, unidadMedicion, estacionNombre, estacionUbicacion, raw_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                it.get("lecturaId"), it.get("valor"), it.get("timestamp"),
-                it.get("sensorNombre"), it.get("tipoSensor"), it.get("unidadMedicion"),
-                it.get("estacionNombre"), it.get("estacionUbicacion"),
-                json.dumps(it, ensure_ascii=False)
-            ))
-            if c.rowcount > 0:
-                added += 1
-        except Exception as e:
-            print("DB raw insert error:", e)
-    conn.commit(); conn.close()
-    return added
+    conn = db_conn()
+    # cada lectura va a la partición de su mes; sin fecha interpretable no tiene mes (la UI nunca la mostró)
+    por_mes = defaultdict(list)
+    for it, ep in zip(items, ts_to_epoch([it.get("timestamp") for it in items])):
+        if ep == ep: por_mes[_mes(ep)].append((it, int(ep)))
+    return sum(_insert_raw_mes(conn, _particion(conn, "lecturas_crudas", mes), grupo)
+               for mes, grupo in sorted(por_mes.items()))
 
+def _insert_raw_mes(conn, t, grupo):
+    # 0) nombres → ids (altas nuevas en la misma transacción que el staging),
+    # 1) claves a staging y 2) INSERT ... solo de las que no existen: payload codificado únicamente para filas nuevas
+    dims = _dims(conn)
+    with conn:
+        ids = [(dims.estacion(conn, it.get("estacionNombre"), it.get("estacionUbicacion")),
+                dims.sensor(conn, it.get("sensorNombre"), it.get("tipoSensor"), it.get("unidadMedicion")))
+               for it, _ in grupo]
+        conn.execute("DELETE FROM temp.stg_crudas")
+        conn.executemany(_SQL_STG_RAW, [(i, it.get("timestamp"), *k) for i, ((it, _), k) in enumerate(zip(grupo, ids))])
+        nuevas = [(*grupo[p], *ids[p]) for (p,) in conn.execute(_SQL_NEW_RAW.format(t=t))]
+    items = [x[0] for x in nuevas]
+    if RAW_MODO == "residuo":
+        crudos = [None] * len(items); zs = _raw_codificar(conn, items, [dims.ubicaciones.get(x[2]) for x in nuevas])
+    else:
+        crudos = [json.dumps(it, ensure_ascii=False) for it in items] if RAW_MODO == "json" else [None] * len(items)
+        zs = [None] * len(items)
+    n = _executemany(conn, _SQL_INS_RAW.format(t=t), [
+        (it.get("lecturaId"), it.get("valor"), it.get("timestamp"), est, sen, cr, z, ep)
+        for (it, ep, est, sen), cr, z in zip(nuevas, crudos, zs)], "raw")
+    if n: _versiones_subir(conn, {x[2] for x in nuevas})
+    return n
+
+@traza()
 def db_insert_consolidated(rows):
     if not rows:
         return 0
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    added = 0
-    for r in rows:
-        try:
-            c.execute("""
-            INSERT OR IGNORE INTO lecturas_consolidadas
-            (ts, fecha, hora, estacionNombre, temperatura, presion, altitud, calidadAire)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (r["ts"], r["fecha"], r["hora"], r["estacionNombre"],
-                  r.get("temperatura"), r.get("presion"),
-                  r.get("altitud"), r.get("calidadAire")))
-            if c.rowcount > 0: added += 1
-        except Exception as e:
-            print("DB consolidated insert error:", e)
-    conn.commit(); conn.close()
+    conn = db_conn()
+    dims = _dims(conn)
+    por_mes = defaultdict(list)   # (mes, estación): así se sabe qué estaciones agregaron filas
+    with conn:
+        # FilaConso ya trae el orden de columnas; solo cambia el nombre de la estación por su id
+        for r in rows:
+            if r.epoch is None: continue
+            est = dims.estacion(conn, r.estacionNombre)
+            por_mes[(_mes(r.epoch), est or 0)].append(r._replace(estacionNombre=est))
+    added = 0; tocadas = {}; subir = set()
+    for (mes, est), grupo in sorted(por_mes.items()):
+        t = _particion(conn, "lecturas_consolidadas", mes)
+        n = _executemany(conn, _SQL_INS_CONSO.format(t=t), grupo, "consolidated")
+        if n: added += n; tocadas[t] = None; subir.add(est)
+    if tocadas: db_update_rollup(list(tocadas)); _versiones_subir(conn, subir)
     return added
 
-def db_fetch_raw(limit=MAX_ROWS_TABLE, est=None):
-    conn = sqlite3.connect(DB_FILE); c = conn.cursor()
-    if est:
-        c.execute("""
-        SELECT lecturaId, timestamp, estacionNombre, sensorNombre, tipoSensor, unidadMedicion, valor
-        FROM lecturas_crudas
-        WHERE estacionNombre = ?
-        ORDER BY datetime(timestamp) DESC
-        LIMIT ?""", (est, limit))
-    else:
-        c.execute("""
-        SELECT lecturaId, timestamp, estacionNombre, sensorNombre, tipoSensor, unidadMedicion, valor
-        FROM lecturas_crudas
-        ORDER BY datetime(timestamp) DESC
-        LIMIT ?""", (limit,))
-    rows = c.fetchall(); conn.close()
-    return rows[::-1]
+@traza()
+def db_update_rollup(tablas=None):
+    """Agrega a lecturas_rollup las consolidadas posteriores a la marca de cada partición (todas, o solo
+    `tablas`) y avanza las marcas, en una transacción. Si el proceso muere entre la inserción y el rollup,
+    la siguiente llamada retoma desde las marcas."""
+    conn = db_conn()
+    if tablas is None: tablas = _particiones(conn, "lecturas_consolidadas")
+    n = 0
+    with conn:
+        for t in tablas:
+            fila = conn.execute("SELECT ultimoId FROM rollup_marcas WHERE tabla = ?", (t,)).fetchone()
+            desde = fila[0] if fila else 0
+            hasta = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {t}").fetchone()[0]
+            if hasta <= desde: continue
+            conn.execute(_SQL_ROLLUP.format(t=t, filtro=""), (desde, hasta))
+            conn.execute("INSERT OR REPLACE INTO rollup_marcas (tabla, ultimoId) VALUES (?, ?)", (t, hasta))
+            n += hasta - desde
+    return n
+
+# Nombres de las dimensiones para las consultas de la UI (c = la partición)
+_JOIN_ESTACION = "LEFT JOIN estaciones e ON e.id = c.estacion_id"
+_JOIN_SENSOR = "LEFT JOIN sensores s ON s.id = c.sensor_id"
 
-def db_fetch_consolidated(limit=MAX_ROWS_TABLE, est=None):
-    conn = sqlite3.connect(DB_FILE); c = conn.cursor()
+def _db_page(base, cols, joins, limit, est, before, after):
+    """Página por clave (epoch, id), servida por los índices (estacion_id, epoch) / (epoch):
+    sin `before`/`after` → las `limit` más recientes; `before` → las anteriores; `after` → las posteriores.
+    Recorre las particiones desde el borde de la página y para al juntar `limit` filas (las de un mes
+    tienen epochs anteriores a las del siguiente, así que (epoch, id) sigue ordenando entre particiones).
+    Devuelve filas en orden ascendente con (epoch, id) añadidos al final."""
+    conn = db_conn()
+    where = ["c.epoch IS NOT NULL"]; params = []
     if est:
-        c.execute("""
-        SELECT fecha, hora, estacionNombre, temperatura, presion, altitud, calidadAire, ts
-        FROM lecturas_consolidadas
-        WHERE estacionNombre = ?
-        ORDER BY datetime(ts) DESC
-        LIMIT ?""", (est, limit))
+        est = _dims(conn).id_estacion(conn, est)
+        if est is None: return []
+        where.append("c.estacion_id = ?"); params.append(est)
+    if after:
+        where.append("(c.epoch, c.id) > (?, ?)"); params += after; order = "ASC"
+        tablas = _particiones(conn, base, t0=after[0])
     else:
-        c.execute("""
-        SELECT fecha, hora, estacionNombre, temperatura, presion, altitud, calidadAire, ts
-        FROM lecturas_consolidadas
-        ORDER BY datetime(ts) DESC
-        LIMIT ?""", (limit,))
-    rows = c.fetchall(); conn.close()
+        order = "DESC"
+        if before: where.append("(c.epoch, c.id) < (?, ?)"); params += before
+        tablas = _particiones(conn, base, t1=before[0] + 1 if before else None, desc=True)
+    cond = " AND ".join(where)
+    rows = []
+    for t in tablas:
+        rows += conn.execute(f"""
+        SELECT {cols}, c.epoch, c.id
+        FROM {t} c {joins}
+        WHERE {cond}
+        ORDER BY c.epoch {order}, c.id {order}
+        LIMIT ?""", (*params, limit - len(rows))).fetchall()
+        if len(rows) >= limit: break
+    return rows if after else rows[::-1]
+
+@traza()
+def db_fetch_raw(limit=MAX_ROWS_TABLE, est=None, before=None, after=None):
+    return _db_page("lecturas_crudas",
+                    "c.lecturaId, c.timestamp, e.nombre, s.nombre, s.tipo, s.unidad, c.valor",
+                    f"{_JOIN_ESTACION} {_JOIN_SENSOR}", limit, est, before, after)
+
+@traza()
+def db_fetch_payload(epoch, rid):
+    """Payload de una lectura cruda tal como llegó (salvo el orden de claves); None si no se guardó.
+    El epoch elige la partición. Solo aquí se descomprime raw_z: la tabla nunca lo toca."""
+    conn = db_conn(); t = f"lecturas_crudas_p{_mes(epoch)}"
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (t,)).fetchone():
+        return None   # partición purgada
+    # mismas columnas y orden que _RAW_COLS
+    row = conn.execute(f"""
+    SELECT c.raw_json, c.raw_z, c.lecturaId, c.valor, c.timestamp, s.nombre, s.tipo, s.unidad, e.nombre, e.ubicacion
+    FROM {t} c {_JOIN_ESTACION} {_JOIN_SENSOR}
+    WHERE c.id = ?""", (rid,)).fetchone()
+    if row is None: return None
+    raw_json, raw_z, *cols = row
+    if raw_json is not None: return json.loads(raw_json)
+    if raw_z is None: return None
+    it = {k: v for k, v in zip(_RAW_COLS, cols) if v is not None}
+    if raw_z: it.update(_raw_decodificar(conn, raw_z))
+    return it
+
+@traza()
+def db_fetch_consolidated(limit=MAX_ROWS_TABLE, est=None, before=None, after=None):
+    return _db_page("lecturas_consolidadas",
+                    "c.fecha, c.hora, e.nombre, c.temperatura, c.presion, c.altitud, c.calidadAire, c.ts",
+                    _JOIN_ESTACION, limit, est, before, after)
+
+@traza()
+def db_fetch_series(est, limit):
+    """Últimas `limit` filas (epoch + métricas) de una estación; servida por el índice cubriente
+    de cada partición, de la más reciente hacia atrás hasta juntar `limit`."""
+    conn = db_conn(); rows = []
+    est = _dims(conn).id_estacion(conn, est)
+    if est is None: return rows
+    for t in _particiones(conn, "lecturas_consolidadas", desc=True):
+        rows += conn.execute(f"""
+        SELECT epoch, temperatura, presion, altitud, calidadAire
+        FROM {t}
+        WHERE estacion_id = ? AND epoch IS NOT NULL
+        ORDER BY epoch DESC
+        LIMIT ?""", (est, limit - len(rows))).fetchall()
+        if len(rows) >= limit: break
     return rows[::-1]
 
+def pick_resolution(span, max_points=MAX_POINTS_CHART):
+    """Resolución de rollup más gruesa que aún da `max_points` cubetas en `span` segundos; 0 = filas consolidadas."""
+    for res in sorted(ROLLUP_RES, reverse=True):
+        if span / res >= max_points:
+            return res
+    return 0
+
+def resolucion_lod(span, px):
+    """Resolución más fina que no da más puntos que píxeles de ancho en `span` segundos (zoom).
+    0 = filas consolidadas (una por minuto, como la cubeta más fina)."""
+    for res in (0,) + tuple(sorted(ROLLUP_RES)):
+        if span / (res or min(ROLLUP_RES)) <= px:
+            return res
+    return max(ROLLUP_RES)
+
+@traza()
+def db_fetch_range(est, t0, t1, res=0):
+    """Serie (epoch + métricas) de una estación en [t0, t1).
+    res=0 → filas consolidadas (solo de las particiones del rango);
+    res>0 → una fila por cubeta del rollup (media, x en el centro de la cubeta)."""
+    conn = db_conn()
+    est = _dims(conn).id_estacion(conn, est)
+    if est is None: return []
+    if res:
+        return conn.execute(f"""
+        SELECT bucket + ?, {", ".join(f"{m}_sum / {m}_n" for m in METRICAS)}
+        FROM lecturas_rollup
+        WHERE res = ? AND estacion_id = ? AND bucket >= ? AND bucket < ?
+        ORDER BY bucket""", (res / 2, res, est, t0 // res * res, t1)).fetchall()
+    rows = []
+    for t in _particiones(conn, "lecturas_consolidadas", t0, t1):
+        rows += conn.execute(f"""
+        SELECT epoch, temperatura, presion, altitud, calidadAire
+        FROM {t}
+        WHERE estacion_id = ? AND epoch >= ? AND epoch < ?
+        ORDER BY epoch""", (est, t0, t1)).fetchall()
+    return rows
+
+@traza()
 def db_fetch_estaciones():
-    conn = sqlite3.connect(DB_FILE); c = conn.cursor()
-    c.execute("SELECT DISTINCT estacionNombre FROM lecturas_crudas ORDER BY estacionNombre ASC")
-    rows = [r[0] for r in c.fetchall() if r[0]]
-    conn.close(); return rows
+    # La dimensión: una fila por estación, sin tocar particiones ni rollup
+    return [r[0] for r in db_conn().execute("SELECT nombre FROM estaciones ORDER BY nombre ASC")]
 
-def db_export_csv(path, est=None):
-    conn = sqlite3.connect(DB_FILE); c = conn.cursor()
-    if est:
-        c.execute("""
-        SELECT fecha, hora, estacionNombre, temperatura, presion, altitud, calidadAire, ts
-        FROM lecturas_consolidadas
-        WHERE estacionNombre = ?
-        ORDER BY datetime(ts)""", (est,))
-    else:
-        c.execute("""
-        SELECT fecha, hora, estacionNombre, temperatura, presion, altitud, calidadAire, ts
-        FROM lecturas_consolidadas
-        ORDER BY datetime(ts)""")
-    rows = c.fetchall(); conn.close()
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(["Fecha","Hora","Estacion","Temperatura(°C)","Presion(hPa)","Altitud(m)","CalidadAire(%)","Timestamp"])
-        w.writerows(rows)
-    return len(rows)
+@traza()
+def db_fetch_versiones():
+    """{estación: versión de datos}. Cambia cuando la ingesta agrega filas de una estación o aparece una nueva."""
+    return dict(db_conn().execute("""
+    SELECT e.nombre, COALESCE(v.version, 0)
+    FROM estaciones e LEFT JOIN versiones v ON v.estacion_id = e.id"""))
+
+def db_enlazar_estaciones(items):
+    """estacionId → estacionNombre de las lecturas del servidor (solo HTTP: un nombre provisional de MQTT
+    no debe enlazarse). Las estaciones ya están dadas de alta por db_insert_raw. Lo que llegó por MQTT
+    antes del primer enlace, con el nombre provisional "Estación N", pasa a la estación real.
+    Devuelve los nombres provisionales fusionados (la caché de series que los tenga quedó vieja)."""
+    conn = db_conn(); dims = _dims(conn); fusionadas = []
+    for sid, nombre in {it.get("estacionId"): it.get("estacionNombre") for it in items}.items():
+        if sid is None or nombre not in dims.estaciones: continue
+        dims.enlazar(conn, sid, nombre)
+        prov = f"Estación {sid}"
+        if prov != nombre and prov in dims.estaciones:
+            de = dims.estaciones.pop(prov); dims.ubicaciones.pop(de, None)
+            _fusionar_estacion(conn, de, dims.estaciones[nombre]); fusionadas.append(prov)
+    return fusionadas
+
+def _fusionar_estacion(conn, de, a):
+    """Pasa las lecturas de la estación `de` a la `a` y borra `de`. Las que `a` ya tiene (mismo timestamp y
+    sensor / mismo ts) se descartan; las cubetas de rollup de los días tocados se rehacen desde las
+    consolidadas ya agregadas (id <= marca: el resto lo agrega db_update_rollup). Una transacción."""
+    crudas = _particiones(conn, "lecturas_crudas"); conso = _particiones(conn, "lecturas_consolidadas")
+    bordes = [conn.execute(f"SELECT MIN(epoch), MAX(epoch) FROM {t} WHERE estacion_id = ?", (de,)).fetchone()
+              for t in conso]
+    bordes = [b for b in bordes if b[0] is not None]
+    with conn:
+        for t in crudas:
+            conn.execute(f"""DELETE FROM {t} WHERE estacion_id = ? AND EXISTS (SELECT 1 FROM {t} x
+                WHERE x.timestamp = {t}.timestamp AND x.estacion_id = ? AND x.sensor_id = {t}.sensor_id)""", (de, a))
+            conn.execute(f"UPDATE {t} SET estacion_id = ? WHERE estacion_id = ?", (a, de))
+        for t in conso:
+            conn.execute(f"""DELETE FROM {t} WHERE estacion_id = ? AND EXISTS (SELECT 1 FROM {t} x
+                WHERE x.ts = {t}.ts AND x.estacion_id = ?)""", (de, a))
+            conn.execute(f"UPDATE {t} SET estacion_id = ? WHERE estacion_id = ?", (a, de))
+        conn.executemany("DELETE FROM lecturas_rollup WHERE res = ? AND estacion_id = ?", [(r, de) for r in ROLLUP_RES])
+        if bordes:
+            # días completos: toda resolución divide 86400, así ninguna cubeta queda a medias
+            t0 = min(b[0] for b in bordes) // 86400 * 86400; t1 = (max(b[1] for b in bordes) // 86400 + 1) * 86400
+            conn.executemany("DELETE FROM lecturas_rollup WHERE res = ? AND estacion_id = ? AND bucket >= ? AND bucket < ?",
+                             [(r, a, t0, t1) for r in ROLLUP_RES])
+            for t in _particiones(conn, "lecturas_consolidadas", t0, t1):
+                fila = conn.execute("SELECT ultimoId FROM rollup_marcas WHERE tabla = ?", (t,)).fetchone()
+                conn.execute(_SQL_ROLLUP.format(t=t, filtro=" AND c.estacion_id = ? AND c.epoch >= ? AND c.epoch < ?"),
+                             (0, fila[0] if fila else 0, a, t0, t1))
+        conn.execute("DELETE FROM versiones WHERE estacion_id = ?", (de,))
+        conn.execute("DELETE FROM estaciones WHERE id = ?", (de,))
+    _versiones_subir(conn, [a])
+
+def db_nombrar_mqtt(items):
+    """Completa estacionNombre de lecturas MQTT sin MQTT_ESTACIONES con el nombre que el servidor da a su
+    estacionId; "Estación N" si aún no se sincronizó por HTTP."""
+    conn = db_conn(); dims = _dims(conn); nombres = {}
+    for it in items:
+        if it["estacionNombre"] is None:
+            sid = it["estacionId"]
+            if sid not in nombres: nombres[sid] = dims.nombre_servidor(conn, sid) or f"Estación {sid}"
+            it["estacionNombre"] = nombres[sid]
+    return items
+
+@traza()
+def db_fetch_cursores():
+    c = db_conn().cursor()
+    c.execute("SELECT estacionNombre, ultimoTs, ultimoId FROM cursores_sync")
+    return {r[0]: (r[1] or "", r[2] or 0) for r in c.fetchall()}
+
+@traza()
+def db_update_cursores(items):
+    """Avanza el cursor de cada estación hasta la lectura más reciente de items."""
+    tope = {}
+    for it in items:
+        est = it.get("estacionNombre"); ts = it.get("timestamp")
+        if not est or not ts: continue
+        k = (ts, it.get("lecturaId") or 0)
+        if est not in tope or k > tope[est]: tope[est] = k
+    if not tope:
+        return
+    conn = db_conn()
+    with conn: conn.executemany("""
+    INSERT INTO cursores_sync (estacionNombre, ultimoTs, ultimoId) VALUES (?, ?, ?)
+    ON CONFLICT(estacionNombre) DO UPDATE SET ultimoTs = excluded.ultimoTs, ultimoId = excluded.ultimoId
+    WHERE (excluded.ultimoTs, excluded.ultimoId) > (ultimoTs, ultimoId)
+    """, [(est, ts, lid) for est, (ts, lid) in tope.items()])
+
+@traza()
+def db_purgar(meses=RETENCION_MESES, ahora=None, maximo=None):
+    """Retención: tira las particiones de los meses anteriores a los últimos `meses`, de la más antigua
+    en adelante y a lo sumo `maximo` meses por llamada (None = todos), junto con los rollups de menos de
+    una hora hasta el fin de esos meses; los de 1 h y 1 día se conservan para los rangos largos.
+    No es O(1): DROP TABLE recorre el árbol del mes para pasar sus páginas a la lista libre (un año de
+    historia de una vez bloquea el worker un par de segundos); con maximo=1 cada paso cuesta un mes.
+    Devuelve las tablas borradas ([] cuando ya no queda nada que purgar)."""
+    if not meses:
+        return []
+    conn = db_conn()
+    corte = _mes_inicio(_mes_mas(_mes(ahora or time.time()), 1 - meses))
+    por_mes = {}
+    for base in _DDL_PARTICION:
+        for t in _particiones(conn, base, t1=corte): por_mes.setdefault(int(t[-6:]), []).append(t)
+    viejos = sorted(por_mes)[:maximo]
+    tiradas = [t for m in viejos for t in por_mes[m]]
+    if not tiradas:
+        return []
+    fin = _mes_inicio(_mes_mas(viejos[-1], 1))
+    ests = [r[0] for r in conn.execute("SELECT id FROM estaciones")]
+    with conn:
+        for t in tiradas:
+            conn.execute(f"DROP TABLE {t}"); _DB_LOCAL.particiones.discard(t)
+        conn.executemany("DELETE FROM rollup_marcas WHERE tabla = ?", [(t,) for t in tiradas])
+        # por estación: rango sobre la clave primaria (res, estacion_id, bucket) en vez de recorrer cada res
+        conn.executemany("DELETE FROM lecturas_rollup WHERE res = ? AND estacion_id = ? AND bucket < ?",
+                         [(r, e, fin) for r in ROLLUP_RES if r < 3600 for e in ests])
+    _versiones_subir(conn, None)
+    return tiradas
+
+@traza()
+def db_borrar_todo():
+    """Vacía la caché local: particiones, cursores, rollups, sus marcas, versiones y dimensiones
+    (los diccionarios de raw_z se quedan)."""
+    conn = db_conn()
+    tablas = [t for base in _DDL_PARTICION for t in _particiones(conn, base)]
+    with conn:
+        for t in tablas: conn.execute(f"DROP TABLE {t}")
+        for t in ("cursores_sync", "lecturas_rollup", "rollup_marcas", "versiones", "estaciones", "sensores"):
+            conn.execute(f"DELETE FROM {t}")
+    _DB_LOCAL.particiones.clear(); _DB_LOCAL.dims = None
+
+@traza()
+def db_vacuum_paso(paginas=VACUUM_PAGINAS):
+    """Devuelve al disco hasta `paginas` páginas libres (auto_vacuum=INCREMENTAL); corto para no
+    bloquear al worker. Devuelve las páginas libres que quedan."""
+    conn = db_conn()
+    # por execute() el pragma avanza un solo paso (una página); executescript lo corre hasta el final
+    conn.executescript(f"PRAGMA incremental_vacuum({int(paginas)});")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+_EXPORT_HEADER = ["Fecha","Hora","Estacion","Temperatura(°C)","Presion(hPa)","Altitud(m)","CalidadAire(%)","Timestamp"]
+
+def _export_sink(path):
+    """(write(rows), close()) según la extensión: .parquet (pyarrow), .gz (CSV gzip) o CSV."""
+    if path.endswith(".parquet"):
+        schema = pa.schema([("fecha", pa.string()), ("hora", pa.string()), ("estacion", pa.string()),
+                            ("temperatura", pa.float64()), ("presion", pa.float64()), ("altitud", pa.float64()),
+                            ("calidadAire", pa.float64()), ("ts", pa.string())])
+        w = pq.ParquetWriter(path, schema)
+        def write(rows):   # un row group por bloque
+            w.write_table(pa.Table.from_arrays([pa.array(col, type=f.type) for col, f in zip(zip(*rows), schema)],
+                                               schema=schema))
+        return write, w.close
+    f = gzip.open(path, "wt", newline="", encoding="utf-8") if path.endswith(".gz") \
+        else open(path, "w", newline="", encoding="utf-8")
+    w = csv.writer(f); w.writerow(_EXPORT_HEADER)
+    return w.writerows, f.close
+
+def _day_epoch(fecha):
+    return int(datetime.strptime(fecha, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+@traza()
+def db_export(path, est=None, desde=None, hasta=None, progress=None, cancel=None):
+    """Exporta lecturas_consolidadas en bloques de EXPORT_CHUNK con un cursor (memoria constante),
+    partición por partición y solo las del rango.
+    desde/hasta: "YYYY-MM-DD" inclusivos (UTC). progress(hechas, total) tras cada bloque;
+    si cancel (threading.Event) se activa se borra el archivo parcial.
+    Devuelve (filas, path final, cancelado); sin pyarrow un .parquet se escribe como .csv.gz."""
+    if path.endswith(".parquet") and pq is None:
+        path = path[:-len(".parquet")] + ".csv.gz"
+    conn = db_conn()
+    where = ["c.epoch IS NOT NULL"]; params = []
+    if est: where.append("c.estacion_id = ?"); params.append(_dims(conn).id_estacion(conn, est))
+    if desde: where.append("c.epoch >= ?"); params.append(_day_epoch(desde))
+    if hasta: where.append("c.epoch < ?"); params.append(_day_epoch(hasta) + 86400)
+    cond = " AND ".join(where)
+    tablas = _particiones(conn, "lecturas_consolidadas", desde and _day_epoch(desde),
+                          hasta and _day_epoch(hasta) + 86400)
+    total = sum(conn.execute(f"SELECT COUNT(*) FROM {t} c WHERE {cond}", params).fetchone()[0] for t in tablas)
+    write, close = _export_sink(path)
+    n = 0; cancelado = False
+    try:
+        for t in tablas:
+            c = conn.execute(f"""
+            SELECT c.fecha, c.hora, e.nombre, c.temperatura, c.presion, c.altitud, c.calidadAire, c.ts
+            FROM {t} c {_JOIN_ESTACION}
+            WHERE {cond}
+            ORDER BY c.epoch""", params)
+            while not cancelado:
+                rows = c.fetchmany(EXPORT_CHUNK)
+                if not rows: break
+                write(rows); n += len(rows)
+                if progress: progress(n, total)
+                cancelado = cancel is not None and cancel.is_set()
+            c.close()
+            if cancelado: break
+    finally:
+        close()
+    if cancelado and os.path.exists(path): os.remove(path)
+    return n, path, cancelado
 
 # --------------- Fetch & consolidate ---------------
-def http_get_lecturas():
-    r = _HTTP.get(URL, timeout=15)
-    r.raise_for_status()
-    data = r.json()
-    if not isinstance(data, list):
-        raise ValueError("La respuesta no es una lista")
-    return data
-
-def consolidate(items):
-    buckets = defaultdict(lambda: {"temperatura": None, "presion": None, "altitud": None, "calidadAire": None,
-                                   "ts": None, "fecha": None, "hora": None, "estacionNombre": None})
+class CircuitoAbierto(RuntimeError):
+    pass
+
+class HttpFetcher:
+    """GET de una lista JSON con:
+    - GET condicional (ETag / Last-Modified de la última respuesta): 304 → None, sin parsear nada.
+    - Reintentos ante errores de red, 429 y 5xx con backoff exponencial y jitter (o Retry-After).
+    - Cortacircuitos: tras HTTP_CB_FALLOS descargas fallidas seguidas no se intenta en HTTP_CB_ESPERA s.
+    - Validación (Content-Type, primer byte) antes de json.loads: una página HTML de arranque no se parsea.
+    session/sleep/clock inyectables para probarlo contra un servidor local."""
+    def __init__(self, session=None, sleep=time.sleep, clock=time.monotonic):
+        self.session = session or _HTTP; self._sleep = sleep; self._clock = clock
+        self._validadores = (None, None, None)   # (clave de la petición, ETag, Last-Modified)
+        self.fallos = 0; self.abierto_hasta = 0.0
+
+    def get_lista(self, url, params=None):
+        ahora = self._clock()
+        if self.fallos >= HTTP_CB_FALLOS and ahora < self.abierto_hasta:
+            raise CircuitoAbierto(f"Servidor no disponible; nuevo intento en {self.abierto_hasta - ahora:.0f} s")
+        clave = (url, tuple(sorted((params or {}).items())))
+        try:
+            r = self._get(url, params, clave)
+            datos = None if r.status_code == 304 else self._parse(r)
+        except Exception:
+            self.fallos += 1
+            if self.fallos >= HTTP_CB_FALLOS: self.abierto_hasta = self._clock() + HTTP_CB_ESPERA
+            raise
+        self.fallos = 0
+        if datos is not None:
+            self._validadores = (clave, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+        return datos
+
+    def _get(self, url, params, clave):
+        headers = {}
+        k, etag, modif = self._validadores
+        if k == clave:
+            if etag: headers["If-None-Match"] = etag
+            if modif: headers["If-Modified-Since"] = modif
+        for intento in range(HTTP_REINTENTOS + 1):
+            ultimo = intento == HTTP_REINTENTOS; espera = None
+            try:
+                r = self.session.get(url, params=params, headers=headers, timeout=HTTP_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout):
+                if ultimo: raise
+            else:
+                if r.status_code == 304 or ultimo or (r.status_code != 429 and r.status_code < 500):
+                    r.raise_for_status(); return r
+                try: espera = min(float(r.headers.get("Retry-After", "")), HTTP_CB_ESPERA)
+                except ValueError: pass
+            if espera is None:
+                espera = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** intento))
+            self._sleep(espera)
+
+    @staticmethod
+    def _parse(r):
+        ctype = r.headers.get("Content-Type", "")
+        if ctype and "json" not in ctype:
+            raise ValueError(f"Respuesta inesperada del servidor ({ctype.split(';')[0]})")
+        body = r.content                 # ya descomprimido
+        if body.lstrip()[:1] != b"[":
+            raise ValueError("La respuesta no es una lista")
+        return json.loads(body)
+
+_LECTURAS = HttpFetcher()
+
+@traza()
+def http_get_lecturas(desde=None):
+    """Descarga /lecturas; con `desde` pide al servidor solo lo posterior (si SINCE_PARAM lo permite).
+    None = el servidor respondió 304 (sin cambios desde la última descarga)."""
+    params = {SINCE_PARAM: desde} if (desde and SINCE_PARAM) else None
+    return _LECTURAS.get_lista(URL, params)
+
+def filtrar_nuevas(items, cursores):
+    """Descarta lecturas ya ingeridas según el cursor (timestamp, lecturaId) de su estación.
+    Necesario aunque el servidor filtre: `desde` es el mínimo de todas las estaciones."""
+    if not cursores:
+        return items
+    out = []
+    for it in items:
+        cur = cursores.get(it.get("estacionNombre"))
+        if cur is None or ((it.get("timestamp") or ""), (it.get("lecturaId") or 0)) > cur:
+            out.append(it)
+    return out
+
+# Fila consolidada: mismos campos y orden que las columnas de _SQL_INS_CONSO (va directo a executemany)
+FilaConso = namedtuple("FilaConso", "ts fecha hora estacionNombre temperatura presion altitud calidadAire epoch")
+
+# Unidad (en minúsculas) → índice en METRICAS; tipo/sensor solo deciden calidadAire si la unidad no lo hizo.
+# La humedad también viene en % pero no tiene columna: queda solo en las crudas
+_UNIDAD_METRICA = {"°c": 0, "c": 0, "celsius": 0, "hpa": 1, "m": 2, "%": 3}
+_METRICA_CACHE = {}
+
+def _metrica(unidad, tipo, sensor):
+    """(unidad, tipo, sensor) tal como llegan → índice en METRICAS o None. Se resuelve una vez por combinación."""
+    k = (unidad, tipo, sensor)
+    m = _METRICA_CACHE.get(k, -1)
+    if m != -1:
+        return m
+    t = (tipo or "").lower()
+    if "humedad" in t: m = None
+    else:
+        m = _UNIDAD_METRICA.get((unidad or "").lower())
+        if m is None and ("calidad" in t or (sensor or "").lower() == "mq8"):
+            m = 3
+    if len(_METRICA_CACHE) > 4096: _METRICA_CACHE.clear()   # combinaciones basura no crecen sin límite
+    _METRICA_CACHE[k] = m
+    return m
+
+def _ts_partes(ts):
+    """timestamp → (fecha, hora, epoch) con un solo parseo; fecha/hora en la hora de pared del propio texto."""
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, TypeError, ValueError):
+        return ts[:10], ts[11:19] if len(ts) >= 19 else "", None
+    ep = int((dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp())
+    return dt.date().isoformat(), f"{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}", ep
+
+@traza()
+def consolidate(items, previas=None):
+    """Lecturas crudas → FilaConso por (ts, estación), ordenadas por (ts, estación).
+    Cada timestamp distinto se interpreta una vez; previas = salida ordenada anterior en la que se intercalan."""
+    buckets = {}; partes = {}
     for it in items:
         ts = it.get("timestamp"); est = it.get("estacionNombre")
         if not ts or not est: continue
-        b = buckets[(ts, est)]
-        b["ts"] = ts; b["estacionNombre"] = est
+        b = buckets.get((ts, est))
+        if b is None:
+            p = partes.get(ts)
+            if p is None: p = partes[ts] = _ts_partes(ts)
+            b = buckets[(ts, est)] = [ts, p[0], p[1], est, None, None, None, None, p[2]]
+        m = _metrica(it.get("unidadMedicion"), it.get("tipoSensor"), it.get("sensorNombre"))
+        if m is not None: b[4 + m] = it.get("valor")
+    rows = [FilaConso._make(buckets[k]) for k in sorted(buckets)]   # ya casi ordenado: timsort lineal
+    return merge_consolidadas(previas, rows) if previas else rows
+
+def merge_consolidadas(a, b):
+    """Intercala dos listas de FilaConso ordenadas por (ts, estación); en claves repetidas se completa con lo no nulo de b."""
+    if not a or not b:
+        return list(a or b)
+    if (a[-1].ts, a[-1].estacionNombre) < (b[0].ts, b[0].estacionNombre):
+        return a + b                     # caso común: solo llegan lecturas posteriores
+    out = []; i = j = 0; na = len(a); nb = len(b)
+    while i < na and j < nb:
+        x = a[i]; y = b[j]; kx = (x.ts, x.estacionNombre); ky = (y.ts, y.estacionNombre)
+        if kx < ky: out.append(x); i += 1
+        elif ky < kx: out.append(y); j += 1
+        else:
+            out.append(FilaConso._make(v if v is not None else u for u, v in zip(x, y))); i += 1; j += 1
+    out += a[i:]; out += b[j:]
+    return out
+
+# --------------- MQTT (push) ---------------
+def _mqtt_crudas(dt, est, valores):
+    """Una lectura del firmware → lecturas crudas como las del servidor, una por sensor de MQTT_SENSORES
+    (timestamp UTC con milisegundos y Z). estacionNombre queda None sin MQTT_ESTACIONES: lo pone
+    db_nombrar_mqtt en el worker. mq8_raw y las estadísticas del MQ-8 no las guarda el servidor."""
+    ts = dt.strftime("%Y-%m-%dT%H:%M:%S.000Z"); nombre = MQTT_ESTACIONES.get(est)
+    return [{"valor": v, "timestamp": ts, "sensorNombre": sen, "tipoSensor": tipo, "unidadMedicion": unidad,
+             "estacionNombre": nombre, "estacionId": est}
+            for campo, (sen, tipo, unidad) in MQTT_SENSORES.items() if (v := valores.get(campo)) is not None]
+
+def decode_mqtt_payload(payload):
+    """JSON del firmware (Fecha/Hora/temperatura/humedad/mq8_raw/calidadAire/estacion) → lecturas crudas.
+    Fecha/Hora se pasan a UTC para que el timestamp coincida con el de la misma lectura en el servidor."""
+    d = json.loads(payload)
+    if not isinstance(d, dict) or not d.get("Fecha") or not d.get("Hora") or d.get("estacion") is None:
+        raise ValueError("payload MQTT incompleto")
+    if type(d["estacion"]) is not int:   # bool/float/lista/str → fuera (es clave de dicts y de la BD)
+        raise ValueError(f"estacion MQTT inválida: {d['estacion']!r}")
+    local = datetime.fromisoformat(f"{d['Fecha']}T{d['Hora']}")
+    dt = (local - timedelta(hours=MQTT_UTC_OFFSET_H)).replace(tzinfo=timezone.utc)
+    return _mqtt_crudas(dt, d["estacion"], d)
+
+# Formato compacto del firmware: cabecera <BBH (versión, n, estación) + n registros
+# v1 <IhhHB (epoch Unix u32, temp×10 i16, hum×10 i16, mq8_raw u16, calidadAire u8); -32768 = lectura ausente
+# v2 añade <HHHH con mín/máx/media/desviación×10 del MQ-8 en el intervalo (aquí se ignoran, como en JSON)
+_BIN_CAB = struct.Struct("<BBH")
+_BIN_REGS = {1: struct.Struct("<IhhHB"), 2: struct.Struct("<IhhHBHHHH")}
+_BIN_NULO = -32768
+
+def decode_mqtt_binario(payload):
+    """Lote binario del firmware → lecturas crudas, igual que n mensajes JSON."""
+    if len(payload) < _BIN_CAB.size:
+        raise ValueError("payload binario corto")
+    version, n, est = _BIN_CAB.unpack_from(payload)
+    reg = _BIN_REGS.get(version)
+    if reg is None or len(payload) != _BIN_CAB.size + n * reg.size:
+        raise ValueError(f"payload binario inválido (v{version}, n={n}, {len(payload)} bytes)")
+    out = []
+    for ep, temp, hum, _mq, air, *_stats in reg.iter_unpack(memoryview(payload)[_BIN_CAB.size:]):
+        out += _mqtt_crudas(datetime.fromtimestamp(ep, timezone.utc), est,
+                            {"temperatura": None if temp == _BIN_NULO else temp / 10,
+                             "humedad": None if hum == _BIN_NULO else hum / 10, "calidadAire": air})
+    return out
+
+class MqttIngest:
+    """Suscriptor MQTT. paho corre su propio hilo de red; cada mensaje válido se entrega
+    decodificado (lecturas crudas) a on_items(items) y los cambios de conexión a on_status(msg).
+    Escucha el tópico JSON y el binario (MQTT_TOPIC_BIN); se distinguen por tópico."""
+    def __init__(self, on_items, on_status, broker=None, port=None, topic=None, topic_bin=None):
+        self.on_items = on_items; self.on_status = on_status
+        self.broker = broker or MQTT_BROKER; self.port = port or MQTT_PORT; self.topic = topic or MQTT_TOPIC
+        self.topic_bin = topic_bin or MQTT_TOPIC_BIN
+        self.client = None
+
+    def start(self):
+        if paho_mqtt is None:
+            raise RuntimeError("paho-mqtt no está instalado (pip install paho-mqtt)")
+        try:   # paho-mqtt 2.x exige versión de API de callbacks
+            cli = paho_mqtt.Client(paho_mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            cli = paho_mqtt.Client()
+        cli.on_connect = self._on_connect; cli.on_disconnect = self._on_disconnect
+        cli.on_message = self._on_message
+        cli.connect_async(self.broker, self.port, keepalive=30)
+        cli.loop_start(); self.client = cli
+
+    def stop(self):
+        if self.client is not None:
+            self.client.disconnect(); self.client.loop_stop(); self.client = None
+
+    # firmas distintas entre paho 1.x y 2.x → *args
+    def _on_connect(self, client, *args):
+        client.subscribe([(self.topic, 0), (self.topic_bin, 0)])   # en cada (re)conexión
+        self.on_status(f"MQTT conectado · {self.broker}/{self.topic}")
+
+    def _on_disconnect(self, client, *args):
+        self.on_status("MQTT desconectado, reintentando…")
+
+    def _on_message(self, client, userdata, msg):
         try:
-            dt = datetime.fromisoformat(ts.replace("Z",""))
-            b["fecha"] = dt.strftime("%Y-%m-%d"); b["hora"] = dt.strftime("%H:%M:%S")
-        except Exception:
-            b["fecha"] = ts[:10]; b["hora"] = ts[11:19] if len(ts) >= 19 else ""
-        unidad = (it.get("unidadMedicion") or "").lower()
-        tipo = (it.get("tipoSensor") or "").lower()
-        sensor = (it.get("sensorNombre") or "").lower()
-        val = it.get("valor")
-        if unidad in ("°c","c","celsius"): b["temperatura"] = val
-        elif unidad in ("hpa",): b["presion"] = val
-        elif unidad in ("m",): b["altitud"] = val
-        elif unidad in ("%",) or "calidad" in tipo or sensor == "mq8": b["calidadAire"] = val
-    rows = list(buckets.values())
-    rows.sort(key=lambda x: (x["ts"] or "", x["estacionNombre"] or ""))
-    return rows
+            items = decode_mqtt_binario(msg.payload) if msg.topic == self.topic_bin else decode_mqtt_payload(msg.payload)
+        except Exception as e:   # una excepción aquí mataría el hilo de red de paho
+            print("MQTT payload inválido:", e, bytes(msg.payload[:200])); return
+        if items: self.on_items(items)
 
 # ---------------- Utils: downsampling y formato tiempo ----------------
-def thin_series(xs, ys, max_points=MAX_POINTS_CHART):
-    """Reduce puntos manteniendo forma. Si xs>max_points, toma saltos equiespaciados."""
-    n = len(xs)
-    if n <= max_points:
-        return xs, ys
-    step = max(1, n // max_points)
-    xs2 = xs[::step]
-    ys2 = ys[::step]
-    # Garantizar último punto
-    if xs2[-1] != xs[-1]:
-        xs2.append(xs[-1]); ys2.append(ys[-1])
-    return xs2, ys2
-
-def parse_ts_list(ts_list):
-    """Convierte strings ISO a matplotlib datenums."""
+def _lttb_idx(t, Y, n_out):
+    """Largest-Triangle-Three-Buckets con varias métricas: el área de cada candidato es la suma
+    de las áreas de cada métrica normalizada a [0, 1]; los NaN no aportan área."""
+    n = len(t)
+    span = np.nanmax(Y, axis=1, keepdims=True) - np.nanmin(Y, axis=1, keepdims=True)
+    span[~(span > 0)] = 1.0
+    Yn = (Y - np.nanmin(Y, axis=1, keepdims=True)) / span
+    tn = (t - t[0]) / ((t[-1] - t[0]) or 1.0)
+    nb = n_out - 2
+    edges = np.linspace(1, n - 1, nb + 1).astype(np.int64)
+    # promedio de cada cubeta (ignorando NaN) → vértice C del triángulo
+    vals = np.nan_to_num(Yn); cnt = (~np.isnan(Yn)).astype(np.float64)
+    starts = np.append(edges[:-1], n - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cy = np.add.reduceat(vals, starts, axis=1) / np.add.reduceat(cnt, starts, axis=1)
+    ct = np.add.reduceat(tn, starts) / np.diff(np.append(starts, n))
+    idx = np.empty(n_out, dtype=np.int64); idx[0] = 0; idx[-1] = n - 1
+    a = 0
+    for b in range(nb):
+        lo, hi = edges[b], max(edges[b + 1], edges[b] + 1)
+        ta, ya = tn[a], Yn[:, a:a + 1]
+        tc, yc = ct[b + 1], cy[:, b + 1:b + 2]
+        area = np.abs((ta - tc) * (Yn[:, lo:hi] - ya) - (ta - tn[lo:hi]) * (yc - ya))
+        a = lo + int(np.argmax(np.nansum(area, axis=0)))
+        idx[b + 1] = a
+    return idx
+
+def _minmax_idx(Y, max_points):
+    """Mínimo y máximo de cada métrica por cubeta: los picos aparecen siempre con su valor exacto."""
+    m, n = Y.shape
+    nb = max(1, (max_points - 2) // (2 * m))
+    edges = np.linspace(0, n, nb + 1).astype(np.int64)
+    lo_v = np.where(np.isnan(Y), np.inf, Y); hi_v = np.where(np.isnan(Y), -np.inf, Y)
+    sel = [np.array([0, n - 1])]
+    for b in range(nb):
+        lo, hi = edges[b], edges[b + 1]
+        if hi <= lo: continue
+        sel.append(lo + np.argmin(lo_v[:, lo:hi], axis=1)); sel.append(lo + np.argmax(hi_v[:, lo:hi], axis=1))
+    return np.unique(np.concatenate(sel))
+
+def downsample_idx(t, Y, max_points=MAX_POINTS_CHART, mode=DOWNSAMPLE_MODE):
+    """Índices a conservar, compartidos por todas las métricas de una serie.
+    t: epoch/datenum ordenado (n,); Y: métricas (m, n) con NaN en los huecos.
+    Las métricas sin ningún valor (p. ej. presión de una estación sin BMP280) no votan: no tienen picos
+    y np.nanmax/nanmin avisarían "All-NaN slice"."""
+    n = len(t)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    vivas = ~np.isnan(Y).all(axis=1)
+    if not vivas.any():
+        return np.unique(np.linspace(0, n - 1, max_points).astype(np.int64))
+    if not vivas.all(): Y = Y[vivas]
+    if mode == "minmax":
+        return _minmax_idx(Y, max_points)
+    return _lttb_idx(t, Y, max_points)
+
+def thin_series(t, Y, max_points=MAX_POINTS_CHART, mode=DOWNSAMPLE_MODE):
+    """Reduce t (n,) y todas las métricas Y (m, n) con una única selección de índices."""
+    t = np.asarray(t, dtype=np.float64); Y = np.asarray(Y, dtype=np.float64)
+    idx = downsample_idx(t, Y, max_points, mode)
+    return t[idx], Y[:, idx]
+
+_MPL_EPOCH0 = mdates.date2num(datetime(1970, 1, 1))   # epoch 0 en unidades de matplotlib
+
+def ts_to_epoch(ts_list):
+    """Timestamps ISO → segundos epoch float64 en bloque (numpy.datetime64); NaN si no se entienden.
+    Solo si el lote trae algo que numpy no parsea (offsets ±hh:mm) se cae al parser por elemento."""
+    a = np.array([s or "" for s in ts_list], dtype=str)
+    try:
+        with warnings.catch_warnings():   # numpy avisa (y deprecará) los offsets: ir al parser lento
+            warnings.simplefilter("error")
+            d = np.char.rstrip(a, "Z").astype("datetime64[ms]")
+    except (ValueError, Warning):
+        return np.array([np.nan if (e := _ts_epoch(s)) is None else e for s in ts_list], dtype=np.float64)
+    out = d.astype(np.int64) / 1000.0
+    out[np.isnat(d)] = np.nan
+    return out
+
+def epoch_to_num(ep):
+    """Epoch (s) → datenum de matplotlib, vectorizado."""
+    return _MPL_EPOCH0 + np.asarray(ep, dtype=np.float64) / 86400.0
+
+# ---------------- Caché columnar de series ----------------
+class SeriesCache:
+    """Últimas `cap` lecturas consolidadas por estación en columnas NumPy: epoch float64 (n,)
+    y métricas (4, n) con NaN en huecos. Se llena una vez desde SQLite (epoch ya calculado,
+    sin parsear texto) y luego solo se extiende con lo que se ingiere. Solo la usa el worker.
+    También lleva las teselas del zoom, que invalida con lo que entra."""
+    def __init__(self, cap=MAX_POINTS_CHART * 3):
+        self.cap = cap; self._t = {}; self._Y = {}
+        self.teselas = TileCache()
+        self.version = 0                 # cambia con cualquier modificación → firma del snapshot
+
+    def clear(self):
+        self._t.clear(); self._Y.clear(); self.teselas.clear(); self.version += 1
+
+    def get(self, est):
+        if est not in self._t:
+            a = np.array(db_fetch_series(est, self.cap), dtype=np.float64).reshape(-1, 1 + len(METRICAS))
+            self._t[est] = a[:, 0].copy(); self._Y[est] = a[:, 1:].T.copy()
+            self.version += 1
+        return self._t[est], self._Y[est]
+
+    def extend(self, rows, added):
+        """rows: FilaConso recién ingeridas; added: cuántas insertó la DB.
+        Lo posterior al último punto se añade; si la DB aceptó filas atrasadas, la estación se recarga."""
+        por_est = defaultdict(list)
+        for r in rows:
+            if r.epoch is not None: por_est[r.estacionNombre].append(r)
+        cola = 0; atrasadas = []
+        for est, rs in por_est.items():
+            if added: self.teselas.invalidar(est, min(r.epoch for r in rs))
+            if est not in self._t:
+                cola += len(rs); continue   # se cargará completa cuando se pida
+            t = self._t[est]; last = t[-1] if len(t) else -np.inf
+            rs = sorted((r for r in rs if r.epoch > last), key=lambda r: r.epoch)
+            cola += len(rs)
+            if len(rs) < len(por_est[est]): atrasadas.append(est)
+            if not rs: continue
+            nt = np.array([r.epoch for r in rs], dtype=np.float64)
+            nY = np.array([r[4:8] for r in rs], dtype=np.float64).T   # columnas de METRICAS
+            self._t[est] = np.concatenate((t, nt))[-self.cap:]
+            self._Y[est] = np.concatenate((self._Y[est], nY), axis=1)[:, -self.cap:]
+            self.version += 1
+        if added > cola:                 # entraron filas más antiguas que el último punto cacheado
+            for est in atrasadas:
+                self._t.pop(est, None); self._Y.pop(est, None)
+        if added: self.version += 1      # también invalida las vistas por rango (rollups)
+
+class TileCache:
+    """Teselas para el zoom: (estación, resolución, k) → epoch (n,) y métricas (4, n) de la cubeta de tiempo
+    [k·span, (k+1)·span), span = TESELA_PUNTOS cubetas de la resolución. Las cuatro métricas van en la misma
+    tesela porque las cuatro gráficas comparten el eje X. LRU: solo queda en memoria lo visitado hace poco."""
+    def __init__(self, max_teselas=TESELAS_MAX):
+        self.max = max_teselas; self._d = OrderedDict(); self.aciertos = self.fallos = 0
+
+    @staticmethod
+    def _span(res):
+        return TESELA_PUNTOS * (res or min(ROLLUP_RES))
+
+    def clear(self):
+        self._d.clear()
+
+    def get(self, est, t0, t1, res):
+        """Columnas de las teselas que cubren [t0, t1) (un poco más a los lados: desplazar no consulta)."""
+        span = self._span(res); partes = []
+        for k in range(int(t0 // span), int(t1 // span) + 1):
+            clave = (est, res, k); a = self._d.get(clave)
+            if a is None:
+                self.fallos += 1
+                a = np.array(db_fetch_range(est, k * span, (k + 1) * span, res),
+                             dtype=np.float64).reshape(-1, 1 + len(METRICAS)).T
+                a.flags.writeable = False
+                self._d[clave] = a
+                if len(self._d) > self.max: self._d.popitem(last=False)
+            else:
+                self.aciertos += 1; self._d.move_to_end(clave)
+            partes.append(a)
+        a = np.concatenate(partes, axis=1)
+        return a[0], a[1:]
+
+    def invalidar(self, est, desde):
+        """Descarta las teselas de `est` que terminan después de `desde` (llegaron filas en ellas)."""
+        for clave in [c for c in self._d if c[0] == est and (c[2] + 1) * self._span(c[1]) > desde]:
+            del self._d[clave]
+
+# ---------------- Snapshots (worker → UI) ----------------
+# Resultado inmutable de una pasada de consultas; la UI solo lo pinta.
+Snapshot = namedtuple("Snapshot", "est rango estaciones firma tarjetas series")
+# Ventana de zoom/desplazamiento del usuario: [t0, t1) en epoch y ancho del eje en píxeles
+Vista = namedtuple("Vista", "t0 t1 px")
+
+def build_series(cache, estaciones, rango=None):
+    """Series → ((etiqueta, t, temp, pres, alt, air), ...) ya reducidas para graficar.
+    rango=None: caché columnar (últimas lecturas); rango en segundos: rollup de la resolución adecuada;
+    Vista: teselas a la resolución que da el ancho en píxeles (ya no hace falta reducir)."""
     out = []
-    for s in ts_list:
+    if isinstance(rango, Vista):
+        res = resolucion_lod(rango.t1 - rango.t0, rango.px)
+    elif rango:
+        t1 = int(time.time()) + 1; res = pick_resolution(rango)
+    for est in estaciones:
+        if isinstance(rango, Vista):
+            t, Y = cache.teselas.get(est, rango.t0, rango.t1, res)
+        elif rango:
+            a = np.array(db_fetch_range(est, t1 - rango, t1, res), dtype=np.float64).reshape(-1, 1 + len(METRICAS))
+            t, Y = a[:, 0], a[:, 1:].T
+        else:
+            t, Y = cache.get(est)
+        if not len(t): continue
+        if isinstance(rango, Vista):
+            x = epoch_to_num(t)
+        else:
+            x, Y = thin_series(epoch_to_num(t), Y)   # una sola selección de índices para las 4 métricas
+        x.flags.writeable = False; Y.flags.writeable = False
+        out.append((est, x, *Y))
+    return tuple(out)
+
+@traza()
+def build_snapshot(est, cache, rango=None):
+    """Todas las consultas de un refresco (sin tocar Tk): corre en el hilo worker."""
+    estaciones = ("(Todas)",) + tuple(db_fetch_estaciones())
+    if est is not None and est not in estaciones: est = None
+    series = build_series(cache, [est] if est else estaciones[1:], rango)
+    # tarjetas: última lectura de la estación más reciente
+    ultimo = None
+    for nombre in ([est] if est else estaciones[1:]):
+        t, Y = cache.get(nombre)
+        if len(t) and (ultimo is None or t[-1] > ultimo[0]):
+            ultimo = (t[-1], tuple(None if np.isnan(v) else float(v) for v in Y[:, -1]))
+    return Snapshot(est, rango, estaciones, (est, rango, cache.version),
+                    ultimo[1] if ultimo else None, series)
+
+# ---------------- Render incremental de gráficas ----------------
+class ChartRenderer:
+    """Un Line2D persistente por (estación, métrica) actualizado con set_data.
+    - Llegan puntos nuevos dentro de los límites actuales → se añaden y se hace blitting.
+    - Cambia el conjunto de estaciones, se sale de los límites o se acumulan demasiados puntos → redibujo completo.
+    - Vista agregada (rango con rollup): la última cubeta cambia en sitio → se reemplaza la serie y se intenta blitting.
+    - Vista de zoom (Vista): el eje X es del usuario; solo se reescala Y.
+    - tight_layout solo al inicio y al redimensionar.
+    Mientras ajusta ejes `ajustando` es True: quien escuche xlim_changed distingue sus cambios de los del usuario.
+    No depende de Tk: sirve con cualquier canvas de matplotlib (TkAgg, Agg)."""
+    def __init__(self, fig, canvas, axes):
+        self.fig = fig; self.canvas = canvas; self.axes = tuple(axes)
+        self.lines = {}                  # (estación, índice de métrica) → Line2D
+        self.multi = None; self.vista = None; self._bg = None; self._layout_dirty = True
+        self.ajustando = False; self.forzar = False   # forzar: el próximo update redibuja completo
+        self.last_ms = 0.0; self.last_mode = "—"
+        canvas.mpl_connect("draw_event", self._on_draw)
+        canvas.mpl_connect("resize_event", self._on_resize)
+
+    def _on_resize(self, _event):
+        # el canvas redibuja tras el resize; basta con recolocar los ejes
+        self.fig.tight_layout(pad=1.2); self._layout_dirty = False
+
+    def _on_draw(self, _event):
+        # Fondo sin las líneas (animated=True) para poder restaurarlo y repintar solo las líneas
+        self._bg = self.canvas.copy_from_bbox(self.fig.bbox)
+        for ln in self.lines.values(): self.fig.draw_artist(ln)
+
+    def _clear(self):
+        for ln in self.lines.values(): ln.remove()
+        self.lines.clear()
+
+    @traza()
+    def update(self, series, multi, lw=1.2, vista=None):
+        """series: ((etiqueta, t, temp, pres, alt, air), ...) como en Snapshot.series; vista: Snapshot.rango."""
+        # plot/set_data piden un autoescalado diferido: los límites pueden cambiar en cualquier get_xlim o draw
+        self.ajustando = True
         try:
-            dt = datetime.fromisoformat((s or "").replace("Z",""))
-        except Exception:
-            # fallback básico
-            try:
-                dt = datetime.strptime(s[:19], "%Y-%m-%dT%H:%M:%S")
-            except Exception:
-                dt = datetime.utcnow()
-        out.append(mdates.date2num(dt))
-    return out
+            self._update(series, multi, lw, vista)
+        finally:
+            self.ajustando = False
+
+    def _update(self, series, multi, lw, vista):
+        t0 = time.perf_counter()
+        full = self.forzar or multi != self.multi or vista != self.vista
+        self.forzar = False
+        if full:
+            self._clear(); self.multi = multi; self.vista = vista
+        vivas = {sr[0] for sr in series}
+        for key in [k for k in self.lines if k[0] not in vivas]:
+            self.lines.pop(key).remove(); full = True
+
+        appended = []                    # (eje, xs nuevos, ys nuevos) para validar límites
+        for label, t, *cols in series:
+            first = self.lines.get((label, 0))
+            if first is None:
+                for i, (ax, ys) in enumerate(zip(self.axes, cols)):
+                    (ln,) = ax.plot(t, ys, marker=".", linewidth=lw, label=label, animated=True)
+                    self.lines[(label, i)] = ln
+                full = True; continue
+            if vista is not None:
+                for i, (ax, ys) in enumerate(zip(self.axes, cols)):
+                    self.lines[(label, i)].set_data(t, ys); appended.append((ax, t, ys))
+                continue
+            xs = first.get_xdata()
+            k = int(np.searchsorted(t, xs[-1], side="right")) if len(xs) else 0
+            if k == len(t):
+                continue                 # nada nuevo para esta estación
+            if k == 0 or len(xs) + len(t) - k > MAX_POINTS_CHART * 2:
+                # no es continuación de lo dibujado o ya se acumuló demasiado → reemplazo
+                for i, ys in enumerate(cols): self.lines[(label, i)].set_data(t, ys)
+                full = True; continue
+            for i, (ax, ys) in enumerate(zip(self.axes, cols)):
+                ln = self.lines[(label, i)]
+                ln.set_data(np.concatenate((ln.get_xdata(), t[k:])), np.concatenate((ln.get_ydata(), ys[k:])))
+                appended.append((ax, t[k:], ys[k:]))
+
+        if not full and not appended:
+            return
+        if not full and self._bg is not None and all(self._fits(*a) for a in appended):
+            self.canvas.restore_region(self._bg)
+            for ln in self.lines.values(): self.fig.draw_artist(ln)
+            self.canvas.blit(self.fig.bbox)
+            self.last_mode = "blit"
+        else:
+            self._full_draw()
+            self.last_mode = "completo"
+        self.last_ms = (time.perf_counter() - t0) * 1000.0
+
+    @staticmethod
+    def _fits(ax, xs, ys):
+        x0, x1 = ax.get_xlim(); y0, y1 = ax.get_ylim()
+        return all(x0 <= x <= x1 for x in xs) and all(y0 <= y <= y1 for y in ys if y == y)
+
+    def _full_draw(self):
+        ax0 = self.axes[0]
+        if self.multi and self.lines:
+            ax0.legend(handles=[self.lines[k] for k in self.lines if k[1] == 0], loc="upper left", fontsize=8)
+        elif ax0.get_legend() is not None:
+            ax0.get_legend().remove()
+        zoom = isinstance(self.vista, Vista)
+        for ax in self.axes:            # la barra de navegación apaga el autoescalado de X al hacer zoom
+            ax.set_autoscalex_on(not zoom); ax.relim(); ax.autoscale_view()
+        if not zoom and ax0.lines:       # eje X compartido: el margen se aplica una sola vez
+            x0, x1 = ax0.get_xlim(); ax0.set_xlim(x0, x1 + (x1 - x0) * CHART_X_HEADROOM, auto=None)
+        if self._layout_dirty:
+            self.fig.tight_layout(pad=1.2); self._layout_dirty = False
+        self.canvas.draw()               # síncrono: el tiempo medido incluye el render real
 
 # ---------------- UI (dark) ----------------
 def configure_dark_theme(root):
@@ -304,13 +1723,131 @@ def configure_dark_theme(root):
     style.configure("Treeview.Heading", background=PA["panel2"], foreground=PA["fg"], relief="flat")
     style.map("Treeview.Heading", background=[("active", PA["accent"])])
 
+class BarraNavegacion(NavigationToolbar2Tk):
+    """Barra de matplotlib (zoom con rectángulo, desplazar, atrás/adelante) bajo el canvas.
+    "Inicio" no vuelve a la primera vista guardada sino a la vista en vivo (al_inicio)."""
+    def __init__(self, canvas, window, al_inicio):
+        self._al_inicio = al_inicio
+        super().__init__(canvas, window, pack_toolbar=False)
+
+    def home(self, *args):
+        self._al_inicio()
+
+class VirtualTable:
+    """Treeview con ventana deslizante sobre SQLite. Solo mantiene hasta TABLE_MAX_ITEMS filas:
+    al llegar arriba del scroll pide la página anterior, al llegar abajo (si no está en vivo) la
+    siguiente, y en cada refresco solo añade las filas nuevas (nunca reconstruye).
+    Las consultas corren en el worker (submit) y vuelven por la cola de la UI (post → apply); con una en
+    vuelo, la última petición que llega espera en `pending` y sale al aplicar la respuesta."""
+    def __init__(self, name, tree, vsb, fetch, submit, post, page=MAX_ROWS_TABLE, max_items=TABLE_MAX_ITEMS):
+        self.name = name; self.tree = tree; self.vsb = vsb; self.fetch = fetch
+        self.submit = submit; self.post = post; self.page = page; self.max_items = max_items
+        self.gen = 0; self.est = None; self.busy = False
+        self.pending = None              # tipo de la petición que llegó con otra en vuelo (una sola plaza)
+        self.live = True                 # la ventana llega hasta la fila más reciente
+        self.older_done = False          # ya no hay filas más antiguas
+        tree.configure(yscrollcommand=self._on_scroll)
+
+    @staticmethod
+    def _key(iid):
+        ep, rid = iid.split(":"); return int(ep), int(rid)
+
+    def _edge(self, i):
+        ch = self.tree.get_children()
+        return self._key(ch[i]) if ch else None
+
+    def _request(self, kind, before=None, after=None):
+        if self.busy: self.pending = kind; return
+        self.busy = True
+        gen, est = self.gen, self.est
+        def job():
+            rows = self.fetch(limit=self.page, est=est, before=before, after=after)
+            self.post("page", (self.name, gen, kind, rows))
+        self.submit(job)
+
+    def _send_pending(self):
+        # Los bordes se leen ahora, no al encolar: la respuesta aplicada pudo moverlos
+        kind, self.pending = self.pending, None
+        if not kind: return
+        if not self.tree.get_children(): self._request("latest")
+        elif kind == "older":
+            if not self.older_done: self._request("older", before=self._edge(0))
+        elif kind == "newer": self._request("newer", after=self._edge(-1))
+
+    # hilo UI
+    def reset(self, est):
+        self.gen += 1; self.est = est; self.busy = False; self.pending = None
+        self.live = True; self.older_done = False
+        self.tree.delete(*self.tree.get_children())
+        self._request("latest")
+
+    def refresh(self):
+        if not self.tree.get_children(): self._request("latest")
+        elif self.live: self._request("newer", after=self._edge(-1))
+
+    def _on_scroll(self, lo, hi):
+        self.vsb.set(lo, hi)
+        if float(lo) <= 0.0 and not self.older_done and self.tree.get_children():
+            self._request("older", before=self._edge(0))
+        elif float(hi) >= 1.0 and not self.live:
+            self._request("newer", after=self._edge(-1))
+
+    @traza()
+    def apply(self, gen, kind, rows):
+        if gen != self.gen: return       # respuesta de otra estación / reset
+        self.busy = False
+        try: self._apply(kind, rows)
+        finally: self._send_pending()
+
+    def _apply(self, kind, rows):
+        tree = self.tree
+        at_bottom = tree.yview()[1] >= 1.0
+        if kind == "older":
+            self.older_done = len(rows) < self.page
+            for i, r in enumerate(rows):
+                iid = f"{r[-2]}:{r[-1]}"
+                if not tree.exists(iid): tree.insert("", i, iid=iid, values=r[:-2])
+            ch = tree.get_children()
+            if len(ch) > self.max_items:
+                tree.delete(*ch[self.max_items:]); self.live = False
+            if rows: tree.yview_moveto(len(rows) / max(1, len(tree.get_children())))
+            return
+        if kind == "latest":
+            self.older_done = len(rows) < self.page
+        elif len(rows) < self.page:
+            self.live = True             # se alcanzó la fila más reciente
+        for r in rows:
+            iid = f"{r[-2]}:{r[-1]}"
+            if not tree.exists(iid): tree.insert("", tk.END, iid=iid, values=r[:-2])
+        ch = tree.get_children()
+        if len(ch) > self.max_items:
+            tree.delete(*ch[:len(ch) - self.max_items]); self.older_done = False
+        if kind == "latest" or (at_bottom and rows): tree.yview_moveto(1.0)
+
 class DashboardApp:
     def __init__(self, root):
         self.root = root; self.root.title("Estación Meteorológica — Dashboard (Modo Oscuro)")
         configure_dark_theme(root)
         self.auto = False; self.selected_station = tk.StringVar(value="(Todas)")
+        self.selected_range = tk.StringVar(value="Reciente")
         self.status_var = tk.StringVar(value="Listo.")
+        self.render_var = tk.StringVar(value="")   # tiempo del último redibujo de gráficas
         self._last_hash_conso = None   # para redibujo inteligente
+        self.mqtt = None
+        self._export_cancel = None           # Event de la exportación en curso
+        self._diag = None; self._diag_after = None; self._prof = None   # panel Diagnóstico / cProfile del worker
+
+        # Productor/consumidor: un único worker hace red + SQLite; Tk solo pinta lo que llega a _ui_q
+        self._est = None                     # estación seleccionada (copia legible desde el worker)
+        self._rango = None                   # rango de las gráficas: segundos, Vista (zoom) o None = últimas lecturas
+        self._zoom_after = None              # consulta de zoom pendiente (debounce)
+        self.cache = SeriesCache()           # solo se toca desde el worker
+        # La red va en su propio hilo: un servidor lento (arranque en frío) no frena snapshots ni paginación
+        self._jobs = queue.Queue(); self._net = queue.Queue(); self._ui_q = queue.Queue()
+        self._snap_pending = False; self._fetch_pending = False; self._auto_after = None
+        self._snap_clave = None; self._snap_forzar = False   # (selección, versiones) del último snapshot
+        threading.Thread(target=self._job_loop, args=(self._jobs,), name="worker", daemon=True).start()
+        threading.Thread(target=self._job_loop, args=(self._net,), name="red", daemon=True).start()
 
         # Top bar
         top = ttk.Frame(root, style="Panel2.TFrame"); top.pack(fill=tk.X, padx=10, pady=8)
@@ -318,11 +1855,17 @@ class DashboardApp:
         ttk.Label(top, text="Estación:", style="Muted.TLabel").pack(side=tk.LEFT)
         self.station_cb = ttk.Combobox(top, textvariable=self.selected_station, state="readonly", width=30)
         self.station_cb.pack(side=tk.LEFT, padx=6); self.station_cb["values"] = ["(Todas)"]
-        self.station_cb.bind("<<ComboboxSelected>>", lambda e: self.refresh_all())
+        self.station_cb.bind("<<ComboboxSelected>>", self._on_station)
+        ttk.Label(top, text="Rango:", style="Muted.TLabel").pack(side=tk.LEFT)
+        range_cb = ttk.Combobox(top, textvariable=self.selected_range, state="readonly", width=9, values=list(RANGOS))
+        range_cb.pack(side=tk.LEFT, padx=6); range_cb.bind("<<ComboboxSelected>>", self._on_range)
         ttk.Button(top, text="Refrescar", command=self.manual_refresh).pack(side=tk.LEFT, padx=6)
         self.auto_btn = ttk.Button(top, text="Iniciar Auto-Refresh", command=self.toggle_auto); self.auto_btn.pack(side=tk.LEFT, padx=6)
-        ttk.Button(top, text="Exportar CSV", command=self.export_csv).pack(side=tk.LEFT, padx=6)
+        self.mqtt_btn = ttk.Button(top, text="Iniciar MQTT", command=self.toggle_mqtt); self.mqtt_btn.pack(side=tk.LEFT, padx=6)
+        self.export_btn = ttk.Button(top, text="Exportar", command=self.export_data); self.export_btn.pack(side=tk.LEFT, padx=6)
         ttk.Button(top, text="Limpiar caché", command=self.clear_cache).pack(side=tk.LEFT, padx=6)
+        ttk.Button(top, text="Diagnóstico", command=self.open_diagnostics).pack(side=tk.LEFT, padx=6)
+        ttk.Label(top, textvariable=self.render_var, style="Muted.TLabel").pack(side=tk.RIGHT, padx=8)
         ttk.Label(top, textvariable=self.status_var, style="Muted.TLabel").pack(side=tk.RIGHT, padx=8)
 
         # Cards
@@ -337,15 +1880,22 @@ class DashboardApp:
         # Layout bottom
         mid = ttk.Frame(root); mid.pack(fill=tk.BOTH, expand=True, padx=10, pady=6)
         left = ttk.Notebook(mid); left.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0,6))
-        self.tree_conso_frame, self.tree_conso = self._make_tree(left, ("Fecha","Hora","Estación","Temp(°C)","Pres(hPa)","Alt(m)","Aire(%)","ts"))
-        self.tree_raw_frame, self.tree_raw = self._make_tree(left, ("lecturaId","timestamp","Estación","Sensor","Tipo","Unidad","Valor"))
+        self.tree_conso_frame, self.tree_conso, vsb_conso = self._make_tree(left, ("Fecha","Hora","Estación","Temp(°C)","Pres(hPa)","Alt(m)","Aire(%)","ts"))
+        self.tree_raw_frame, self.tree_raw, vsb_raw = self._make_tree(left, ("lecturaId","timestamp","Estación","Sensor","Tipo","Unidad","Valor"))
+        self.tables = {
+            "conso": VirtualTable("conso", self.tree_conso, vsb_conso, db_fetch_consolidated, self._jobs.put, self._post),
+            "raw": VirtualTable("raw", self.tree_raw, vsb_raw, db_fetch_raw, self._jobs.put, self._post),
+        }
         left.add(self.tree_conso_frame, text="Lecturas Consolidadas")
         left.add(self.tree_raw_frame, text="Lecturas Crudas")
+        self.tree_raw.bind("<Double-1>", self._on_raw_open)   # payload original (se descomprime solo aquí)
 
         right = ttk.Notebook(mid); right.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(6,0))
         self.fig = Figure(figsize=(6,5), dpi=100, facecolor="#0e0f11")
-        self.ax_temp = self.fig.add_subplot(411); self.ax_press = self.fig.add_subplot(412)
-        self.ax_alt = self.fig.add_subplot(413); self.ax_air = self.fig.add_subplot(414)
+        self.ax_temp = self.fig.add_subplot(411)   # eje X compartido: zoom y desplazamiento mueven las cuatro
+        self.ax_press = self.fig.add_subplot(412, sharex=self.ax_temp)
+        self.ax_alt = self.fig.add_subplot(413, sharex=self.ax_temp)
+        self.ax_air = self.fig.add_subplot(414, sharex=self.ax_temp)
         self._prepare_axis(self.ax_temp, "°C")
         self._prepare_axis(self.ax_press, "hPa")
         self._prepare_axis(self.ax_alt, "m")
@@ -357,10 +1907,19 @@ class DashboardApp:
             ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M\n%d-%m"))
             ax.tick_params(axis="x", labelrotation=0)
 
-        self.canvas = FigureCanvasTkAgg(self.fig, master=right)
-        right.add(self.canvas.get_tk_widget(), text="Gráficos (Tiempo)")
+        graf = ttk.Frame(right, style="Panel.TFrame")
+        self.canvas = FigureCanvasTkAgg(self.fig, master=graf)
+        self.toolbar = BarraNavegacion(self.canvas, graf, self._zoom_inicio)
+        self.toolbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        right.add(graf, text="Gráficos (Tiempo)")
+        self.charts = ChartRenderer(self.fig, self.canvas, (self.ax_temp, self.ax_press, self.ax_alt, self.ax_air))
+        self.ax_temp.callbacks.connect("xlim_changed", self._on_xlim)
 
-        self.refresh_all(initial=True)
+        for t in self.tables.values(): t.reset(None)
+        self.refresh_all()
+        self._mantenimiento()
+        self.root.after(UI_POLL_MS, self._drain_ui)
 
     # helpers UI
     def _make_card(self, parent, title):
@@ -373,11 +1932,11 @@ class DashboardApp:
         frame = ttk.Frame(parent, style="Panel.TFrame")
         tree = ttk.Treeview(frame, columns=columns, show="headings", height=16)
         for c in columns: tree.heading(c, text=c); tree.column(c, width=110, anchor=tk.CENTER)
-        vsb = ttk.Scrollbar(frame, orient="vertical", command=tree.yview); tree.configure(yscroll=vsb.set)
+        vsb = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)   # yscrollcommand: VirtualTable
         tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True); vsb.pack(side=tk.LEFT, fill=tk.Y)
-        return frame, tree
+        return frame, tree, vsb
 
-    # estética de ejes (modo oscuro) — se aplica tras cada cla()
+    # estética de ejes (modo oscuro)
     def _prepare_axis(self, ax, ylabel):
         ax.grid(True, alpha=0.25)
         ax.set_facecolor("#15171a")
@@ -387,85 +1946,334 @@ class DashboardApp:
         ax.yaxis.label.set_color("#d4d7dd")
         ax.set_ylabel(ylabel)
 
-    # actions
-    def set_status(self, msg): self.status_var.set(msg); self.root.update_idletasks()
-    def manual_refresh(self): threading.Thread(target=self._refresh_worker, daemon=True).start()
-    def toggle_auto(self):
+    # ---- hilos: worker (red + DB) y cola hacia Tk ----
+    def _job_loop(self, q):
+        while True:
+            job = q.get()
+            try: job()
+            except Exception as e:
+                print("worker error:", e); self.set_status(f"Error: {e}")
+
+    def _post(self, kind, payload): self._ui_q.put((kind, payload))
+
+    def _drain_ui(self):
+        # Un elemento que falla se registra y se salta; el sondeo se reprograma pase lo que pase
+        # (si after() no corre, la UI deja de recibir snapshots, páginas y estados para siempre).
+        snap = None
+        try:
+            while True:
+                try: kind, payload = self._ui_q.get_nowait()
+                except queue.Empty: break
+                if kind == "snapshot": snap = payload   # solo importa el más reciente
+                else:
+                    try: self._ui_item(kind, payload)
+                    except Exception as e: print(f"ui error ({kind}):", e)
+            if snap is not None:
+                try: self.render_snapshot(snap)
+                except Exception as e: print("ui error (snapshot):", e)
+        finally:
+            self.root.after(UI_POLL_MS, self._drain_ui)
+
+    def _ui_item(self, kind, payload):
+        if kind == "page": self.tables[payload[0]].apply(*payload[1:])
+        elif kind == "status": self.status_var.set(payload)
+        elif kind == "reset_tables":
+            for t in self.tables.values(): t.reset(self._est)
+        elif kind == "tables":
+            for t in self.tables.values(): t.refresh()
+        elif kind == "info": messagebox.showinfo(*payload)
+        elif kind == "payload": self._show_payload(*payload)
+        elif kind == "export_done":
+            self._export_cancel = None; self.export_btn.configure(text="Exportar")
+
+    # actions (seguras desde cualquier hilo salvo donde se indica)
+    def set_status(self, msg): self._post("status", msg)
+
+    def refresh_all(self, forzar=False):
+        """Pide un snapshot nuevo; mientras haya uno en cola las peticiones se agrupan.
+        Sin `forzar`, el worker no consulta ni redibuja si los datos a la vista no cambiaron."""
+        if forzar: self._snap_forzar = True
+        if self._snap_pending: return
+        self._snap_pending = True
+        self._jobs.put(self._snapshot_job)
+
+    def _snapshot_job(self):
+        self._snap_pending = False
+        # Detección de cambios: versiones leídas antes de consultar (lo que entre mientras tanto sube la
+        # versión y el próximo refresco lo ve). Con una estación elegida solo cuenta la suya y el catálogo.
+        est, rango = self._est, self._rango; v = db_fetch_versiones()
+        clave = (est, rango, (v.get(est), frozenset(v)) if est else v)
+        if clave == self._snap_clave and not self._snap_forzar: return
+        self._snap_clave = clave; self._snap_forzar = False
+        self._post("snapshot", build_snapshot(est, self.cache, rango))
+        self._post("tables", None)       # las tablas piden solo sus filas nuevas
+
+    def manual_refresh(self):
+        if self._fetch_pending: return
+        self._fetch_pending = True
+        self._net.put(self._fetch_job)
+
+    def toggle_auto(self):   # hilo UI
         self.auto = not self.auto
         self.auto_btn.configure(text="Detener Auto-Refresh" if self.auto else "Iniciar Auto-Refresh")
-        if self.auto: threading.Thread(target=self._auto_worker, daemon=True).start()
+        if self._auto_after is not None:
+            self.root.after_cancel(self._auto_after); self._auto_after = None
+        if self.auto: self._auto_tick()
+
+    def _auto_tick(self):
+        self.manual_refresh()
+        self._auto_after = self.root.after(AUTO_REFRESH_SECONDS * 1000, self._auto_tick)
+
+    def _on_station(self, _event=None):   # hilo UI
+        v = self.selected_station.get()
+        self._est = None if v == "(Todas)" else v
+        for t in self.tables.values(): t.reset(self._est)
+        self.refresh_all()
+
+    def _on_range(self, _event=None):   # hilo UI
+        self._zoom_inicio()
 
-    def _auto_worker(self):
-        while self.auto:
-            try: self._refresh_worker()
-            except Exception as e: print("auto refresh error:", e)
-            for _ in range(AUTO_REFRESH_SECONDS):
-                if not self.auto: break
-                time.sleep(1)
+    # ---- zoom / desplazamiento (hilo UI) ----
+    def _on_xlim(self, _ax):
+        # también llega por los ajustes del renderer (autoescalado, margen): esos no son del usuario
+        if self.charts.ajustando: return
+        if self._zoom_after is not None: self.root.after_cancel(self._zoom_after)
+        self._zoom_after = self.root.after(ZOOM_DEBOUNCE_MS, self._zoom_consultar)
 
-    def _refresh_worker(self):
+    def _zoom_consultar(self):
+        self._zoom_after = None
+        x0, x1 = self.ax_temp.get_xlim()
+        t0, t1 = ((x - _MPL_EPOCH0) * 86400.0 for x in (x0, x1))
+        self._rango = Vista(math.floor(t0), math.ceil(t1), max(1, int(self.ax_temp.get_window_extent().width)))
+        self.refresh_all()
+
+    def _zoom_inicio(self):
+        """Vuelve a la vista en vivo del combobox Rango (botón Inicio de la barra o cambio de rango)."""
+        if self._zoom_after is not None:
+            self.root.after_cancel(self._zoom_after); self._zoom_after = None
+        self.toolbar.update()            # NavigationToolbar2.update: vacía la pila atrás/adelante
+        self._rango = RANGOS[self.selected_range.get()]
+        self.charts.forzar = True; self._last_hash_conso = None   # aunque la firma no cambie: deshacer el zoom
+        self.refresh_all(forzar=True)
+
+    def toggle_mqtt(self):   # hilo UI
+        if self.mqtt is not None:
+            self.mqtt.stop(); self.mqtt = None
+            self.mqtt_btn.configure(text="Iniciar MQTT"); self.set_status("MQTT detenido.")
+            return
+        mqtt = MqttIngest(self._on_mqtt_items, self.set_status)
+        try:
+            mqtt.start()
+        except Exception as e:
+            messagebox.showerror("MQTT", str(e)); return
+        self.mqtt = mqtt
+        self.mqtt_btn.configure(text="Detener MQTT"); self.set_status(f"MQTT conectando a {MQTT_BROKER}…")
+
+    def _on_mqtt_items(self, items):   # hilo de red de paho → al worker
+        self._jobs.put(lambda: self._ingest_mqtt(items))
+
+    def _ingest_mqtt(self, items):   # worker: mismo camino que _ingest_http, sin mover los cursores
+        db_nombrar_mqtt(items)
+        added_raw = db_insert_raw(items); rows = consolidate(items)
+        added = db_insert_consolidated(rows)
+        self.cache.extend(rows, added)
+        self.set_status(f"MQTT · {rows[-1].estacionNombre} {rows[-1].hora} · Crudas +{added_raw} · Consolidadas +{added}")
+        if added_raw or added: self.refresh_all()
+
+    def _fetch_job(self):   # hilo de red
         try:
             self.set_status("Consultando servidor…")
-            items = http_get_lecturas()
-            added_raw = db_insert_raw(items)
-            rows = consolidate(items)
+            cursores = db_fetch_cursores() if INCREMENTAL_SYNC else {}
+            desde = min((ts for ts, _ in cursores.values() if ts), default=None)
+            items = http_get_lecturas(desde)
+            if items is None:
+                self.set_status("OK · Sin cambios en el servidor"); self._fetch_pending = False
+                return
+            nuevas = filtrar_nuevas(items, cursores)
+            rows = consolidate(nuevas)
+        except Exception as e:
+            self.set_status(f"Error: {e}"); self._fetch_pending = False
+            return
+        self._jobs.put(lambda: self._ingest_http(items, nuevas, rows))
+
+    def _ingest_http(self, items, nuevas, rows):   # worker
+        try:
+            added_raw = db_insert_raw(nuevas)
+            if db_enlazar_estaciones(items):   # lo llegado por MQTT con nombre provisional ya es de la estación real
+                self.cache.clear(); self._post("reset_tables", None)
             added_conso = db_insert_consolidated(rows)
-            self.set_status(f"OK · Crudas +{added_raw} · Consolidadas +{added_conso}")
+            self.cache.extend(rows, added_conso)
+            db_update_cursores(nuevas)
+            self.set_status(f"OK · Nuevas {len(nuevas)}/{len(items)} · Crudas +{added_raw} · Consolidadas +{added_conso}")
         except Exception as e:
             self.set_status(f"Error: {e}")
         finally:
+            self._fetch_pending = False
             self.refresh_all()
 
-    def refresh_all(self, initial=False):
-        stations = ["(Todas)"] + db_fetch_estaciones()
-        cur = self.selected_station.get()
-        self.station_cb["values"] = stations
-        if cur not in stations: self.selected_station.set("(Todas)")
-        est = None if self.selected_station.get() == "(Todas)" else self.selected_station.get()
-
-        # Tablas
-        self._fill_tree(self.tree_conso, db_fetch_consolidated(limit=MAX_ROWS_TABLE, est=est))
-        self._fill_tree(self.tree_raw, db_fetch_raw(limit=MAX_ROWS_TABLE, est=est))
+    # render (solo hilo UI)
+    def render_snapshot(self, snap):
+        self.station_cb["values"] = snap.estaciones
+        if self.selected_station.get() not in snap.estaciones:
+            self.selected_station.set("(Todas)"); self._on_station(); return
+        if snap.est != self._est or snap.rango != self._rango:   # la selección cambió mientras se consultaba
+            self.refresh_all(); return
 
         # Tarjetas + gráficas (solo si cambió dataset)
-        self.update_cards_and_charts(est)
+        self.update_cards_and_charts(snap)
+
+    def export_data(self):   # hilo UI
+        if self._export_cancel is not None:   # el botón cancela la exportación en curso
+            self._export_cancel.set(); return
+        rango = simpledialog.askstring("Exportación", "Rango de fechas (AAAA-MM-DD a AAAA-MM-DD).\nVacío = todo:",
+                                       parent=self.root)
+        if rango is None: return
+        try:
+            partes = [p.strip() for p in rango.split(" a ")] if rango.strip() else [None, None]
+            desde, hasta = (partes + [None])[:2]
+            for f in (desde, hasta):
+                if f: _day_epoch(f)
+        except ValueError:
+            messagebox.showerror("Exportación", f"Rango inválido: {rango}"); return
+        tipos = [("CSV", "*.csv"), ("CSV gzip", "*.csv.gz")]
+        if pq is not None: tipos.insert(0, ("Parquet", "*.parquet"))
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=tipos)
+        if not path: return
+        est = self._est; cancel = self._export_cancel = threading.Event()
+        self.export_btn.configure(text="Cancelar exportación")
+        def progress(n, total):
+            self.set_status(f"Exportando… {n:,}/{total:,} ({100 * n // max(1, total)}%)")
+        def worker():   # hilo propio: no bloquea los refrescos del worker principal
+            try:
+                n, final, cancelado = db_export(path, est, desde, hasta, progress, cancel)
+                if cancelado: self.set_status(f"Exportación cancelada ({n:,} filas descartadas).")
+                else: self._post("info", ("Exportación", f"Exportadas {n:,} filas a:\n{final}"))
+            except Exception as e:
+                self.set_status(f"Error exportando: {e}")
+            finally:
+                self._post("export_done", None)
+        threading.Thread(target=worker, name="exportación", daemon=True).start()
+
+    def clear_cache(self):   # hilo UI
+        if not messagebox.askyesno("Confirmar", "¿Borrar TODA la base local (cache) y recargar?"):
+            return
+        def job():
+            db_borrar_todo()
+            self.cache.clear()
+            self.set_status("Caché limpiada. Pulsa Refrescar.")
+            self._post("reset_tables", None)
+            self.refresh_all(forzar=True)
+            self._vacuum_job()   # el espacio de las particiones tiradas vuelve al disco en segundo plano
+        self._jobs.put(job)
+
+    # ---- mantenimiento de la base: retención y vacuum incremental ----
+    def _mantenimiento(self):   # hilo UI
+        self._jobs.put(self._mantenimiento_job)
+        self.root.after(MANTENIMIENTO_S * 1000, self._mantenimiento)
+
+    def _mantenimiento_job(self, tiradas=0):
+        # un mes por trabajo y el siguiente al final de la cola, como el vacuum: purgar un año de una vez
+        # bloquearía snapshots y páginas mientras DROP TABLE libera cada página
+        paso = db_purgar(maximo=1)
+        if paso:
+            self._jobs.put(lambda: self._mantenimiento_job(tiradas + len(paso))); return
+        if tiradas:
+            self.cache.clear()
+            self.set_status(f"Retención: {tiradas} particiones antiguas borradas.")
+            self._post("reset_tables", None)
+            self.refresh_all(forzar=True)
+        self._vacuum_job()
+
+    def _vacuum_job(self, antes=None):
+        # un paso por trabajo y el siguiente al final de la cola: snapshots y páginas se intercalan
+        quedan = db_vacuum_paso()
+        if quedan and (antes is None or quedan < antes):
+            self._jobs.put(lambda: self._vacuum_job(quedan))
 
-    def _fill_tree(self, tree, rows):
+    def _on_raw_open(self, event):   # hilo UI
+        iid = self.tree_raw.identify_row(event.y)
+        if not iid: return
+        ep, rid = VirtualTable._key(iid)
+        self._jobs.put(lambda: self._post("payload", (rid, db_fetch_payload(ep, rid))))
+
+    def _show_payload(self, rid, payload):
+        if payload is None:
+            messagebox.showinfo("Payload", f"La lectura {rid} no guardó su payload (RAW_MODO)."); return
+        win = tk.Toplevel(self.root); win.title(f"Payload de la lectura {rid}"); win.configure(bg="#0e0f11")
+        txt = tk.Text(win, width=70, height=20, bg="#15171a", fg="#d4d7dd", insertbackground="#d4d7dd",
+                      relief=tk.FLAT, font=("Consolas", 10))
+        txt.insert("1.0", json.dumps(payload, ensure_ascii=False, indent=2)); txt.configure(state=tk.DISABLED)
+        txt.pack(fill=tk.BOTH, expand=True, padx=8, pady=8)
+
+    # ---- diagnóstico (solo hilo UI) ----
+    def open_diagnostics(self):
+        """Ventana con p50/p95 por etapa; mientras está abierta el tracer mide."""
+        if self._diag is not None:
+            self._diag.lift(); return
+        TRACER.activo = True
+        win = self._diag = tk.Toplevel(self.root)
+        win.title("Diagnóstico — tiempos por etapa"); win.configure(bg="#0e0f11")
+        win.protocol("WM_DELETE_WINDOW", self._close_diagnostics)
+        barra = ttk.Frame(win, style="Panel2.TFrame"); barra.pack(fill=tk.X, padx=8, pady=6)
+        ttk.Button(barra, text="Exportar JSON", command=lambda: self._export_trace(TRACER.exportar_json)).pack(side=tk.LEFT, padx=4)
+        ttk.Button(barra, text="Exportar traza Chrome", command=lambda: self._export_trace(TRACER.exportar_chrome)).pack(side=tk.LEFT, padx=4)
+        ttk.Button(barra, text="Limpiar", command=TRACER.limpiar).pack(side=tk.LEFT, padx=4)
+        self.prof_btn = ttk.Button(barra, text="Perfilar worker", command=self.toggle_profiler); self.prof_btn.pack(side=tk.LEFT, padx=4)
+        frame, self._diag_tree, vsb = self._make_tree(win, ("Span", "n", "p50 ms", "p95 ms", "máx ms", "total ms"))
+        self._diag_tree.configure(yscrollcommand=vsb.set); self._diag_tree.column("Span", width=260, anchor=tk.W)
+        frame.pack(fill=tk.BOTH, expand=True, padx=8, pady=(0, 8))
+        self._diag_tick()
+
+    def _diag_tick(self):
+        tree = self._diag_tree
         tree.delete(*tree.get_children())
-        for r in rows: tree.insert("", tk.END, values=r)
+        for nombre, n, p50, p95, mx, total in TRACER.resumen():
+            tree.insert("", tk.END, values=(nombre, n, f"{p50:.1f}", f"{p95:.1f}", f"{mx:.1f}", f"{total:.0f}"))
+        self._diag_after = self.root.after(1000, self._diag_tick)
+
+    def _close_diagnostics(self):
+        TRACER.activo = False
+        if self._prof is not None:            # perfil sin guardar: se descarta
+            self._jobs.put(self._prof.disable); self._prof = None
+        self.root.after_cancel(self._diag_after)
+        self._diag.destroy(); self._diag = None
 
-    def export_csv(self):
-        est = None if self.selected_station.get() == "(Todas)" else self.selected_station.get()
-        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV","*.csv")])
+    def _export_trace(self, exportar):
+        path = filedialog.asksaveasfilename(parent=self._diag, defaultextension=".json", filetypes=[("JSON", "*.json")])
         if not path: return
-        n = db_export_csv(path, est=est)
-        messagebox.showinfo("Exportación", f"Exportadas {n} filas a:\n{path}")
+        try:
+            exportar(path)
+        except OSError as e:
+            messagebox.showerror("Diagnóstico", str(e)); return
+        self.set_status(f"Diagnóstico exportado a {path}")
 
-    def clear_cache(self):
-        if not messagebox.askyesno("Confirmar", "¿Borrar TODA la base local (cache) y recargar?"):
+    def toggle_profiler(self):
+        """cProfile solo perfila el hilo que lo activa: se enciende y apaga con jobs del propio worker."""
+        if self._prof is None:
+            self._prof = cProfile.Profile(); self._jobs.put(self._prof.enable)
+            self.prof_btn.configure(text="Detener perfil"); self.set_status("Perfilando el worker…")
             return
-        conn = sqlite3.connect(DB_FILE); c = conn.cursor()
-        c.execute("DELETE FROM lecturas_crudas"); c.execute("DELETE FROM lecturas_consolidadas")
-        conn.commit(); conn.close()
-        self.set_status("Caché limpiada. Pulsa Refrescar.")
-
-    def _hash_rows(self, rows):
-        # hash simple por última marca de tiempo + cantidad
-        if not rows: return "0|0"
-        last_ts = rows[-1][7] if len(rows[-1]) > 7 else ""
-        return f"{len(rows)}|{last_ts}"
-
-    def update_cards_and_charts(self, est):
-        rows = db_fetch_consolidated(limit=MAX_POINTS_CHART*3, est=est)  # traemos un poco más y reducimos
+        prof, self._prof = self._prof, None
+        self.prof_btn.configure(text="Perfilar worker")
+        path = filedialog.asksaveasfilename(parent=self._diag, defaultextension=".prof", filetypes=[("cProfile", "*.prof")])
+        def job():
+            prof.disable()
+            if not path: return
+            prof.dump_stats(path)
+            with open(os.path.splitext(path)[0] + ".txt", "w", encoding="utf-8") as f:
+                pstats.Stats(prof, stream=f).sort_stats("cumulative").print_stats(40)
+            self._post("info", ("Perfil", f"Perfil del worker guardado en:\n{path}\n(resumen legible en .txt)"))
+        self._jobs.put(job)
+
+    def update_cards_and_charts(self, snap):
         # Redibujo inteligente (si no cambió, salimos)
-        h = self._hash_rows(rows)
-        if h == self._last_hash_conso:
+        if snap.firma == self._last_hash_conso:
             return
-        self._last_hash_conso = h
+        self._last_hash_conso = snap.firma
 
         # Tarjetas
-        if rows:
-            last = rows[-1]; _,_,_, temp,pres,alt,air,_ = last
+        if snap.tarjetas:
+            temp, pres, alt, air = snap.tarjetas
             self.card_temp.value_label.configure(text=f"{temp if temp is not None else '—'}")
             self.card_press.value_label.configure(text=f"{pres if pres is not None else '—'}")
             self.card_alt.value_label.configure(text=f"{alt if alt is not None else '—'}")
@@ -474,64 +2282,9 @@ class DashboardApp:
             for c in (self.card_temp, self.card_press, self.card_alt, self.card_air):
                 c.value_label.configure(text="—")
 
-        # Gráficas: limpiar y re-preparar ejes
-        for ax in (self.ax_temp, self.ax_press, self.ax_alt, self.ax_air):
-            ax.cla()
-        self._prepare_axis(self.ax_temp, "°C")
-        self._prepare_axis(self.ax_press, "hPa")
-        self._prepare_axis(self.ax_alt, "m")
-        self._prepare_axis(self.ax_air, "%")
-        for ax in (self.ax_temp, self.ax_press, self.ax_alt, self.ax_air):
-            ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M\n%d-%m"))
-            ax.tick_params(axis="x", labelrotation=0)
-        self.ax_air.set_xlabel("Tiempo", color="#d4d7dd")
-
-        if not rows:
-            self.fig.tight_layout(pad=1.2); self.canvas.draw_idle()
-            return
-
-        # Construcción de series
-        if est is None:
-            by_est = defaultdict(list)
-            for r in rows: by_est[r[2]].append(r)
-            for estname, serie in by_est.items():
-                ts = [s[7] for s in serie]
-                t = parse_ts_list(ts)
-                temp = [s[3] for s in serie]; pres = [s[4] for s in serie]
-                alt  = [s[5] for s in serie]; air  = [s[6] for s in serie]
-
-                # downsampling
-                t, temp = thin_series(t, temp)
-                _, pres = thin_series(t, pres)  # usar mismos índices tras el primer thin
-                _, alt  = thin_series(t, alt)
-                _, air  = thin_series(t, air)
-
-                self.ax_temp.plot(t, temp, marker=".", linewidth=1.2, label=estname)
-                self.ax_press.plot(t, pres, marker=".", linewidth=1.2, label=estname)
-                self.ax_alt.plot(t, alt, marker=".", linewidth=1.2, label=estname)
-                self.ax_air.plot(t, air, marker=".", linewidth=1.2, label=estname)
-            self.ax_temp.legend(loc="upper left", fontsize=8)
-        else:
-            ts = [r[7] for r in rows]
-            t = parse_ts_list(ts)
-            temp = [r[3] for r in rows]; pres = [r[4] for r in rows]
-            alt  = [r[5] for r in rows]; air  = [r[6] for r in rows]
-
-            t, temp = thin_series(t, temp)
-            _, pres = thin_series(t, pres)
-            _, alt  = thin_series(t, alt)
-            _, air  = thin_series(t, air)
-
-            self.ax_temp.plot(t, temp, marker=".", linewidth=1.4, label=est or "")
-            self.ax_press.plot(t, pres, marker=".", linewidth=1.4, label=est or "")
-            self.ax_alt.plot(t, alt, marker=".", linewidth=1.4, label=est or "")
-            self.ax_air.plot(t, air, marker=".", linewidth=1.4, label=est or "")
-
-        # límites ajustados
-        for ax in (self.ax_temp, self.ax_press, self.ax_alt, self.ax_air):
-            ax.relim(); ax.autoscale_view()
-
-        self.fig.tight_layout(pad=1.2); self.canvas.draw_idle()
+        # Gráficas: líneas persistentes, solo se añade lo nuevo
+        self.charts.update(snap.series, multi=snap.est is None, lw=1.2 if snap.est is None else 1.4, vista=snap.rango)
+        self.render_var.set(f"Gráficas {self.charts.last_ms:.0f} ms ({self.charts.last_mode})")
 
 def main():
     db_init()
@@ -1,7 +1,9 @@
 # main.py – ESP32 con DHT11 y MQ-8 (lectura REAL)
-# Envía datos cada minuto sincronizado a la hora de Guatemala (UTC-6)
+# Envía datos cada minuto sincronizado a la hora de Guatemala (UTC-6), o solo cambios (CONFIG["rbe"])
 
-import time, ujson
+import time, ujson, struct, os, random, math
+from array import array
+import machine
 from machine import Pin, ADC
 import network
 from umqtt.simple import MQTTClient
@@ -14,9 +16,66 @@ WIFI_PASSWORD = "boteo000"
 
 MQTT_BROKER = "test.mosquitto.org"
 MQTT_PORT = 1883
+MQTT_TOPIC = "umes/clima"
+MQTT_TOPIC_BIN = "umes/clima/bin"
+
+# Formato de envío: JSON (compatible con el servidor) o binario compacto por lotes (lo decodifica el dashboard)
+FORMATO_BIN = False
+BATCH_MAX = 20            # registros por mensaje binario
+BATCH_MIN = 1             # lecturas a juntar antes de publicar en binario (5 → un mensaje cada 5 min)
 
 ESTACION_ID = 3
 
+# ========= STORE-AND-FORWARD =========
+RAM_SLOTS = 32            # lecturas en RAM antes de volcarlas a flash (~30 min sin red)
+FLASH_DIR = "sf2"         # segmentos solo-append en flash (registro v2; "sf" era el v1)
+FLASH_SEG_RECS = 1024     # registros por segmento (1024 × REC_SIZE = 19 KB)
+FLASH_MAX_SEGS = 16       # tope en flash (~11 días); al pasarlo se descarta el segmento más viejo
+DRAIN_BURST = 20          # publicaciones por ráfaga al vaciar lo pendiente
+WIFI_ESPERA_S = 8         # espera máxima por intento de WiFi dentro del loop
+BACKOFF_MIN_S = 5         # reintentos de WiFi/MQTT: exponencial con jitter
+BACKOFF_MAX_S = 300
+
+# ========= PLANIFICADOR =========
+# Rejilla absoluta del RTC: cada tarea corre en múltiplos de su periodo (+ fase), sin deriva
+PERIODO_REGISTRO_S = 60   # un registro por minuto en el segundo 00
+PERIODO_DHT_S = 60        # el DHT11 admite como mucho 1 lectura/s
+PERIODO_MQ8_S = 15        # el MQ-8 se promedia dentro del minuto (por omisión; ver CONFIG)
+PERIODO_CONFIG_S = 30     # revisión de mensajes entrantes (config retenida)
+FASE_DHT_S = -5           # leer antes del registro: ni los reintentos lo retrasan
+FASE_MQ8_S = 0             # la ráfaga del segundo 00 corre justo antes del registro
+USAR_LIGHTSLEEP = True    # CPU y radio dormidos entre tareas (despierta la alarma del RTC)
+LIGHTSLEEP_MIN_S = 2      # esperas más cortas con time.sleep (no compensa dormir)
+
+# ========= FILTRADO =========
+MQ8_RAFAGA = 16           # lecturas ADC por muestra del MQ-8
+MQ8_RAFAGA_US = 2000      # separación entre lecturas de la ráfaga
+MQ8_RECORTE = 4           # se descartan las 4 más bajas y las 4 más altas (7 → mediana)
+MQ8_EMA_ALFA = 0.3        # suavizado entre ráfagas (1 = sin suavizar)
+DHT_REINTENTOS = 3        # checksum/timeout del DHT11: se reintenta dentro del mismo plazo
+DHT_PAUSA_S = 1.1         # el DHT11 necesita ≥1 s entre lecturas
+DHT_RANGO_T = (0, 60)     # fuera de esto es una lectura corrupta (el DHT11 mide 0–50 °C)
+DHT_RANGO_H = (5, 100)
+
+# ========= CONFIG REMOTA / REPORTE POR EXCEPCIÓN =========
+MQTT_TOPIC_CONFIG = "umes/clima/config/%d" % ESTACION_ID   # retenido: JSON con claves de CONFIG
+CONFIG_FILE = "config.json"                 # última config recibida (vale al arrancar sin red)
+# Valores por omisión; el tópico retenido los reemplaza en caliente
+CONFIG = {
+    "rbe": False,                             # True: publicar solo cambios, cruces de umbral y latido
+    "latido_s": 900,                          # en modo rbe: registro aunque nada cambie
+    "banda_temp": 1.0,                        # bandas muertas: cambio mínimo que se publica
+    "banda_hum": 2.0,
+    "banda_mq8": 60,
+    "periodo_mq8_s": PERIODO_MQ8_S,           # divisor de 60; en rbe conviene 5 (alertas en segundos)
+    "umbrales_mq8": [900, 1500, 2200, 3000],  # cortes de calidadAire sobre el ADC calibrado
+    "calidades": [100, 90, 70, 40, 15],
+    "mq8_ganancia": 1.0,                      # calibración: adc·ganancia + offset
+    "mq8_offset": 0.0,
+    "temp_offset": 0.0,
+    "hum_offset": 0.0,
+}
+
 # ========= SENSORES =========
 dht_pin = Pin(18, Pin.IN)       # TU PIN PARA DHT11
 dht_sensor = dht.DHT11(dht_pin)
@@ -36,13 +95,18 @@ except:
 # ===============================================================
 # ✅ WIFI
 # ===============================================================
-def conectar_wifi():
-    print("Conectando a WiFi...")
+def conectar_wifi(espera_s=20):
     wlan = network.WLAN(network.STA_IF)
+    if wlan.isconnected():
+        return True
+    print("Conectando a WiFi...")
     wlan.active(True)
-    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+    try:
+        wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+    except Exception as e:   # p. ej. ya había un intento en curso
+        print("WiFi connect:", e)
 
-    for _ in range(20):
+    for _ in range(espera_s):
         if wlan.isconnected():
             print("WiFi OK:", wlan.ifconfig())
             return True
@@ -60,13 +124,21 @@ def sincronizar_hora():
         ntptime.host = "pool.ntp.org"
         ntptime.settime()
         print("Hora NTP OK")
+        return True
     except:
         print("ERROR NTP")
+        return False
+
+
+def hora_valida(secs=None):
+    # Sin NTP el RTC arranca en 2000
+    t = time.localtime() if secs is None else time.localtime(secs)
+    return t[0] >= 2024
 
 
-def obtener_hora_gt():
-    # Obtener UTC
-    t = time.localtime()
+def obtener_hora_gt(secs=None):
+    # Obtener UTC (ahora o de un registro guardado)
+    t = time.localtime() if secs is None else time.localtime(secs)
     # Convertir a segundos
     utc_secs = time.mktime(t)
     # Restar 6 horas para Guatemala
@@ -78,14 +150,6 @@ def obtener_hora_gt():
     return fecha, hora, gt
 
 
-def esperar_minuto_exact():
-    while True:
-        _, _, gt = obtener_hora_gt()
-        if gt[5] == 0:
-            return
-        time.sleep(0.2)
-
-
 # ===============================================================
 # ✅ MQTT
 # ===============================================================
@@ -93,6 +157,8 @@ def conectar_mqtt():
     try:
         client = MQTTClient("estacion_esp32_3", MQTT_BROKER, port=MQTT_PORT)
         client.connect()
+        client.set_callback(recibir_config)
+        client.subscribe(MQTT_TOPIC_CONFIG)   # el broker entrega enseguida la config retenida
         print("MQTT OK")
         return client
     except Exception as e:
@@ -100,80 +166,631 @@ def conectar_mqtt():
         return None
 
 
+class Enlace:
+    """WiFi + MQTT con reconexión: cada intento fallido duplica la espera (con jitter)
+    hasta BACKOFF_MAX_S; mientras tanto las lecturas se acumulan en el Almacen."""
+    def __init__(self):
+        self.mqtt = None
+        self.espera = BACKOFF_MIN_S
+        self.proximo = 0
+        self.al_sincronizar = None   # callback(delta_s) tras el primer NTP válido
+
+    def listo(self, espera_wifi=WIFI_ESPERA_S):
+        if self.mqtt is not None:
+            if not hora_valida():   # NTP falló al conectar: lo pendiente espera la hora
+                self._sincronizar()
+            return True
+        ahora = time.time()
+        if ahora < self.proximo:
+            return False
+        if conectar_wifi(espera_wifi):
+            if not hora_valida():
+                self._sincronizar()
+            self.mqtt = conectar_mqtt()
+        if self.mqtt is not None:
+            self.espera = BACKOFF_MIN_S
+            return True
+        self.proximo = time.time() + self.espera * (0.5 + random.getrandbits(8) / 256)
+        print("Sin enlace; reintento en", int(self.proximo - time.time()), "s")
+        self.espera = min(self.espera * 2, BACKOFF_MAX_S)
+        return False
+
+    def _sincronizar(self):
+        antes = time.time()
+        if sincronizar_hora() and self.al_sincronizar:
+            self.al_sincronizar(time.time() - antes)
+
+    def revisar(self):
+        # mensajes entrantes sin bloquear (la config llega por callback)
+        if self.mqtt is None:
+            return
+        try:
+            self.mqtt.check_msg()
+        except Exception as e:
+            self.caido(e)
+
+    def caido(self, e):
+        print("Enlace caído:", e)
+        try:
+            self.mqtt.disconnect()
+        except:
+            pass
+        self.mqtt = None
+        self.proximo = time.time() + BACKOFF_MIN_S
+
+
 # ===============================================================
-# ✅ LECTURAS REALES
+# ✅ CONFIG REMOTA
 # ===============================================================
-def leer_dht11():
+def validar_config(d):
+    """CONFIG con las claves conocidas de `d` encima, o None si algo no valida: el mensaje se rechaza
+    entero (aplicar la mitad de una config mala la guardaría y volvería en cada arranque)."""
+    if not isinstance(d, dict):
+        return None
+    nueva = dict(CONFIG)
+    for k, v in d.items():
+        actual = CONFIG.get(k)
+        if actual is None:
+            print("Config: clave desconocida", k)
+            continue
+        if not (type(v) is type(actual) or type(actual) is float and type(v) is int):
+            print("Config rechazada:", k, v)
+            return None
+        nueva[k] = float(v) if type(actual) is float else v
+    p = nueva["periodo_mq8_s"]
+    umbrales = nueva["umbrales_mq8"]
+    calidades = nueva["calidades"]
+    if p < 1 or 60 % p or nueva["latido_s"] < 1:
+        print("Config rechazada: periodos", p, nueva["latido_s"])
+        return None
+    # calidad_aire compara contra cada umbral y empaquetar guarda la calidad en un byte ('B')
+    if (any(type(u) not in (int, float) for u in umbrales) or sorted(umbrales) != umbrales
+            or any(type(c) is not int or not 0 <= c <= 255 for c in calidades)
+            or len(calidades) != len(umbrales) + 1):
+        print("Config rechazada: umbrales/calidades", umbrales, calidades)
+        return None
+    return nueva
+
+
+def aplicar_config(d):
+    """Valida `d` entera y aplica lo que cambió; devuelve las claves cambiadas (None si se rechazó)."""
+    nueva = validar_config(d)
+    if nueva is None:
+        return None
+    cambios = [k for k in nueva if nueva[k] != CONFIG[k]]
+    CONFIG.update(nueva)
+    return cambios
+
+
+def recibir_config(topic, msg):
     try:
-        dht_sensor.measure()
-        temp = dht_sensor.temperature()
-        hum  = dht_sensor.humidity()
-        return temp, hum
+        cambios = aplicar_config(ujson.loads(msg))
     except Exception as e:
-        print("Error DHT:", e)
-        return None, None
-
-
-def leer_mq8():
-    """
-    MQ-8 entrega voltaje (0–3.3V) proporcional a concentración H2.
-    ADC devuelve un valor 0–4095.
-    """
-    adc_val = mq8_adc.read()
-
-    # Cálculo simple de "calidad de aire" basado en rango
-    if adc_val < 900:
-        calidad = 100
-    elif adc_val < 1500:
-        calidad = 90
-    elif adc_val < 2200:
-        calidad = 70
-    elif adc_val < 3000:
-        calidad = 40
-    else:
-        calidad = 15
+        print("Config inválida:", e)
+        return
+    if cambios:   # solo una config ya validada llega a flash
+        print("Config:", cambios)
+        try:
+            with open(CONFIG_FILE, "w") as f:
+                f.write(ujson.dumps(CONFIG))
+        except OSError as e:
+            print("No se guardó la config:", e)
+
+
+def cargar_config():
+    try:
+        with open(CONFIG_FILE) as f:
+            aplicar_config(ujson.loads(f.read()))
+    except (OSError, ValueError):
+        pass
+
 
-    return adc_val, calidad
+# ===============================================================
+# ✅ STORE-AND-FORWARD
+# ===============================================================
+# Registro binario v2: segundos RTC (UTC), temp×10, hum×10, mq8_raw filtrado, calidadAire,
+# y del MQ-8 en el intervalo: mínimo, máximo, media y desviación×10 de las lecturas crudas
+REC_FMT = "<IhhHBHHHH"
+REC_SIZE = struct.calcsize(REC_FMT)   # 19 bytes
+NULO = -32768                         # lectura ausente (DHT falló)
+
+# Mensaje binario: cabecera (versión, n, estación) + n registros con epoch Unix
+BIN_CAB = "<BBH"
+BIN_CAB_SIZE = struct.calcsize(BIN_CAB)
+EPOCH_UNIX = 946684800 if time.localtime(0)[0] == 2000 else 0   # el RTC del ESP32 cuenta desde 2000
+_msg_bin = bytearray(BIN_CAB_SIZE + BATCH_MAX * REC_SIZE)
+
+
+def empaquetar(secs, temp, hum, mq_raw, air, stats=None):
+    mn, mx, media, std = stats or (mq_raw, mq_raw, mq_raw, 0)
+    return struct.pack(REC_FMT, int(secs),
+                       NULO if temp is None else int(round(temp * 10)),
+                       NULO if hum is None else int(round(hum * 10)),
+                       mq_raw, air, mn, mx, int(round(media)), int(round(std * 10)))
+
+
+def registro_a_dict(rec):
+    secs, t, h, mq_raw, air, mn, mx, media, std = struct.unpack(REC_FMT, rec)
+    fecha, hora, _ = obtener_hora_gt(secs)
+    return {
+        "Fecha": fecha,
+        "Hora": hora,
+        "temperatura": None if t == NULO else t / 10,
+        "humedad": None if h == NULO else h / 10,
+        "mq8_raw": mq_raw,
+        "calidadAire": air,
+        "mq8_min": mn,
+        "mq8_max": mx,
+        "mq8_media": media,
+        "mq8_std": std / 10,
+        "estacion": ESTACION_ID
+    }
+
+
+def empaquetar_lote(lote):
+    """Registros del Almacen → mensaje binario en un buffer preasignado (memoryview, sin copias extra)."""
+    struct.pack_into(BIN_CAB, _msg_bin, 0, 2, len(lote), ESTACION_ID)
+    off = BIN_CAB_SIZE
+    for rec in lote:
+        _msg_bin[off:off + REC_SIZE] = rec
+        struct.pack_into("<I", _msg_bin, off, struct.unpack_from("<I", rec)[0] + EPOCH_UNIX)
+        off += REC_SIZE
+    return memoryview(_msg_bin)[:off]
+
+
+class Almacen:
+    """Cola FIFO de registros pendientes de publicar.
+    - RAM: anillo de RAM_SLOTS registros en un bytearray preasignado.
+    - Flash: con la RAM llena se escribe el bloque entero al final del segmento abierto; los segmentos
+      solo crecen y se borran enteros cuando ya se enviaron (ninguna reescritura en sitio).
+    - Entrega al menos una vez: tras un reinicio el segmento a medio enviar se reenvía completo
+      (el dashboard descarta duplicados por (ts, estación)). No se persiste el puntero de lectura.
+    - Hora: lo registrado antes del primer NTP lleva la hora del RTC (2000) y no se publica hasta
+      sincronizar. Al sincronizar se corrige en RAM y, como los segmentos no se reescriben, el desfase
+      de los de esta sesión se guarda junto a ellos (NNNN.dt) y se aplica al leerlos."""
+    def __init__(self, slots=RAM_SLOTS, carpeta=FLASH_DIR):
+        self.buf = bytearray(slots * REC_SIZE)
+        self.slots = slots
+        self.ini = 0
+        self.n = 0
+        self.carpeta = carpeta
+        try:
+            os.mkdir(carpeta)
+        except OSError:
+            pass
+        archivos = os.listdir(carpeta)
+        self.segs = sorted(int(f[:-4]) for f in archivos if f.endswith(".bin"))
+        self.en_flash = sum(self._tam(i) for i in self.segs) // REC_SIZE
+        self.desfases = {}       # segmento → s a sumar a sus registros sin hora
+        for f in archivos:
+            if f.endswith(".dt"):
+                try:
+                    with open(self._ruta(int(f[:-3]), ".dt")) as g:
+                        self.desfases[int(f[:-3])] = int(g.read())
+                except (OSError, ValueError):
+                    pass
+        self.sesion = []         # segmentos abiertos desde este arranque
+        self.leidos = 0          # registros ya enviados del segmento más viejo
+        self.abierto = None      # segmento de esta sesión que admite más bloques
+        self.descartados = 0
+
+    def _ruta(self, i, ext=".bin"):
+        return "{}/{:04d}{}".format(self.carpeta, i, ext)
+
+    def _tam(self, i):
+        return os.stat(self._ruta(i))[6]
+
+    def pendientes(self):
+        return self.en_flash + self.n
+
+    def agregar(self, rec):
+        if self.n == self.slots:
+            self._volcar()
+        i = (self.ini + self.n) % self.slots * REC_SIZE
+        self.buf[i:i + REC_SIZE] = rec
+        self.n += 1
+
+    def _volcar(self):
+        # Un segmento nuevo por sesión: no se añade tras una posible cola truncada por un corte de luz
+        if self.abierto is None or self._tam(self.abierto) >= FLASH_SEG_RECS * REC_SIZE:
+            self.abierto = self.segs[-1] + 1 if self.segs else 0
+            self.segs.append(self.abierto)
+            self.sesion.append(self.abierto)
+        mv = memoryview(self.buf)
+        a = self.ini * REC_SIZE
+        b = (self.ini + self.n) % self.slots * REC_SIZE
+        with open(self._ruta(self.abierto), "ab") as f:
+            if a < b:
+                f.write(mv[a:b])
+            else:
+                f.write(mv[a:])
+                f.write(mv[:b])
+        self.en_flash += self.n
+        self.ini = 0
+        self.n = 0
+        while len(self.segs) > FLASH_MAX_SEGS:
+            self.descartados += self._tam(self.segs[0]) // REC_SIZE - self.leidos
+            self._borrar_primero()
+
+    def _borrar_primero(self):
+        i = self.segs.pop(0)
+        self.en_flash -= max(0, self._tam(i) // REC_SIZE - self.leidos)
+        os.remove(self._ruta(i))
+        if self.desfases.pop(i, None) is not None:
+            try:
+                os.remove(self._ruta(i, ".dt"))
+            except OSError:
+                pass
+        self.leidos = 0
+        if i == self.abierto:
+            self.abierto = None
+
+    def corregir_hora(self, delta):
+        # Lecturas tomadas antes del primer NTP (RTC en 2000): en RAM se desplazan en bloque;
+        # en flash el desfase queda al lado de cada segmento de esta sesión
+        delta = int(delta)
+        for k in range(self.n):
+            i = (self.ini + k) % self.slots * REC_SIZE
+            secs = struct.unpack_from("<I", self.buf, i)[0]
+            if not hora_valida(secs):
+                struct.pack_into("<I", self.buf, i, secs + delta)
+        for i in self.sesion:
+            if i in self.segs and i not in self.desfases:
+                self.desfases[i] = delta
+                try:
+                    with open(self._ruta(i, ".dt"), "w") as f:
+                        f.write(str(delta))
+                except OSError as e:
+                    print("No se guardó el desfase:", e)
+
+    def _fechar(self, recs, delta):
+        # los registros sin hora salen con el desfase; sin desfase (aún sin NTP) se corta ahí: esperan
+        for k in range(len(recs)):
+            secs = struct.unpack_from("<I", recs[k])[0]
+            if not hora_valida(secs):
+                if delta is None:
+                    return recs[:k]
+                rec = bytearray(recs[k])
+                struct.pack_into("<I", rec, 0, secs + delta)
+                recs[k] = bytes(rec)
+        return recs
+
+    def lote(self, maximo):
+        """Hasta `maximo` registros más antiguos (flash antes que RAM), sin quitarlos y ya con la hora corregida.
+        Vacío si el más antiguo aún no tiene hora (antes del primer NTP)."""
+        while self.segs:
+            i = self.segs[0]
+            with open(self._ruta(i), "rb") as f:
+                f.seek(self.leidos * REC_SIZE)
+                datos = f.read(maximo * REC_SIZE)
+            completos = len(datos) // REC_SIZE   # ignora una cola truncada
+            if completos:
+                recs = [datos[k * REC_SIZE:(k + 1) * REC_SIZE] for k in range(completos)]
+                if (i not in self.sesion and i not in self.desfases
+                        and not hora_valida(struct.unpack_from("<I", recs[0])[0])):
+                    # de un arranque anterior que nunca sincronizó: no hay con qué fecharlo
+                    self.descartados += self._tam(i) // REC_SIZE - self.leidos
+                    self._borrar_primero()
+                    continue
+                return self._fechar(recs, self.desfases.get(i))
+            self._borrar_primero()
+        out = []
+        for k in range(min(maximo, self.n)):
+            i = (self.ini + k) % self.slots * REC_SIZE
+            out.append(bytes(self.buf[i:i + REC_SIZE]))
+        return self._fechar(out, None)
+
+    def confirmar(self, k):
+        """Quita los primeros k registros del último lote (ya publicados)."""
+        if not k:
+            return
+        if self.segs:
+            self.leidos += k
+            self.en_flash -= k
+            if self.leidos * REC_SIZE + REC_SIZE > self._tam(self.segs[0]):
+                self._borrar_primero()
+        else:
+            self.ini = (self.ini + k) % self.slots
+            self.n -= k
+
+
+def drenar(almacen, enlace, maximo=DRAIN_BURST):
+    """Publica una ráfaga de pendientes; solo se confirma lo que se publicó sin error.
+    Binario: un mensaje con hasta BATCH_MAX registros (espera a tener BATCH_MIN)."""
+    minimo = BATCH_MIN if FORMATO_BIN else 1
+    if almacen.pendientes() < minimo or not enlace.listo(espera_wifi=0):
+        return 0
+    enviados = 0
+    try:
+        if FORMATO_BIN:
+            lote = almacen.lote(BATCH_MAX)
+            if not lote:
+                return 0   # lo más antiguo aún sin hora: un mensaje solo con cabecera no sirve de nada
+            enlace.mqtt.publish(MQTT_TOPIC_BIN, empaquetar_lote(lote))
+            enviados = len(lote)
+        else:
+            for rec in almacen.lote(maximo):
+                enlace.mqtt.publish(MQTT_TOPIC, ujson.dumps(registro_a_dict(rec)))
+                enviados += 1
+    except Exception as e:
+        enlace.caido(e)
+    almacen.confirmar(enviados)
+    return enviados
 
 
 # ===============================================================
-# ✅ LOOP PRINCIPAL
+# ✅ PLANIFICADOR
 # ===============================================================
-def main():
-    print("ESP32 Estación Meteorológica – LECTURA REAL")
-    conectar_wifi()
-    sincronizar_hora()
-    mqtt = conectar_mqtt()
+# Reloj con resolución sub-segundo si el port la tiene (time.time() de MicroPython es entero)
+_ahora = (lambda: time.time_ns() / 1e9) if hasattr(time, "time_ns") else time.time
 
-    while True:
-        esperar_minuto_exact()  # sincronizado GT
 
-        temp, hum = leer_dht11()
-        mq_raw, air = leer_mq8()
-        fecha, hora, _ = obtener_hora_gt()
+def dormir_ligero(s):
+    # lightsleep apaga CPU y radio y despierta con la alarma del RTC; si el AP nos suelta,
+    # el siguiente publish falla y Enlace reconecta con backoff
+    if USAR_LIGHTSLEEP and s >= LIGHTSLEEP_MIN_S and hasattr(machine, "lightsleep"):
+        machine.lightsleep(int(s * 1000) + 1)   # redondeo hacia arriba: no despertar 1 ms antes
+    else:
+        time.sleep(s)
+
+
+class Tarea:
+    def __init__(self, nombre, periodo, fn, fase=0):
+        self.nombre = nombre
+        self.periodo = periodo
+        self.fn = fn              # fn(plazo): plazo = instante de la rejilla que toca
+        self.fase = fase
+        self.proximo = 0
+        self.corridas = 0
+        self.saltadas = 0
+        self.errores = 0
+
+    def siguiente(self, t):
+        # primer instante de la rejilla estrictamente posterior a t
+        return ((t - self.fase) // self.periodo + 1) * self.periodo + self.fase
+
+
+class Planificador:
+    """Tareas periódicas por plazos absolutos: el próximo plazo se calcula una vez al terminar
+    cada tarea y entre plazos el equipo duerme. Una tarea atrasada corre tarde pero no se pierde
+    su turno; los turnos que pasaron enteros se saltan (no se recuperan lecturas viejas).
+    Una excepción en una tarea se cuenta (Tarea.errores) y el planificador sigue.
+    reloj/dormir se inyectan para simularlo en el PC (ver simulador_host.py)."""
+    def __init__(self, reloj=None, dormir=None):
+        self.reloj = reloj or _ahora
+        self.dormir = dormir or dormir_ligero
+        self.tareas = []
+        self.dormido = 0.0
+        self.despertares = 0
+
+    def agregar(self, nombre, periodo, fn, fase=0):
+        t = Tarea(nombre, periodo, fn, fase)
+        t.proximo = t.siguiente(self.reloj())
+        self.tareas.append(t)
+        return t
+
+    def reajustar(self):
+        # tras ajustar el RTC (NTP) los plazos viejos no valen: se recalculan sin contar saltos
+        ahora = self.reloj()
+        for t in self.tareas:
+            t.proximo = t.siguiente(ahora)
+
+    def paso(self, ocioso=None):
+        """Corre lo vencido y duerme hasta el próximo plazo.
+        ocioso() → True si queda trabajo (vaciar pendientes): entonces solo se cede un momento."""
+        ahora = self.reloj()
+        for t in self.tareas:
+            if t.proximo - ahora > t.periodo:   # el RTC retrocedió: se recalcula
+                t.proximo = t.siguiente(ahora)
+            if t.proximo <= ahora + 0.001:
+                # una tarea que falla (flash llena, driver) pierde su turno, no el planificador
+                try:
+                    t.fn(t.proximo)
+                except Exception as e:
+                    t.errores += 1
+                    print("Tarea", t.nombre, "falló:", e)
+                t.corridas += 1
+                ahora = self.reloj()
+                sig = t.siguiente(ahora)
+                t.saltadas += max(0, int((sig - t.proximo) // t.periodo) - 1)
+                t.proximo = sig
+        espera = min(t.proximo for t in self.tareas) - self.reloj()
+        if ocioso and ocioso():
+            espera = min(espera, 0.2)
+        if espera > 0:
+            self.dormir(espera)
+            self.dormido += espera
+            self.despertares += 1
 
-        data = {
-            "Fecha": fecha,
-            "Hora": hora,
-            "temperatura": temp,
-            "humedad": hum,
-            "mq8_raw": mq_raw,
-            "calidadAire": air,
-            "estacion": ESTACION_ID
-        }
 
-        print("Enviado:", ujson.dumps(data))
+# ===============================================================
+# ✅ LECTURAS REALES
+# ===============================================================
+def leer_dht11(reintentos=DHT_REINTENTOS):
+    # Los errores de checksum del DHT11 son transitorios: se reintenta respetando su pausa mínima
+    for k in range(reintentos):
+        if k:
+            time.sleep(DHT_PAUSA_S)
+        try:
+            dht_sensor.measure()
+            temp = dht_sensor.temperature()
+            hum  = dht_sensor.humidity()
+            if DHT_RANGO_T[0] <= temp <= DHT_RANGO_T[1] and DHT_RANGO_H[0] <= hum <= DHT_RANGO_H[1]:
+                return temp, hum
+            print("DHT fuera de rango:", temp, hum)
+        except Exception as e:
+            print("Error DHT:", e)
+    return None, None
+
+
+# Ráfaga del MQ-8 en un buffer preasignado: filtrar no crea listas en cada muestra
+_rafaga = array("H", bytes(2 * MQ8_RAFAGA))
+
+
+def leer_rafaga_mq8(buf=_rafaga):
+    for i in range(len(buf)):
+        buf[i] = mq8_adc.read()
+        time.sleep_us(MQ8_RAFAGA_US)
+    return buf
+
+
+def ordenar(buf):
+    # inserción en sitio (array no tiene sort en MicroPython); n pequeño
+    for i in range(1, len(buf)):
+        v = buf[i]
+        j = i - 1
+        while j >= 0 and buf[j] > v:
+            buf[j + 1] = buf[j]
+            j -= 1
+        buf[j + 1] = v
+
+
+def media_recortada(buf, recorte):
+    """buf ordenado: media sin las `recorte` lecturas de cada extremo (recorte=0 → media,
+    recorte=(n-1)//2 → mediana). Quita los picos del ADC sin el sesgo de promediarlos."""
+    s = 0
+    for i in range(recorte, len(buf) - recorte):
+        s += buf[i]
+    return s / (len(buf) - 2 * recorte)
+
+
+def calidad_aire(adc_val):
+    # Bandas de "calidad de aire" sobre el ADC calibrado (umbrales configurables por MQTT)
+    v = adc_val * CONFIG["mq8_ganancia"] + CONFIG["mq8_offset"]
+    calidades = CONFIG["calidades"]
+    for i, u in enumerate(CONFIG["umbrales_mq8"]):
+        if v < u:
+            return calidades[i]
+    return calidades[-1]
+
+
+class Muestreo:
+    """Cada sensor a su propia tasa. El registro lleva la última lectura válida del DHT y el
+    MQ-8 filtrado (media recortada por ráfaga + EMA entre ráfagas), más mínimo/máximo/media/
+    desviación de las lecturas crudas desde el registro anterior.
+    Con CONFIG["rbe"] solo se registra si algo sale de su banda muerta, si la calidad del aire
+    cambia de banda (en la misma ráfaga, sin esperar al minuto) o si toca el latido."""
+    def __init__(self, almacen, enlace):
+        self.almacen = almacen
+        self.enlace = enlace
+        self.temp = None
+        self.hum = None
+        self.mq_ema = None
+        self.publicado = None     # (temp, hum, mq_raw, air, plazo) del último registro
+        self.tarea_mq8 = None
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self.mq_n = 0
+        self.mq_suma = 0
+        self.mq_suma2 = 0
+        self.mq_min = 4095
+        self.mq_max = 0
+
+    def dht(self, plazo):
+        temp, hum = leer_dht11()
+        if temp is not None:
+            temp += CONFIG["temp_offset"]
+            hum += CONFIG["hum_offset"]
+        self.temp, self.hum = temp, hum
+
+    def mq8(self, plazo):
+        buf = leer_rafaga_mq8()
+        for v in buf:
+            self.mq_suma += v
+            self.mq_suma2 += v * v
+            if v < self.mq_min:
+                self.mq_min = v
+            if v > self.mq_max:
+                self.mq_max = v
+        self.mq_n += len(buf)
+        ordenar(buf)
+        v = media_recortada(buf, MQ8_RECORTE)
+        self.mq_ema = v if self.mq_ema is None else self.mq_ema + MQ8_EMA_ALFA * (v - self.mq_ema)
+
+        t = self.tarea_mq8
+        if t is not None and t.periodo != CONFIG["periodo_mq8_s"]:
+            t.periodo = CONFIG["periodo_mq8_s"]   # el próximo plazo ya sale con el periodo nuevo
+        p = self.publicado
+        if CONFIG["rbe"] and p is not None:
+            mq_raw = int(self.mq_ema + 0.5)
+            # la banda muerta hace de histéresis: oscilar junto a un umbral no dispara alertas
+            if calidad_aire(mq_raw) != p[3] and abs(mq_raw - p[2]) >= CONFIG["banda_mq8"]:
+                self.registrar(plazo, "umbral")
+
+    def estadisticas(self):
+        if not self.mq_n:
+            return None
+        media = self.mq_suma / self.mq_n
+        return self.mq_min, self.mq_max, media, math.sqrt(max(0, self.mq_suma2 / self.mq_n - media * media))
+
+    def _motivo(self, plazo):
+        p = self.publicado
+        if p is None:
+            return "inicio"
+        if plazo - p[4] >= CONFIG["latido_s"]:
+            return "latido"
+        for actual, previo, banda in ((self.temp, p[0], CONFIG["banda_temp"]), (self.hum, p[1], CONFIG["banda_hum"])):
+            if (actual is None) != (previo is None) or actual is not None and abs(actual - previo) >= banda:
+                return "dht"
+        if abs(int(self.mq_ema + 0.5) - p[2]) >= CONFIG["banda_mq8"]:
+            return "mq8"
+        return None
 
-        if mqtt:
-            mqtt.publish("umes/clima", ujson.dumps(data))
+    def minuto(self, plazo):
+        if self.mq_ema is None:   # aún sin ráfagas (arranque): una ahora
+            self.mq8(plazo)
+        motivo = self._motivo(plazo) if CONFIG["rbe"] else "minuto"
+        if motivo:
+            self.registrar(plazo, motivo)
+
+    def registrar(self, plazo, motivo):
+        mq_raw = int(self.mq_ema + 0.5)
+        air = calidad_aire(mq_raw)
+        stats = self.estadisticas()
+        self._reiniciar()
+        # marca de tiempo = plazo de la rejilla, no la hora en que terminó de correr
+        self.almacen.agregar(empaquetar(plazo, self.temp, self.hum, mq_raw, air, stats))
+        self.publicado = (self.temp, self.hum, mq_raw, air, plazo)
+
+        print("Lectura (" + motivo + "):", obtener_hora_gt(int(plazo))[1], "T", self.temp, "H", self.hum, "MQ8", mq_raw, "Aire", air)
+        enviados = drenar(self.almacen, self.enlace)
+        if self.almacen.pendientes():
+            print("Enviadas:", enviados, "| pendientes:", self.almacen.pendientes(), "| descartadas:", self.almacen.descartados)
 
         if led:
             led.on()
             time.sleep(0.2)
             led.off()
 
-        # Evitar doble envío en segundo 00
-        time.sleep(1.2)
+
+def crear_planificador(almacen, enlace, reloj=None, dormir=None):
+    m = Muestreo(almacen, enlace)
+    plan = Planificador(reloj, dormir)
+    m.tarea_mq8 = plan.agregar("mq8", CONFIG["periodo_mq8_s"], m.mq8, FASE_MQ8_S)
+    plan.agregar("dht", PERIODO_DHT_S, m.dht, FASE_DHT_S)
+    plan.agregar("registro", PERIODO_REGISTRO_S, m.minuto)
+    plan.agregar("config", PERIODO_CONFIG_S, lambda plazo: enlace.revisar())
+    enlace.al_sincronizar = lambda delta: (almacen.corregir_hora(delta), plan.reajustar())
+    return plan
+
+
+# ===============================================================
+# ✅ LOOP PRINCIPAL
+# ===============================================================
+def main():
+    print("ESP32 Estación Meteorológica – LECTURA REAL")
+    cargar_config()
+    almacen = Almacen()
+    enlace = Enlace()
+    plan = crear_planificador(almacen, enlace)   # también engancha la corrección de hora tras NTP
+    print("Pendientes en flash:", almacen.pendientes())
+    enlace.listo(espera_wifi=20)
+
+    # el minuto GT coincide con el UTC (desfase de horas enteras): la rejilla va sobre el RTC
+    while True:
+        plan.paso(ocioso=lambda: drenar(almacen, enlace) and almacen.pendientes())
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# simulador_host.py – corre el firmware (main.py) en el PC con un reloj simulado
+# Uso: python simulador_host.py [--horas 24] [--dht-lento 2.5] [--estricto]
+# Reemplaza machine/network/umqtt/ntptime/dht por imitaciones; el tiempo solo avanza cuando
+# el firmware duerme o un sensor tarda, así que un día entero se simula en segundos.
+
+import argparse, calendar, json, os, shutil, struct, sys, tempfile, time, types
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+T_REAL = 1760000000 - 1760000000 % 60 + 17   # arranque a media minuto (2025-10-09)
+
+
+class Reloj:
+    def __init__(self, t):
+        self.t = float(t)
+        self.ligero = 0.0      # s en lightsleep
+        self.despierto = 0.0   # s con la CPU corriendo (time.sleep y trabajo)
+        self.saltos = 0.0      # ajustes del RTC por NTP (no son tiempo transcurrido)
+
+    def ahora(self):
+        return self.t
+
+    def sleep(self, s):
+        self.t += s
+        self.despierto += s
+
+    def lightsleep(self, ms):
+        self.t += ms / 1000
+        self.ligero += ms / 1000
+
+    def ajustar(self, delta):
+        self.t += delta
+        self.saltos += delta
+
+    def transcurrido(self, t0):
+        return self.t - self.saltos - t0
+
+    def localtime(self, secs=None):
+        return time.gmtime(self.t if secs is None else secs)
+
+
+def instalar_imitaciones(reloj, red, dht_lento):
+    m = types.ModuleType("machine")
+
+    class Pin:
+        IN = OUT = 0
+        def __init__(self, *a): pass
+        def on(self): pass
+        def off(self): pass
+
+    class ADC:
+        ATTN_11DB = WIDTH_12BIT = 0
+        def __init__(self, *a): pass
+        def atten(self, *a): pass
+        def width(self, *a): pass
+        k = 0
+        def read(self):
+            # ~1200 con ruido; 1 de cada 40 lecturas es un pico a fondo de escala
+            if red.get("adc_falla"):
+                red["adc_falla"] -= 1
+                raise OSError("ADC")
+            ADC.k += 1
+            return 4095 if ADC.k % 40 == 0 else red.get("mq_base", 1150) + ADC.k * 37 % 101
+
+    m.Pin, m.ADC, m.lightsleep = Pin, ADC, reloj.lightsleep
+
+    n = types.ModuleType("network"); n.STA_IF = 0
+
+    class WLAN:
+        def __init__(self, *a): pass
+        def active(self, *a): pass
+        def connect(self, *a): pass
+        def isconnected(self): return red["wifi"]
+        def ifconfig(self): return ("10.0.0.2",)
+
+    n.WLAN = WLAN
+
+    us = types.ModuleType("umqtt.simple")
+
+    class MQTTClient:
+        def __init__(self, *a, **k): self.cb = self.pendiente = None
+        def connect(self): pass
+        def disconnect(self): pass
+        def set_callback(self, cb): self.cb = cb
+        def subscribe(self, topic): self.pendiente = red.get("retenido")
+        def check_msg(self):
+            if not red["wifi"]:
+                raise OSError("sin red")
+            if self.pendiente:
+                msg, self.pendiente = self.pendiente, None
+                self.cb(b"config", msg)
+        def publish(self, topic, msg):
+            if not red["wifi"]:
+                raise OSError("sin red")
+            reloj.sleep(0.05)
+            if time.gmtime(reloj.t)[0] < 2024:
+                red["antes_ntp"] = red.get("antes_ntp", 0) + 1
+            if topic.endswith("/bin"):
+                red["pub"] += desempaquetar(bytes(msg), red)   # copia: el firmware reutiliza el buffer
+            else:
+                red["pub"].append(json.loads(msg))
+
+    us.MQTTClient = MQTTClient
+
+    nt = types.ModuleType("ntptime")
+    def settime():
+        if red.get("ntp_falla"):
+            raise OSError("ETIMEDOUT")
+        reloj.ajustar(red.pop("salto_ntp", 0))
+
+    nt.settime = settime
+
+    dh = types.ModuleType("dht")
+
+    class DHT11:
+        def __init__(self, p): self.k = 0
+        def measure(self):
+            self.k += 1
+            reloj.sleep(dht_lento)
+            if self.k % 97 == 0:
+                raise OSError("ETIMEDOUT")
+        def temperature(self): return 20 + self.k // 180 % 5   # cambia cada ~3 h
+        def humidity(self): return 50
+
+    dh.DHT11 = DHT11
+    sys.modules.update({"machine": m, "network": n, "umqtt": types.ModuleType("umqtt"),
+                        "umqtt.simple": us, "ntptime": nt, "dht": dh, "ujson": json})
+
+
+# Formato binario tal como lo lee el dashboard (decode_mqtt_binario): cabecera <BBH (versión, n, estación)
+# y n registros según la versión; epoch Unix, temp/hum ×10 con -32768 = ausente
+BIN_REGS = {1: "<IhhHB", 2: "<IhhHBHHHH"}
+
+
+def desempaquetar(msg, red):
+    """Lote binario → los mismos dicts que publicaría el firmware en JSON (Fecha/Hora en hora de Guatemala)."""
+    version, n, est = struct.unpack_from("<BBH", msg)
+    fmt = BIN_REGS.get(version)
+    if n == 0:
+        red["bin_vacios"] = red.get("bin_vacios", 0) + 1
+        return []
+    if fmt is None or len(msg) != 4 + n * struct.calcsize(fmt):
+        red["bin_invalidos"] = red.get("bin_invalidos", 0) + 1
+        return []
+    out = []
+    for ep, t, h, mq_raw, air, *_ in struct.iter_unpack(fmt, msg[4:]):
+        gt = time.gmtime(ep - 6 * 3600)
+        out.append({"Fecha": time.strftime("%Y-%m-%d", gt), "Hora": time.strftime("%H:%M:%S", gt),
+                    "temperatura": None if t == -32768 else t / 10, "humedad": None if h == -32768 else h / 10,
+                    "mq8_raw": mq_raw, "calidadAire": air, "estacion": est})
+    return out
+
+
+def cargar_firmware(reloj):
+    sys.path.insert(0, AQUI)
+    import main as fw
+    # el firmware ve el reloj simulado como RTC en UTC
+    fw.time = types.SimpleNamespace(time=reloj.ahora, time_ns=lambda: int(reloj.t * 1e9),
+                                    sleep=reloj.sleep, sleep_us=lambda us: reloj.sleep(us / 1e6), localtime=reloj.localtime, mktime=calendar.timegm)
+    fw._ahora = reloj.ahora
+    fw.print = lambda *a, **k: None
+    fw.CONFIG_FILE = os.path.join(tempfile.gettempdir(), "sim_config.json")
+    return fw
+
+
+def simular(fw, reloj, segundos, carpeta, eventos=(), red=None):
+    """Corre el loop principal hasta `segundos` simulados; eventos: [(t_rel, fn)].
+    red["flash_falla"] = n: los n próximos volcados a flash fallan (sistema de archivos lleno)."""
+    almacen = fw.Almacen(carpeta=carpeta)
+    volcar = almacen._volcar
+    def _volcar():
+        if red and red.get("flash_falla"):
+            red["flash_falla"] -= 1
+            raise OSError(28, "ENOSPC")
+        volcar()
+    almacen._volcar = _volcar
+    enlace = fw.Enlace()
+    enlace.al_sincronizar = almacen.corregir_hora
+    registros = []
+    agregar = almacen.agregar
+    almacen.agregar = lambda rec: (registros.append(struct.unpack(fw.REC_FMT, rec)), agregar(rec))
+    plan = fw.crear_planificador(almacen, enlace, reloj=reloj.ahora, dormir=fw.dormir_ligero)
+    t0 = reloj.t
+    eventos = sorted(eventos)
+    while reloj.transcurrido(t0) < segundos:
+        while eventos and reloj.transcurrido(t0) >= eventos[0][0]:
+            eventos.pop(0)[1]()
+        plan.paso(ocioso=lambda: fw.drenar(almacen, enlace) and almacen.pendientes())
+    return plan, almacen, registros, reloj.transcurrido(t0)
+
+
+def informe(nombre, plan, almacen, registros, total, reloj, red, esperados, alerta=None, fallos=None):
+    secs = [r[0] for r in registros if r[0] >= T_REAL - 86400]   # los previos al NTP se corrigen en el Almacen
+    pasos = set(b - a for a, b in zip(secs, secs[1:]))
+    tareas = {t.nombre: (t.corridas, t.saltadas) for t in plan.tareas}
+    errores = sum(t.errores for t in plan.tareas)
+    fallos = fallos or []
+    if red.get("antes_ntp"):
+        fallos.append("%d mensajes publicados antes de sincronizar la hora" % red["antes_ntp"])
+    if red.get("bin_vacios"):
+        fallos.append("%d lotes binarios vacíos (solo cabecera)" % red["bin_vacios"])
+    if red.get("bin_invalidos"):
+        fallos.append("%d mensajes binarios mal formados" % red["bin_invalidos"])
+    if errores != red.get("errores", 0):
+        fallos.append("%d tareas fallidas, se esperaban %d" % (errores, red.get("errores", 0)))
+    if alerta is None:
+        if any(s % 60 for s in secs):
+            fallos.append("registros fuera del segundo 00")
+        if pasos - {60}:
+            fallos.append("huecos entre registros: %s" % sorted(pasos - {60})[:5])
+    else:
+        # reporte por excepción: nada más largo que el latido y el cruce de umbral se publica enseguida
+        if max(pasos) > plan.config["latido_s"]:
+            fallos.append("sin latido durante %d s" % max(pasos))
+        t_alerta = T_REAL + alerta
+        tras = [r for r in registros if r[0] >= t_alerta and r[4] != registros[0][4]]
+        demora = tras[0][0] - t_alerta if tras else None
+        print("   alerta publicada a los %s s del cambio" % demora)
+        if demora is None or demora > 2 * plan.config["periodo_mq8_s"]:
+            fallos.append("alerta tardía o ausente")
+    if len(registros) < esperados:
+        fallos.append("%d registros, se esperaban %d" % (len(registros), esperados))
+    if tareas["registro"][1] and not reloj.saltos:
+        fallos.append("minutos saltados: %d" % tareas["registro"][1])
+    if almacen.pendientes():
+        fallos.append("%d pendientes sin publicar" % almacen.pendientes())
+    hs = [(p["Fecha"], p["Hora"]) for p in red["pub"]]
+    if any(p["temperatura"] is None for p in red["pub"]):
+        fallos.append("lecturas del DHT nulas pese a los reintentos")
+    if alerta is None and any(p["mq8_raw"] > 1300 for p in red["pub"]):
+        fallos.append("picos del ADC llegan al mq8_raw filtrado")
+    if any(f < "2024" for f, _ in hs):
+        fallos.append("publicaciones con la hora del RTC sin sincronizar")
+    if hs != sorted(hs) or len(set(hs)) != len(hs):
+        fallos.append("publicaciones desordenadas o duplicadas")
+    print("%-22s %5d registros | %5d publicados | lightsleep %5.1f%% | despertares/h %5.1f | tareas %s"
+          % (nombre, len(registros), len(red["pub"]), 100 * reloj.ligero / total,
+             plan.despertares * 3600 / total, tareas))
+    for f in fallos:
+        print("   FALLA:", f)
+    return not fallos
+
+
+def escenario(nombre, horas, dht_lento, inicio=T_REAL, red_ini=True, eventos=(), esperados=None, salto_ntp=0,
+              config=None, alerta=None, rechazada=False, errores=0, ajustes=None):
+    reloj = Reloj(inicio)
+    red = {"wifi": red_ini, "pub": [], "salto_ntp": salto_ntp, "retenido": config and json.dumps(config).encode(),
+           "errores": errores}
+    instalar_imitaciones(reloj, red, dht_lento)
+    sys.modules.pop("main", None)
+    fw = cargar_firmware(reloj)
+    for k, v in (ajustes or {}).items():
+        setattr(fw, k, v)
+    carpeta = tempfile.mkdtemp(prefix="sf_")
+    defecto = dict(fw.CONFIG); fallos = []
+    try:
+        ev = [(t, (lambda f=f: f(red))) for t, f in eventos]
+        plan, almacen, registros, total = simular(fw, reloj, horas * 3600, carpeta, ev, red)
+        # una config retenida inválida no se aplica ni se guarda (volvería en cada arranque)
+        if rechazada and (fw.CONFIG != defecto or os.path.exists(fw.CONFIG_FILE)):
+            fallos.append("config inválida aplicada o guardada")
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+        sys.path.remove(AQUI)
+        if os.path.exists(fw.CONFIG_FILE):
+            os.remove(fw.CONFIG_FILE)
+    if esperados is None:
+        esperados = int(horas * 60) - 1
+    plan.config = fw.CONFIG
+    return informe(nombre, plan, almacen, registros, total, reloj, red, esperados, alerta, fallos)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulación en el PC del planificador del ESP32")
+    ap.add_argument("--horas", type=float, default=24)
+    ap.add_argument("--dht-lento", type=float, default=2.5, help="s que tarda cada lectura del DHT")
+    ap.add_argument("--estricto", action="store_true", help="código de salida 1 si algo falla")
+    a = ap.parse_args()
+    h = a.horas
+    ok = [
+        escenario("con red", h, a.dht_lento),
+        escenario("corte de 3 h", max(h, 4), a.dht_lento,
+                  eventos=[(1800, lambda r: r.update(wifi=False)), (1800 + 3 * 3600, lambda r: r.update(wifi=True))]),
+        # arranque sin NTP (RTC en 2000) y sin red; al volver la red el RTC salta a la hora real
+        escenario("arranque sin hora", 2, a.dht_lento, inicio=T_REAL - 805000000, red_ini=False,
+                  eventos=[(1200, lambda r: r.update(wifi=True))], esperados=100, salto_ntp=805000000),
+        # ídem con 3 h sin red: lo anterior al NTP ya pasó de la RAM a los segmentos de flash
+        escenario("sin hora ni red 3 h", 4, a.dht_lento, inicio=T_REAL - 805000000, red_ini=False,
+                  eventos=[(3 * 3600, lambda r: r.update(wifi=True))], esperados=230, salto_ntp=805000000),
+        # reporte por excepción activado por la config retenida; a las 2 h el aire empeora de golpe
+        escenario("reporte por excepción", h, a.dht_lento, esperados=1, alerta=7203,
+                  config={"rbe": True, "periodo_mq8_s": 5, "latido_s": 600},
+                  eventos=[(7203, lambda r: r.update(mq_base=2400))]),
+        # el ADC falla en tres ráfagas seguidas y, en un corte de red, un volcado a flash: esas tareas
+        # pierden su turno (y la lectura que no cupo) y el planificador sigue
+        escenario("fallo de tareas", 2, a.dht_lento, errores=4, esperados=118,
+                  eventos=[(300, lambda r: r.update(adc_falla=3)),
+                           (600, lambda r: r.update(wifi=False, flash_falla=1)),
+                           (3000, lambda r: r.update(wifi=True))]),
+        # formato binario por lotes (FORMATO_BIN): tras el corte sale lo acumulado en lotes de BATCH_MAX
+        escenario("binario con corte", 2, a.dht_lento, ajustes={"FORMATO_BIN": True},
+                  eventos=[(1800, lambda r: r.update(wifi=False)), (3600, lambda r: r.update(wifi=True))]),
+        # binario con red pero sin NTP durante 10 min: nada sale (ni lotes vacíos) hasta tener hora
+        escenario("binario sin NTP", 2, a.dht_lento, inicio=T_REAL - 805000000, ajustes={"FORMATO_BIN": True},
+                  eventos=[(0, lambda r: r.update(ntp_falla=True)), (600, lambda r: r.update(ntp_falla=False))],
+                  esperados=110, salto_ntp=805000000),
+        # config retenida con tipos válidos por fuera pero no por dentro: umbrales de texto, calidad > 255
+        escenario("config inválida", 2, a.dht_lento, rechazada=True,
+                  config={"umbrales_mq8": ["a", "b", "c", "d"], "calidades": [100, 90, 70, 40, 300], "rbe": True}),
+    ]
+    if a.estricto and not all(ok):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()